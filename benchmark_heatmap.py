@@ -0,0 +1,433 @@
+"""
+Benchmark suite for generate_heatmap.py.
+
+Generates realistic synthetic location history files for every supported layout
+(root array, 'locations', 'semanticSegments', 'timelineObjects'), runs each phase of
+the generator on them and writes a JSON report with wall time, records/sec, peak RSS
+and output size per phase, so runs can be compared across commits.
+
+Usage:
+    python benchmark_heatmap.py --sizes 10k,100k,1M --formats all --output benchmark.json
+    python benchmark_heatmap.py --sizes 1M --set POINT_ENCODING=binary --baseline benchmark.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+# =============================================================================
+# --- BENCHMARK CONFIGURATION ---
+# =============================================================================
+
+BENCHMARK_CONFIG = {
+    "WORK_DIR": "benchmark_data",     # Synthetic inputs and generated pages are kept here between runs.
+    "SEED": 42,                       # Seed of the synthetic data; the same seed always produces the same files.
+    "START_DATE": "2015-01-01",       # First timestamp of the synthetic history.
+    "HOME": [-23.5505, -46.6333],     # Center of the synthetic history [Latitude, Longitude].
+    "INDENT": 2,                      # Indentation of the generated JSON, like real Takeout files. None = compact.
+}
+
+FORMATS = ("root_array", "locations", "semanticSegments", "timelineObjects")
+
+# =============================================================================
+# --- SYNTHETIC DATA ---
+# =============================================================================
+
+class _SyntheticTrack:
+    """
+    Random walk of a person alternating between stays at a set of places and trips
+    between them, sampled like a phone: jittery fixes while still, a fix every few
+    seconds while moving.
+    """
+
+    def __init__(self, seed, start_date, home):
+        self.random = random.Random(seed)
+        self.time = datetime.fromisoformat(start_date).replace(tzinfo=timezone.utc)
+        self.places = [
+            (home[0] + self.random.gauss(0, 0.05), home[1] + self.random.gauss(0, 0.05))
+            for _ in range(40)
+        ]
+        self.position = self.places[0]
+
+    def stay(self):
+        """Stays at a random place; returns (place, start, end)."""
+        place = self.random.choice(self.places)
+        self.position = place
+        start = self.time
+        self.time += timedelta(minutes=self.random.randint(10, 600))
+        return place, start, self.time
+
+    def trip(self, samples):
+        """Travels towards a random place; returns (start, end, [(lat, lon, time), ...]) with `samples` fixes."""
+        target = self.random.choice(self.places)
+        (lat0, lon0), start = self.position, self.time
+        fixes = []
+        for i in range(1, samples + 1):
+            f = i / samples
+            self.time += timedelta(seconds=self.random.randint(1, 10))
+            fixes.append((
+                lat0 + (target[0] - lat0) * f + self.random.gauss(0, 0.0002),
+                lon0 + (target[1] - lon0) * f + self.random.gauss(0, 0.0002),
+                self.time,
+            ))
+        self.position = target
+        return start, self.time, fixes
+
+    def fix(self):
+        """One raw GPS fix around the current position, one second after the previous one."""
+        self.time += timedelta(seconds=1)
+        if self.random.random() < 0.02: # Occasionally start moving to another place.
+            self.position = self.random.choice(self.places)
+        return (self.position[0] + self.random.gauss(0, 0.0001),
+                self.position[1] + self.random.gauss(0, 0.0001), self.time)
+
+def _iso(moment, offset_hours=-3):
+    """Timestamp in the Android export style, e.g. '2015-01-01T09:00:00.000-03:00'."""
+    local = moment.astimezone(timezone(timedelta(hours=offset_hours)))
+    return local.isoformat(timespec='milliseconds')
+
+def _iso_utc(moment):
+    """Timestamp in the legacy export style, e.g. '2015-01-01T12:00:00.000Z'."""
+    return moment.strftime('%Y-%m-%dT%H:%M:%S.') + f"{moment.microsecond // 1000:03d}Z"
+
+def _e7(value):
+    return round(value * 1e7)
+
+def _degrees(lat, lon):
+    return f"{lat:.7f}°, {lon:.7f}°"
+
+def _geo(lat, lon):
+    return f"geo:{lat:.6f},{lon:.6f}"
+
+def _locations_records(track, count):
+    for _ in range(count):
+        lat, lon, moment = track.fix()
+        record = {
+            "latitudeE7": _e7(lat),
+            "longitudeE7": _e7(lon),
+            "accuracy": track.random.randint(3, 40),
+            "source": "WIFI" if track.random.random() < 0.3 else "GPS",
+            "deviceTag": 1234567890,
+            "timestamp": _iso_utc(moment),
+        }
+        if track.random.random() < 0.1:
+            record["activity"] = [{
+                "activity": [{"type": "STILL", "confidence": 80}, {"type": "ON_FOOT", "confidence": 20}],
+                "timestamp": _iso_utc(moment),
+            }]
+        yield record
+
+def _semantic_segments_records(track, count):
+    for i in range(count):
+        kind = i % 3
+        if kind == 0:
+            (lat, lon), start, end = track.stay()
+            yield {
+                "startTime": _iso(start), "endTime": _iso(end),
+                "startTimeTimezoneUtcOffsetMinutes": -180, "endTimeTimezoneUtcOffsetMinutes": -180,
+                "visit": {
+                    "hierarchyLevel": 0, "probability": 0.9,
+                    "topCandidate": {
+                        "placeId": f"ChIJ{track.random.getrandbits(64):016x}", "semanticType": "UNKNOWN",
+                        "probability": 0.8, "placeLocation": {"latLng": _degrees(lat, lon)},
+                    },
+                },
+            }
+        elif kind == 1:
+            start, end, fixes = track.trip(2)
+            yield {
+                "startTime": _iso(start), "endTime": _iso(end),
+                "activity": {
+                    "start": {"latLng": _degrees(*fixes[0][:2])}, "end": {"latLng": _degrees(*fixes[-1][:2])},
+                    "distanceMeters": track.random.uniform(100, 20000),
+                    "topCandidate": {"type": "IN_PASSENGER_VEHICLE", "probability": 0.9},
+                },
+            }
+        else:
+            start, end, fixes = track.trip(track.random.randint(5, 30))
+            yield {
+                "startTime": _iso(start), "endTime": _iso(end),
+                "timelinePath": [{"point": _degrees(lat, lon), "time": _iso(moment)} for lat, lon, moment in fixes],
+            }
+
+def _timeline_objects_records(track, count):
+    for i in range(count):
+        if i % 2 == 0:
+            (lat, lon), start, end = track.stay()
+            yield {
+                "placeVisit": {
+                    "location": {
+                        "latitudeE7": _e7(lat), "longitudeE7": _e7(lon),
+                        "placeId": f"ChIJ{track.random.getrandbits(64):016x}",
+                        "address": "Rua Exemplo, 123, Sao Paulo", "name": "Place",
+                        "locationConfidence": 90.5,
+                    },
+                    "duration": {"startTimestamp": _iso_utc(start), "endTimestamp": _iso_utc(end)},
+                    "placeConfidence": "HIGH_CONFIDENCE", "visitConfidence": 90,
+                },
+            }
+        else:
+            start, end, fixes = track.trip(track.random.randint(3, 20))
+            yield {
+                "activitySegment": {
+                    "startLocation": {"latitudeE7": _e7(fixes[0][0]), "longitudeE7": _e7(fixes[0][1])},
+                    "endLocation": {"latitudeE7": _e7(fixes[-1][0]), "longitudeE7": _e7(fixes[-1][1])},
+                    "duration": {"startTimestamp": _iso_utc(start), "endTimestamp": _iso_utc(end)},
+                    "distance": track.random.randint(100, 20000),
+                    "activityType": "IN_PASSENGER_VEHICLE", "confidence": "HIGH",
+                    "activities": [{"activityType": "IN_PASSENGER_VEHICLE", "probability": 90.0}],
+                    "waypointPath": {"waypoints": [{"latE7": _e7(lat), "lngE7": _e7(lon)} for lat, lon, _ in fixes[::4]]},
+                    "simplifiedRawPath": {"points": [
+                        {"latE7": _e7(lat), "lngE7": _e7(lon), "accuracyMeters": 10, "timestamp": _iso_utc(moment)}
+                        for lat, lon, moment in fixes
+                    ]},
+                },
+            }
+
+def _root_array_records(track, count):
+    for i in range(count):
+        kind = i % 3
+        if kind == 0:
+            (lat, lon), start, end = track.stay()
+            yield {
+                "endTime": _iso(end), "startTime": _iso(start),
+                "visit": {"hierarchyLevel": "0", "topCandidate": {
+                    "probability": "0.9", "semanticType": "Unknown",
+                    "placeID": f"ChIJ{track.random.getrandbits(64):016x}", "placeLocation": _geo(lat, lon),
+                }},
+            }
+        elif kind == 1:
+            start, end, fixes = track.trip(2)
+            yield {
+                "endTime": _iso(end), "startTime": _iso(start),
+                "activity": {
+                    "probability": "0.9", "end": _geo(*fixes[-1][:2]), "start": _geo(*fixes[0][:2]),
+                    "distanceMeters": str(track.random.randint(100, 20000)),
+                    "topCandidate": {"type": "in passenger vehicle", "probability": "0.9"},
+                },
+            }
+        else:
+            start, end, fixes = track.trip(track.random.randint(5, 30))
+            yield {
+                "endTime": _iso(end), "startTime": _iso(start),
+                "timelinePath": [
+                    {"point": _geo(lat, lon), "durationMinutesOffsetFromStartTime": str(int((moment - start).total_seconds() // 60))}
+                    for lat, lon, moment in fixes
+                ],
+            }
+
+RECORD_GENERATORS = {
+    "root_array": _root_array_records,
+    "locations": _locations_records,
+    "semanticSegments": _semantic_segments_records,
+    "timelineObjects": _timeline_objects_records,
+}
+
+def write_synthetic_file(path, format_name, count, config=BENCHMARK_CONFIG):
+    """
+    Streams `count` synthetic records of `format_name` to `path`, one at a time, so
+    files of any size can be generated in constant memory.
+    """
+    track = _SyntheticTrack(config["SEED"], config["START_DATE"], config["HOME"])
+    indent = config["INDENT"]
+    pad = " " * (indent or 0)
+    newline = "\n" if indent else ""
+
+    def dump(record):
+        text = json.dumps(record, indent=indent, ensure_ascii=False)
+        # Indent the record one level deeper, as an item of the enclosing array.
+        return text.replace("\n", "\n" + pad * (1 if format_name == "root_array" else 2))
+
+    temp_path = path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8', buffering=1024 * 1024) as f:
+        if format_name == "root_array":
+            f.write("[" + newline)
+            item_pad = pad
+        else:
+            f.write("{" + newline + pad + json.dumps(format_name) + ": [" + newline)
+            item_pad = pad * 2
+        for i, record in enumerate(RECORD_GENERATORS[format_name](track, count)):
+            f.write(("," + newline if i else "") + item_pad + dump(record))
+        if format_name == "root_array":
+            f.write(newline + "]" + newline)
+        else:
+            # Real Android exports carry other top-level keys after the segments.
+            extra = ',' + newline + pad + '"rawSignals": []' if format_name == "semanticSegments" else ""
+            f.write(newline + pad + "]" + extra + newline + "}" + newline)
+    os.replace(temp_path, path)
+
+def _parse_size(text):
+    """Parses record counts such as '10k', '2.5M' or '50000'."""
+    text = text.strip().lower()
+    multiplier = {"k": 1_000, "m": 1_000_000}.get(text[-1:], 1)
+    return int(float(text.rstrip("km")) * multiplier)
+
+def _size_label(count):
+    for suffix, unit in (("M", 1_000_000), ("k", 1_000)):
+        if count >= unit and count % unit == 0:
+            return f"{count // unit}{suffix}"
+    return str(count)
+
+# =============================================================================
+# --- MEASUREMENT ---
+# =============================================================================
+
+def _import_generator():
+    """Imports generate_heatmap from the directory of this script."""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import generate_heatmap
+    return generate_heatmap
+
+def run_case(input_file, records, overrides, work_dir):
+    """
+    Runs every phase of the generator on `input_file` in this process and returns the
+    measurements. Meant to run in a fresh process per case, so peak RSS is the case's own.
+    """
+    generate_heatmap = _import_generator()
+
+    config = generate_heatmap.make_config({
+        "JSON_INPUT_FILE": input_file,
+        "HTML_OUTPUT_FILE": os.path.join(work_dir, "benchmark_output.html"),
+        "CACHE_DIR": None,
+        "AUTO_OPEN_IN_BROWSER": False,
+    }, **overrides)
+
+    # The generator meters its own phases; load_aggregated_points takes the same extraction
+    # path as a real run (binning while parsing under MEMORY_LIMIT_MB or PIPELINE).
+    metrics = generate_heatmap.METRICS = generate_heatmap.RunMetrics()
+    with contextlib.redirect_stdout(io.StringIO()): # The generator's own progress output.
+        point_count, points = generate_heatmap.load_aggregated_points(config)
+        if points:
+            generate_heatmap.create_html_file(config, points)
+    phases = [
+        {"phase": phase["phase"], "wall_time_s": phase["elapsed_s"], "peak_rss_mb": phase.get("peak_rss_mb")}
+        for phase in metrics.report()["phases"]
+    ]
+
+    extract_time = sum(phase["wall_time_s"] for phase in phases if phase["phase"] == "extract")
+    return {
+        "records": records,
+        "points": point_count,
+        "weighted_points": len(points) if points else 0,
+        "input_size_bytes": os.path.getsize(input_file),
+        "html_size_bytes": os.path.getsize(config["HTML_OUTPUT_FILE"]) if points else None,
+        "records_per_s": round(records / extract_time) if extract_time else None,
+        "wall_time_s": round(sum(phase["wall_time_s"] for phase in phases), 4),
+        "peak_rss_mb": generate_heatmap._peak_rss_mb(),
+        "phases": phases,
+        "parsers": metrics.report()["parsers"],
+    }
+
+def _git_commit():
+    """Commit hash of the working tree, if it is a git checkout."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _compare(report, baseline):
+    """Prints the change of each case's wall time and peak RSS against a baseline report."""
+    previous = {(r["format"], r["records"]): r for r in baseline["results"]}
+    print(f"\n[INFO] Comparison with baseline commit {baseline['meta'].get('commit')}:")
+    for result in report["results"]:
+        old = previous.get((result["format"], result["records"]))
+        if not old or "error" in old or "error" in result: continue
+        time_change = (result["wall_time_s"] / old["wall_time_s"] - 1) * 100 if old["wall_time_s"] else 0
+        line = f"  > {result['format']:>16} {_size_label(result['records']):>5}: wall time {time_change:+6.1f}%"
+        if result["peak_rss_mb"] and old["peak_rss_mb"]:
+            line += f", peak RSS {(result['peak_rss_mb'] / old['peak_rss_mb'] - 1) * 100:+6.1f}%"
+        print(line)
+
+# =============================================================================
+# --- COMMAND LINE ---
+# =============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks generate_heatmap.py on synthetic location history files.")
+    parser.add_argument("--formats", default="all", help=f"Comma-separated layouts to test, or 'all' ({', '.join(FORMATS)}).")
+    parser.add_argument("--sizes", default="10k,100k", help="Comma-separated record counts, e.g. '10k,1M,50M'.")
+    parser.add_argument("--output", default="benchmark_report.json", help="Where to write the JSON report.")
+    parser.add_argument("--work-dir", default=BENCHMARK_CONFIG["WORK_DIR"], help="Directory for synthetic inputs and outputs.")
+    parser.add_argument("--seed", type=int, default=BENCHMARK_CONFIG["SEED"], help="Seed of the synthetic data.")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="Overrides a generate_heatmap CONFIG value, e.g. --set AGGREGATION_GRID=pixel or --set PIPELINE=true. Repeatable.")
+    parser.add_argument("--baseline", help="A previous report to compare this run against.")
+    parser.add_argument("--run-case", help=argparse.SUPPRESS) # Internal: runs one case in this process.
+    args = parser.parse_args()
+
+    if args.run_case:
+        case = json.loads(args.run_case)
+        print(json.dumps(run_case(case["input_file"], case["records"], case["overrides"], case["work_dir"])))
+        return
+
+    formats = FORMATS if args.formats == "all" else [name.strip() for name in args.formats.split(",")]
+    unknown = [name for name in formats if name not in FORMATS]
+    if unknown:
+        parser.error(f"unknown format(s): {', '.join(unknown)}")
+    sizes = [_parse_size(size) for size in args.sizes.split(",")]
+    # Same KEY=VALUE syntax as the generator's --set, checked before any file is generated.
+    generate_heatmap = _import_generator()
+    try:
+        overrides = generate_heatmap._parse_settings(args.set)
+        generate_heatmap.make_config(overrides)
+    except (argparse.ArgumentTypeError, KeyError, ValueError) as e:
+        parser.error(f"--set: {e.args[0]}")
+
+    config = dict(BENCHMARK_CONFIG, SEED=args.seed)
+    os.makedirs(args.work_dir, exist_ok=True)
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "seed": args.seed,
+            "overrides": overrides,
+        },
+        "results": [],
+    }
+
+    for format_name in formats:
+        for count in sizes:
+            input_file = os.path.join(args.work_dir, f"{format_name}_{_size_label(count)}_seed{args.seed}.json")
+            if not os.path.exists(input_file):
+                print(f"[INFO] Generating {count:,} synthetic '{format_name}' records in '{input_file}'...")
+                write_synthetic_file(input_file, format_name, count, config)
+
+            print(f"[INFO] Benchmarking '{format_name}' with {count:,} records...")
+            case = {"input_file": input_file, "records": count, "overrides": overrides, "work_dir": args.work_dir}
+            completed = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--run-case", json.dumps(case)],
+                capture_output=True, text=True
+            )
+            result = {"format": format_name}
+            if completed.returncode == 0:
+                result.update(json.loads(completed.stdout.strip().splitlines()[-1]))
+                print(f"  > {result['wall_time_s']:.2f} s, {result['records_per_s'] or 0:,} records/s, "
+                      f"peak RSS {result['peak_rss_mb']} MB, HTML {(result['html_size_bytes'] or 0) / 1024:,.0f} KB")
+            else:
+                result.update({"records": count, "error": completed.stderr.strip().splitlines()[-1:]})
+                print(f"  [ERROR] The case failed: {result['error']}")
+            report["results"].append(result)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n[SUCCESS] Report written to '{args.output}'.")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            _compare(report, json.load(f))
+
+if __name__ == '__main__':
+    main()
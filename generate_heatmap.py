@@ -1,9 +1,52 @@
+import abc
 import ijson
 import json
 import webbrowser
 import os
 import re
 import traceback
+import math
+import sys
+import zlib
+import base64
+import operator
+import struct
+import hashlib
+import time
+import contextlib
+import argparse
+import glob
+import gzip
+import cProfile
+import heapq
+import posixpath
+import queue
+import shutil
+import threading
+import zipfile
+import tempfile
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta, timezone
+from functools import partial, wraps
+import mmap
+import io
+from array import array
+from itertools import accumulate, chain, groupby, islice, repeat
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+try:
+    import resource
+except ImportError: # Not available on Windows; memory high-water marks are then reported as null.
+    resource = None
+
+try:
+    import zstandard
+except ImportError: # Optional: only needed to read .zst compressed exports.
+    zstandard = None
 
 # =============================================================================
 # --- GENERAL CONFIGURATION ---
@@ -12,8 +55,11 @@ import traceback
 
 CONFIG = {
     # --- File Settings ---
-    "JSON_INPUT_FILE": "Records.json", # Your Google Takeout location history file.
+    "JSON_INPUT_FILE": "Records.json", # Your Google Takeout location history file. Can also be a Takeout .zip, or a .gz or .zst file.
+    "ARCHIVE_MEMBER": None,            # File to read inside a .zip input, e.g. "Takeout/Location History/Records.json". None = found automatically.
     "HTML_OUTPUT_FILE": "heatmap.html", # The name of the HTML map file to be generated.
+    "EXPORT_FILES": [],                # e.g., ["locations.csv", "locations.geojson"]. Also writes the extracted points (with their timestamps)
+                                       # to these files, in the format of each extension: .csv, .geojson or .points (binary columns).
 
     # --- Map Display Settings ---
     "MAP_INITIAL_CENTER": [-15.793889, -47.882778], # Initial map center [Latitude, Longitude].
@@ -39,6 +85,70 @@ CONFIG = {
     "INCLUDE_ACTIVITIES": True,
     "INCLUDE_RAW_PATH": True,
 
+    # --- Trajectory Thinning Settings ---
+    # Thins dense GPS tracks while the file is parsed: a stop (consecutive points close together) collapses into
+    # one point weighted by its size, and moving stretches are simplified with the Douglas-Peucker algorithm.
+    "THINNING": False,
+    "THIN_STATIONARY_RADIUS_M": 25,   # Consecutive points within this distance of the first one form a stop...
+    "THIN_STATIONARY_MIN_STAY_S": 120, # ...if they span at least this many seconds (shorter runs are treated as moving)...
+    "THIN_STATIONARY_MAX_GAP_S": 300, # ...and no more than this many seconds pass between two of them.
+    "THIN_PATH_TOLERANCE_M": 10,      # Moving points closer than this to the simplified track are dropped. 0 keeps them all.
+    "THIN_WINDOW_POINTS": 200,        # Look-back of the track simplification: at most this many points are held at once.
+
+    # --- Aggregation Settings ---
+    # Snaps nearby points to a grid and merges them into weighted points before the HTML is generated.
+    # 'pixel' = one cell per map pixel at HEATMAP_MAX_ZOOM, a number = cell size in degrees, None = keep raw points.
+    # Off by default: at HEATMAP_MAX_ZOOM 18 a pixel is ~0.6 m, too fine to merge most real tracks.
+    "AGGREGATION_GRID": None,
+    # Builds a pyramid of coarser aggregates every PYRAMID_ZOOM_STEP zoom levels below HEATMAP_MAX_ZOOM,
+    # split into tiles, so the page only draws the level and viewport the map currently shows.
+    "ZOOM_PYRAMID": False,
+    "PYRAMID_ZOOM_STEP": 2,
+
+    # --- Raster Tile Settings ---
+    # Renders the heatmap into a {z}/{x}/{y}.png tile directory, shown as a plain tile layer, instead of
+    # embedding points: the browser's work stays constant however many points there are. The look is fixed
+    # at generation time (radius, blur, intensity and gradient), so those live controls are hidden.
+    "RASTER_TILES": False,
+    "RASTER_TILE_DIR": "heatmap_tiles", # Where the tiles are written, relative to the HTML file.
+    "RASTER_MIN_ZOOM": 0,             # Zoom levels to render; above RASTER_MAX_ZOOM the map enlarges
+    "RASTER_MAX_ZOOM": 13,            # the deepest tiles. Each extra level can quadruple the tile count.
+
+    # --- Time Slider Settings ---
+    "TIME_SLIDER": False,          # Keeps each point's timestamp and adds a date range slider to the live controls.
+    "TIME_BLOCK_PERIOD": "month",  # Granularity of the slider: 'month' or 'week' (UTC). Points are embedded in one block per period.
+
+    # --- Output Encoding Settings ---
+    "POINT_ENCODING": "json",      # How points are embedded in the page: 'json' (plain arrays) or 'binary' (delta-encoded E7 integers, base64).
+    "POINT_COMPRESSION": True,     # Deflate 'binary' payloads; the page inflates them with the browser's DecompressionStream.
+
+    # --- Cache Settings ---
+    "CACHE_DIR": ".heatmap_cache", # Extracted points are cached here per input file, so re-runs skip Phase 1. None disables the cache.
+    "CACHE_MAX_SIZE_MB": 2048,     # The least recently used cache entries are deleted beyond this total size.
+    "CACHE_REFRESH": False,        # Set to True to ignore (and overwrite) the cached points of the input file.
+
+    # --- Incremental History Settings ---
+    "HISTORY_STORE_DIR": None,     # e.g., "timeline_history". When set, each export is merged into this store (duplicates
+                                   # of earlier exports are dropped) and the heatmap shows the whole stored history.
+
+    # --- Performance Settings ---
+    "PARALLEL_WORKERS": 1,         # Processes used to parse the input file. 1 = sequential, 0 = one per CPU core.
+    "PARALLEL_SHARD_SIZE_MB": 64,  # Approximate size of the byte ranges handed to each worker process.
+    "PIPELINE": False,             # Overlaps reading, parsing, aggregation and EXPORT_FILES in threads linked by bounded queues,
+                                   # binning points as they are parsed instead of keeping them. Same heatmap; needs aggregation enabled.
+    "PIPELINE_QUEUE_CHUNKS": 8,    # How many chunks of 65,536 points the queue in front of each stage may hold.
+    "MEMORY_LIMIT_MB": None,       # e.g., 512. Bins points into AGGREGATION_GRID cells while parsing instead of keeping them all, spilling
+                                   # sorted partial aggregates to disk beyond this size. Same heatmap; needs aggregation enabled.
+    "SPILL_DIR": None,             # Where the spilled aggregates are written (and deleted afterwards). None = the system temp directory.
+
+    # --- Serve Mode Settings ---
+    "SERVE_HOST": "127.0.0.1",     # Address the 'serve' command listens on. The page then loads only the points in view.
+    "SERVE_PORT": 8000,            # Port of the 'serve' command.
+
+    # --- Metrics Settings ---
+    "METRICS_REPORT_FILE": None,   # e.g., "heatmap_metrics.json". Saves time, throughput, counters and memory per phase and per parser.
+    "PROFILE_OUTPUT_FILE": None,   # e.g., "parse.prof". Runs the parser under cProfile and saves the stats (open with 'python -m pstats').
+
     # --- Execution Settings ---
     "AUTO_OPEN_IN_BROWSER": True, # Set to True to automatically open the HTML file after generation.
 }
@@ -100,6 +210,18 @@ HTML_TEMPLATE = """
             width: 300px;
             transition: all 0.3s ease-in-out;
         }
+        #loading {
+            position: absolute;
+            bottom: 25px;
+            left: 10px;
+            z-index: 1000;
+            background-color: rgba(255, 255, 255, 0.85);
+            border-radius: 8px;
+            padding: 6px 12px;
+            box-shadow: 0 2px 10px rgba(0,0,0,0.2);
+            font-size: 14px;
+            color: #333;
+        }
         #controls-header {
             padding: 10px 15px;
             cursor: pointer;
@@ -173,36 +295,58 @@ HTML_TEMPLATE = """
                 <label for="mapStyle">Map Style</label>
                 <select id="mapStyle"></select>
             </div>
-            <div class="control-group">
+            <div class="control-group heat-option">
                 <label for="radius">Radius <span id="radiusValue" class="value-display"></span></label>
                 <input type="range" id="radius" min="1" max="50" step="1">
             </div>
-            <div class="control-group">
+            <div class="control-group heat-option">
                 <label for="blur">Blur <span id="blurValue" class="value-display"></span></label>
                 <input type="range" id="blur" min="1" max="50" step="1">
             </div>
-            <div class="control-group">
+            <div class="control-group heat-option">
                 <label for="maxIntensity">Max Intensity <span id="maxIntensityValue" class="value-display"></span></label>
                 <input type="range" id="maxIntensity" min="0.1" max="10" step="0.1">
             </div>
-            <div class="control-group">
+            <div class="control-group heat-option">
                 <label for="maxZoom">Heatmap Max Zoom <span id="maxZoomValue" class="value-display"></span></label>
                 <input type="range" id="maxZoom" min="1" max="18" step="1">
             </div>
+            <div class="control-group" id="timeControls" style="display: none;">
+                <label for="timeStart">From <span id="timeStartValue" class="value-display"></span></label>
+                <input type="range" id="timeStart" min="0" step="1">
+                <label for="timeEnd">To <span id="timeEndValue" class="value-display"></span></label>
+                <input type="range" id="timeEnd" min="0" step="1">
+            </div>
         </div>
     </div>
 
+    <div id="loading" style="display: none;">Loading points... <span id="loadingProgress"></span></div>
+
+    <!-- Point blocks: plain text, so the browser does not parse them as JavaScript, then their JSON index. -->
+%(DATA_BLOCKS)s
     <script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js" integrity="sha256-20nQCchB9co0qIjJZRGuk2/Z9VM+kNiyxNV1lvTlZBo=" crossorigin=""></script>
     <script src="https://unpkg.com/leaflet.heat@0.2.0/dist/leaflet-heat.js"></script>
     <script>
         // --- Data and Configuration Injected by Python ---
-        const locationData = %(LOCATIONS_DATA)s;
+        // Block i of the page is described by row i of the block index (null = not set).
+        const indexTag = document.getElementById('point-index');
+        const blockIndex = indexTag ? JSON.parse(indexTag.textContent) : {shared: {}, fields: [], blocks: []};
+        const dataBlocks = Array.from(document.querySelectorAll('script.point-block'), (source, i) => {
+            const block = Object.assign({source}, blockIndex.shared);
+            blockIndex.fields.forEach((field, j) => {
+                if (blockIndex.blocks[i][j] !== null) block[field] = blockIndex.blocks[i][j];
+            });
+            return block;
+        });
+        const timePeriods = %(TIME_PERIODS)s;
         const initialHeatOptions = %(HEATMAP_OPTIONS)s;
         const mapCenter = %(MAP_CENTER)s;
         const mapZoom = %(MAP_ZOOM)s;
         const initialMapStyle = '%(INITIAL_MAP_STYLE)s';
         const mapStyles = %(MAP_STYLES_JS)s;
         const mapAttributions = %(MAP_ATTRIBUTIONS_JS)s;
+        const pointsUrl = %(POINTS_URL)s;
+        const rasterTiles = %(RASTER_TILES)s;
 
         // --- Map Initialization ---
         const map = L.map('map').setView(mapCenter, mapZoom);
@@ -210,7 +354,249 @@ HTML_TEMPLATE = """
             attribution: mapAttributions[initialMapStyle],
             maxZoom: 19
         }).addTo(map);
-        const heatLayer = L.heatLayer(locationData, initialHeatOptions).addTo(map);
+        const heatLayer = L.heatLayer([], initialHeatOptions).addTo(map);
+        if (rasterTiles) {
+            // A pre-rendered heatmap: tiles without any heat were not written, so they fall back to a blank pixel.
+            L.tileLayer(rasterTiles.url, {
+                minZoom: rasterTiles.minZoom,
+                maxNativeZoom: rasterTiles.maxZoom,
+                maxZoom: 19,
+                errorTileUrl: 'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAAC0lEQVR4nGNgAAIAAAUAAXpeqz8AAAAASUVORK5CYII=',
+            }).addTo(map);
+            document.querySelectorAll('.heat-option').forEach(group => { group.style.display = 'none'; });
+        }
+
+        // --- Point Decoding ---
+        // A block's points are either a plain [[lat, lon(, weight)], ...] array or a base64
+        // string of delta-encoded int32 E7 latitude and longitude columns followed by
+        // float32 weights, optionally deflated. Both decode to a flat Float64Array of
+        // [lat, lon, weight] triples. This runs in a Web Worker, off the page's main thread.
+        async function decodePoints(payload, meta) {
+            if (meta.encoding !== 'binary') {
+                const points = typeof payload === 'string' ? JSON.parse(payload) : payload;
+                const data = new Float64Array(3 * points.length);
+                for (let i = 0; i < points.length; i++) {
+                    data[3 * i] = points[i][0];
+                    data[3 * i + 1] = points[i][1];
+                    data[3 * i + 2] = points[i].length > 2 ? points[i][2] : 1;
+                }
+                return data;
+            }
+            const binary = atob(payload);
+            let bytes = new Uint8Array(binary.length);
+            for (let i = 0; i < binary.length; i++) bytes[i] = binary.charCodeAt(i);
+            if (meta.deflate) {
+                const stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream('deflate'));
+                bytes = new Uint8Array(await new Response(stream).arrayBuffer());
+            }
+            const n = meta.count;
+            const coords = new Int32Array(bytes.buffer, 0, 2 * n);
+            const weights = meta.weighted ? new Float32Array(bytes.buffer, 8 * n, n) : null;
+            const data = new Float64Array(3 * n);
+            // Undo the delta encoding; Int32Array stores wrap exactly like the encoder did.
+            for (let i = 0; i < n; i++) {
+                if (i > 0) {
+                    coords[i] += coords[i - 1];
+                    coords[n + i] += coords[n + i - 1];
+                }
+                data[3 * i] = coords[i] / 1e7;
+                data[3 * i + 1] = coords[n + i] / 1e7;
+                data[3 * i + 2] = weights ? weights[i] : 1;
+            }
+            return data;
+        }
+
+        // Decodes one block's text, or fetches and decodes the blocks of a serve mode query.
+        async function handleDecoderMessage(message) {
+            if (message.url) {
+                const response = await fetch(message.url);
+                if (!response.ok) throw new Error(`HTTP ${response.status}`);
+                const blocks = await response.json();
+                return {blocks: await Promise.all(blocks.map(block => decodePoints(block.points, block)))};
+            }
+            return {data: await decodePoints(message.text, message.meta)};
+        }
+
+        let decoder = null;
+        try {
+            const source = `${decodePoints}\n${handleDecoderMessage}\n` +
+                'self.onmessage = async e => {' +
+                '  try {' +
+                '    const result = await handleDecoderMessage(e.data);' +
+                '    const buffers = (result.blocks || [result.data]).map(data => data.buffer);' +
+                '    self.postMessage({id: e.data.id, result}, buffers);' +
+                '  } catch (error) { self.postMessage({id: e.data.id, error: String(error)}); }' +
+                '};';
+            decoder = new Worker(URL.createObjectURL(new Blob([source], {type: 'text/javascript'})));
+        } catch (error) {
+            console.warn('Web Workers unavailable, decoding points on the main thread:', error);
+        }
+        const decoderRequests = new Map();
+        let nextDecoderRequest = 0;
+        if (decoder) {
+            decoder.onmessage = e => {
+                const request = decoderRequests.get(e.data.id);
+                decoderRequests.delete(e.data.id);
+                if (e.data.error) request.reject(new Error(e.data.error));
+                else request.resolve(e.data.result);
+            };
+            decoder.onerror = e => {
+                // The worker could not start (e.g. blocked by the browser): decode here from now on.
+                e.preventDefault();
+                decoder = null;
+                decoderRequests.forEach(request => handleDecoderMessage(request.message).then(request.resolve, request.reject));
+                decoderRequests.clear();
+            };
+        }
+        function decode(message) {
+            if (!decoder) return handleDecoderMessage(message);
+            return new Promise((resolve, reject) => {
+                const id = nextDecoderRequest++;
+                decoderRequests.set(id, {resolve, reject, message});
+                decoder.postMessage(Object.assign({id}, message));
+            });
+        }
+
+        // leaflet.heat takes [lat, lon, weight] arrays.
+        function toLatLngs(data) {
+            const points = new Array(data.length / 3);
+            for (let i = 0, j = 0; j < data.length; i++, j += 3) points[i] = [data[j], data[j + 1], data[j + 2]];
+            return points;
+        }
+
+        // Blocks are decoded on first use, a few at a time; the text of a decoded block is dropped.
+        const MAX_DECODING = 4;
+        const decodeQueue = [];
+        let decoding = 0;
+        function loadBlock(block) {
+            if (!block.loading) {
+                block.loading = new Promise((resolve, reject) => decodeQueue.push({block, resolve, reject}));
+                pumpDecodeQueue();
+            }
+            return block.loading;
+        }
+        function pumpDecodeQueue() {
+            while (decoding < MAX_DECODING && decodeQueue.length) {
+                const {block, resolve, reject} = decodeQueue.shift();
+                decoding++;
+                const meta = Object.assign({}, block);
+                delete meta.source;
+                delete meta.loading;
+                decode({text: block.source.textContent, meta}).then(result => {
+                    block.points = toLatLngs(result.data);
+                    block.source.remove();
+                    block.source = null;
+                    resolve(block);
+                }, reject).finally(() => {
+                    decoding--;
+                    pumpDecodeQueue();
+                });
+            }
+        }
+
+        // --- Data Selection ---
+        // Blocks with a zoom 'z' belong to the zoom pyramid and cover one tile (ty, tx) of
+        // 360 / 2^tz degrees (each time period may use its own tz); blocks without one are always
+        // drawn. Blocks with a period 't' (an index into timePeriods) are only drawn while it is
+        // inside the selected range.
+        const pyramidZooms = [...new Set(dataBlocks.filter(b => b.z !== undefined).map(b => b.z))].sort((a, b) => a - b);
+        const pyramidTiles = {};
+        const pyramidTileZooms = {};
+        dataBlocks.forEach(block => {
+            if (block.z === undefined) return;
+            (pyramidTileZooms[block.z] = pyramidTileZooms[block.z] || new Set()).add(block.tz);
+            const key = `${block.z}/${block.tz}/${block.ty}/${block.tx}`;
+            (pyramidTiles[key] = pyramidTiles[key] || []).push(block);
+        });
+        let timeRange = [0, timePeriods.length - 1];
+        const inTimeRange = block => block.t === undefined || (block.t >= timeRange[0] && block.t <= timeRange[1]);
+
+        function visibleBlocks() {
+            const blocks = dataBlocks.filter(b => b.z === undefined && inTimeRange(b));
+            if (!pyramidZooms.length) return blocks;
+            // Use the finest level that is not finer than the current zoom.
+            const zoom = map.getZoom();
+            const level = pyramidZooms.reduce((best, z) => (z <= zoom ? z : best), pyramidZooms[0]);
+            const bounds = map.getBounds().pad(0.5);
+            pyramidTileZooms[level].forEach(tileZoom => {
+                const size = 360 / Math.pow(2, tileZoom);
+                const south = Math.floor(Math.max(bounds.getSouth(), -90) / size);
+                const north = Math.floor(Math.min(bounds.getNorth(), 90) / size);
+                const west = Math.floor(Math.max(bounds.getWest(), -180) / size);
+                const east = Math.floor(Math.min(bounds.getEast(), 180) / size);
+                for (let ty = south; ty <= north; ty++) {
+                    for (let tx = west; tx <= east; tx++) {
+                        (pyramidTiles[`${level}/${tileZoom}/${ty}/${tx}`] || []).forEach(block => {
+                            if (inTimeRange(block)) blocks.push(block);
+                        });
+                    }
+                }
+            });
+            return blocks;
+        }
+
+        // --- Progressive Drawing ---
+        // Blocks that are already decoded are drawn at once; the others are appended to the
+        // heat layer as the worker finishes them, so the map is usable while points load.
+        const loading = document.getElementById('loading');
+        const loadingProgress = document.getElementById('loadingProgress');
+        let drawGeneration = 0;
+        function showProgress(done, total) {
+            loading.style.display = done < total ? '' : 'none';
+            loadingProgress.textContent = `${Math.floor(100 * done / total)}%`;
+        }
+
+        // In serve mode the page holds no points: every map move asks the server for the
+        // blocks of the visible tiles, and only the answer to the latest request is drawn.
+        async function fetchVisibleBlocks(generation) {
+            const params = new URLSearchParams({
+                bbox: map.getBounds().pad(0.5).toBBoxString(),
+                zoom: map.getZoom(),
+            });
+            if (timePeriods.length) params.set('periods', timeRange.join(','));
+            loading.style.display = '';
+            loadingProgress.textContent = '';
+            try {
+                const result = await decode({url: new URL(`${pointsUrl}?${params}`, location.href).href});
+                if (generation === drawGeneration) heatLayer.setLatLngs([].concat(...result.blocks.map(toLatLngs)));
+            } catch (error) {
+                console.error('Could not load points:', error);
+            } finally {
+                if (generation === drawGeneration) loading.style.display = 'none';
+            }
+        }
+
+        function refreshHeatmap() {
+            const generation = ++drawGeneration;
+            if (pointsUrl) return fetchVisibleBlocks(generation);
+            const blocks = visibleBlocks();
+            const drawn = [];
+            const append = block => { for (const point of block.points) drawn.push(point); };
+            blocks.filter(block => block.points).forEach(append);
+            heatLayer.setLatLngs(drawn);
+
+            const missing = blocks.filter(block => !block.points);
+            const total = missing.reduce((sum, block) => sum + block.count, 0);
+            let done = 0;
+            showProgress(done, total);
+            missing.forEach(block => loadBlock(block).then(() => {
+                if (generation !== drawGeneration) return; // The view changed meanwhile.
+                append(block);
+                heatLayer.redraw(); // Coalesced into one redraw per animation frame.
+                showProgress(done += block.count, total);
+            }, error => console.error('Could not decode points:', error)));
+        }
+        // 'moveend' also fires at the end of every zoom.
+        if (pyramidZooms.length || pointsUrl) map.on('moveend', refreshHeatmap);
+
+        // Slider handlers update their label at once and the map once the slider rests.
+        function debounce(callback, wait) {
+            let timer = null;
+            return (...args) => {
+                clearTimeout(timer);
+                timer = setTimeout(() => callback(...args), wait);
+            };
+        }
 
         // --- Controls Logic ---
         const controls = document.getElementById('controls');
@@ -224,6 +610,11 @@ HTML_TEMPLATE = """
         const maxIntensityValue = document.getElementById('maxIntensityValue');
         const maxZoomValue = document.getElementById('maxZoomValue');
         const mapStyleSelect = document.getElementById('mapStyle');
+        const timeControls = document.getElementById('timeControls');
+        const timeStartSlider = document.getElementById('timeStart');
+        const timeEndSlider = document.getElementById('timeEnd');
+        const timeStartValue = document.getElementById('timeStartValue');
+        const timeEndValue = document.getElementById('timeEndValue');
 
         // Function to set initial values for controls from config
         function setInitialControlValues() {
@@ -236,6 +627,15 @@ HTML_TEMPLATE = """
             blurValue.textContent = blurSlider.value;
             maxIntensityValue.textContent = maxIntensitySlider.value;
             maxZoomValue.textContent = maxZoomSlider.value;
+
+            if (timePeriods.length) {
+                timeControls.style.display = '';
+                timeStartSlider.max = timeEndSlider.max = timePeriods.length - 1;
+                timeStartSlider.value = 0;
+                timeEndSlider.value = timePeriods.length - 1;
+                timeStartValue.textContent = timePeriods[0];
+                timeEndValue.textContent = timePeriods[timePeriods.length - 1];
+            }
         }
 
         // --- Event Listeners ---
@@ -243,14 +643,14 @@ HTML_TEMPLATE = """
             controls.classList.toggle('collapsed');
         });
 
-        const updateHeatmapOptions = () => {
+        const updateHeatmapOptions = debounce(() => {
             heatLayer.setOptions({
                 radius: parseInt(radiusSlider.value, 10),
                 blur: parseInt(blurSlider.value, 10),
                 max: parseFloat(maxIntensitySlider.value),
                 maxZoom: parseInt(maxZoomSlider.value, 10),
             });
-        };
+        }, 150);
         
         radiusSlider.addEventListener('input', e => {
             radiusValue.textContent = e.target.value;
@@ -269,6 +669,24 @@ HTML_TEMPLATE = """
             updateHeatmapOptions();
         });
 
+        // The date range only changes which precomputed blocks are concatenated.
+        const refreshHeatmapSoon = debounce(refreshHeatmap, 150);
+        const updateTimeRange = moved => {
+            let start = parseInt(timeStartSlider.value, 10);
+            let end = parseInt(timeEndSlider.value, 10);
+            if (start > end) {
+                // Keep the range valid by dragging the other handle along.
+                if (moved === timeStartSlider) timeEndSlider.value = end = start;
+                else timeStartSlider.value = start = end;
+            }
+            timeRange = [start, end];
+            timeStartValue.textContent = timePeriods[start];
+            timeEndValue.textContent = timePeriods[end];
+            refreshHeatmapSoon();
+        };
+        timeStartSlider.addEventListener('input', e => updateTimeRange(e.target));
+        timeEndSlider.addEventListener('input', e => updateTimeRange(e.target));
+
         mapStyleSelect.addEventListener('change', e => {
             const newStyle = e.target.value;
             tileLayer.setUrl(mapStyles[newStyle]);
@@ -284,263 +702,3390 @@ HTML_TEMPLATE = """
         });
         mapStyleSelect.value = initialMapStyle;
         setInitialControlValues();
+        refreshHeatmap();
     </script>
 </body>
 </html>
 """
 
-def _process_locations_format(file_handle):
-    """Processes the older 'locations' array format from Google Takeout or iOS."""
-    print("[INFO] 'locations' format detected. Processing...")
-    points = []
-    # Google stores coordinates as integers, so they must be scaled by 1e-7.
-    E7 = 1e-7
-    locations = ijson.items(file_handle, 'locations.item')
-    for i, loc in enumerate(locations):
-        if 'latitudeE7' in loc and 'longitudeE7' in loc:
-            lat = loc['latitudeE7'] * E7
-            lon = loc['longitudeE7'] * E7
-            points.append([lat, lon])
-        if (i + 1) % 50000 == 0:
-            print(f"  [PROGRESS] {i+1:,} locations processed...")
-    return points
+class PointBuffer:
+    """
+    Compact columnar store for coordinate points.
+    Latitudes and longitudes are kept as E7 integers in contiguous int32 arrays,
+    with optional timestamp (int64, epoch milliseconds) and weight (float64) columns.
+    Storage grows in fixed-size chunks, so memory tracks the raw data size
+    instead of per-point Python object overhead.
+    """
+    CHUNK_SIZE = 65536
+
+    def __init__(self, with_timestamps=False, with_weights=False):
+        self.with_timestamps = with_timestamps
+        self.with_weights = with_weights
+        self._chunks = [] # Sealed (full) chunks as (lat, lon, timestamp, weight) column tuples.
+        self._length = 0
+        self._new_tail()
+
+    @classmethod
+    def from_columns(cls, lat, lon, ts=None, weight=None):
+        """
+        Wraps existing columns (arrays or memoryviews, e.g. over a memory-mapped file)
+        without copying them. They are exposed as CHUNK_SIZE slices; appends go to new chunks.
+        """
+        buffer = cls(with_timestamps=ts is not None, with_weights=weight is not None)
+        for start in range(0, len(lat), cls.CHUNK_SIZE):
+            stop = start + cls.CHUNK_SIZE
+            buffer._chunks.append((
+                lat[start:stop], lon[start:stop],
+                ts[start:stop] if ts is not None else None,
+                weight[start:stop] if weight is not None else None
+            ))
+        buffer._length = len(lat)
+        return buffer
+
+    @classmethod
+    def concatenate(cls, buffers):
+        """Joins PointBuffers with the same columns into one that shares their chunks."""
+        buffers = list(buffers)
+        if not buffers: return cls()
+        joined = cls(buffers[0].with_timestamps, buffers[0].with_weights)
+        for buffer in buffers:
+            joined._chunks.extend(buffer.iter_chunks())
+            joined._length += len(buffer)
+        return joined
 
-def _process_semantic_segments_format(file_handle, config):
-    """Processes the newer 'semanticSegments' (Android) format."""
-    print("[INFO] 'semanticSegments' format detected. Processing...")
-    points = []
-    # Regular expression to find floating-point numbers in coordinate strings.
-    coord_regex = re.compile(r"([-]?\d+\.\d+)")
-    def parse_lat_lng_string(lat_lng_str):
-        if not isinstance(lat_lng_str, str): return None
+    def _new_tail(self):
+        self._lat = array('i')
+        self._lon = array('i')
+        self._ts = array('q') if self.with_timestamps else None
+        self._weight = array('d') if self.with_weights else None
+
+    def _seal_tail(self):
+        self._chunks.append((self._lat, self._lon, self._ts, self._weight))
+        self._new_tail()
+
+    def append_e7(self, lat_e7, lon_e7, timestamp=0, weight=1.0):
+        """Appends one point given as E7 integers (degrees * 10^7)."""
+        n = len(self._lat)
         try:
-            coords = [float(c) for c in coord_regex.findall(lat_lng_str)]
-            return [coords[0], coords[1]] if len(coords) == 2 else None
-        except (ValueError, AttributeError): return None
-    
-    segments = ijson.items(file_handle, 'semanticSegments.item')
-    for i, segment in enumerate(segments):
+            self._lat.append(lat_e7)
+            self._lon.append(lon_e7)
+            if self._ts is not None: self._ts.append(timestamp)
+            if self._weight is not None: self._weight.append(weight)
+        except (TypeError, OverflowError):
+            # Keep the columns aligned if a value does not fit its typed array.
+            for col in (self._lat, self._lon, self._ts, self._weight):
+                if col is not None: del col[n:]
+            raise
+        self._length += 1
+        if n + 1 >= self.CHUNK_SIZE:
+            self._seal_tail()
+
+    def append(self, lat, lon, timestamp=0, weight=1.0):
+        """Appends one point given in decimal degrees."""
+        self.append_e7(round(lat * 1e7), round(lon * 1e7), timestamp, weight)
+
+    def extend(self, other):
+        """Appends every point of another PointBuffer, copying whole column slices at a time."""
+        for lat, lon, ts, weight in other.iter_chunks():
+            start, total = 0, len(lat)
+            while start < total:
+                stop = min(total, start + self.CHUNK_SIZE - len(self._lat))
+                self._lat.extend(lat[start:stop])
+                self._lon.extend(lon[start:stop])
+                if self._ts is not None:
+                    self._ts.extend(ts[start:stop] if ts is not None else array('q', bytes(8 * (stop - start))))
+                if self._weight is not None:
+                    self._weight.extend(weight[start:stop] if weight is not None else array('d', [1.0]) * (stop - start))
+                self._length += stop - start
+                start = stop
+                if len(self._lat) >= self.CHUNK_SIZE:
+                    self._seal_tail()
+
+    def iter_chunks(self):
+        """Yields (lat_e7, lon_e7, timestamps, weights) column tuples; missing columns are None."""
+        yield from self._chunks
+        if self._lat:
+            yield (self._lat, self._lon, self._ts, self._weight)
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        """Yields (lat, lon) tuples in decimal degrees."""
+        for lat, lon, _, _ in self.iter_chunks():
+            for lat_e7, lon_e7 in zip(lat, lon):
+                yield (lat_e7 / 1e7, lon_e7 / 1e7)
+
+    @property
+    def nbytes(self):
+        """Total size in bytes of the underlying column storage."""
+        return sum(
+            sum(col.itemsize * len(col) for col in chunk if col is not None)
+            for chunk in self.iter_chunks()
+        )
+
+def _iter_points_js(points):
+    """Yields a PointBuffer as pieces of a JavaScript array literal of [lat, lon] (or [lat, lon, weight]) entries, one chunk at a time."""
+    yield "["
+    separator = ""
+    for lat, lon, _, weight in points.iter_chunks():
+        if weight is None:
+            piece = ",".join(f"[{a / 1e7},{b / 1e7}]" for a, b in zip(lat, lon))
+        else:
+            piece = ",".join(f"[{a / 1e7},{b / 1e7},{w:.9g}]" for a, b, w in zip(lat, lon, weight))
+        yield separator + piece
+        separator = ","
+    yield "]"
+
+def _int32_deltas(values, previous):
+    """Returns each value minus the one before it (`previous` for the first), wrapped to int32."""
+    try:
+        return array('i', map(operator.sub, values, chain((previous,), values)))
+    except OverflowError:
+        # Longitude jumps across the antimeridian can exceed int32; wrap them like the decoder does.
+        return array('i', (
+            (delta + 2**31) % 2**32 - 2**31
+            for delta in map(operator.sub, values, chain((previous,), values))
+        ))
+
+def _iter_binary_payload(points, compress):
+    """
+    Yields the binary encoding of a PointBuffer in pieces: the latitude column and then the
+    longitude column as little-endian int32 E7 deltas (each value minus the previous one),
+    followed by the weights as float32 if the buffer has them. The whole payload is
+    optionally zlib-deflated. Each column is encoded straight from the buffer's chunks.
+    """
+    def columns():
+        for index in (0, 1):
+            previous = 0
+            for chunk in points.iter_chunks():
+                deltas = _int32_deltas(chunk[index], previous)
+                previous = chunk[index][-1]
+                yield deltas
+        if points.with_weights:
+            for chunk in points.iter_chunks():
+                yield array('f', chunk[3])
+
+    compressor = zlib.compressobj(6) if compress else None
+    for column in columns():
+        if sys.byteorder == 'big': column.byteswap()
+        data = column.tobytes()
+        if compressor: data = compressor.compress(data)
+        if data: yield data
+    if compressor: yield compressor.flush()
+
+def _iter_base64(pieces):
+    """Base64-encodes a stream of byte strings, yielding ASCII text as it goes."""
+    pending = b""
+    for piece in pieces:
+        data = pending + piece
+        cut = len(data) - len(data) % 3
+        if cut: yield base64.b64encode(data[:cut]).decode('ascii')
+        pending = data[cut:]
+    if pending: yield base64.b64encode(pending).decode('ascii')
+
+def _block_meta(meta, points, config):
+    """A block's metadata plus what the page needs to decode its points."""
+    binary = config["POINT_ENCODING"] == "binary"
+    meta = dict(meta, encoding="binary" if binary else "json", count=len(points))
+    if binary:
+        meta.update(weighted=points.with_weights, deflate=bool(config["POINT_COMPRESSION"]))
+    return meta
+
+def _iter_points_payload(meta, points):
+    """Yields the points of a block as pieces of its text payload (a JSON array or base64 string)."""
+    if meta["encoding"] == "binary":
+        yield from _iter_base64(_iter_binary_payload(points, meta["deflate"]))
+    else:
+        yield from _iter_points_js(points)
+
+def _iter_block_js(meta, points, config):
+    """Yields one (metadata, PointBuffer) block as pieces of a JSON object, as served in serve mode."""
+    meta = _block_meta(meta, points, config)
+    fields = "".join(f'{json.dumps(key)}:{json.dumps(value)},' for key, value in meta.items())
+    yield "{" + fields + '"points":'
+    quote = '"' if meta["encoding"] == "binary" else ''
+    yield quote
+    yield from _iter_points_payload(meta, points)
+    yield quote + "}"
+
+# Per-tag metadata of the embedded point blocks, as columns of the page's block index.
+BLOCK_INDEX_FIELDS = ("count", "weighted", "t", "z", "tz", "ty", "tx")
+
+def _iter_block_tags(blocks, config):
+    """
+    Yields (metadata, PointBuffer) blocks as pieces of <script type="text/plain"> tags, one
+    per PointBuffer chunk, so the page can decode and draw a big block piece by piece. The
+    metadata of every tag follows in one compact JSON index: a row of BLOCK_INDEX_FIELDS
+    per tag, and the values shared by all of them (the encoding) once.
+    """
+    shared, rows = {}, []
+    for meta, points in blocks:
+        for lat, lon, ts, weight in points.iter_chunks():
+            piece = PointBuffer.from_columns(lat, lon, ts, weight)
+            piece_meta = _block_meta(meta, piece, config)
+            shared = {key: value for key, value in piece_meta.items() if key not in BLOCK_INDEX_FIELDS}
+            rows.append([piece_meta.get(field) for field in BLOCK_INDEX_FIELDS])
+            yield '    <script type="text/plain" class="point-block">'
+            yield from _iter_points_payload(piece_meta, piece)
+            yield '</script>\n'
+    index = {"shared": shared, "fields": BLOCK_INDEX_FIELDS, "blocks": rows}
+    yield f'    <script type="application/json" id="point-index">{json.dumps(index, separators=(",", ":"))}</script>\n'
+
+# --- Metrics and profiling ---
+# Phase functions are wrapped by _metered_phase and the parsers report their counters,
+# so a run can be broken down into time, throughput and memory per phase and per format.
+
+def _peak_rss_mb():
+    """High-water mark of this process's resident memory in MB, or None where it cannot be measured."""
+    if resource is None: return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+PARSER_COUNTERS = ("records_seen", "records_skipped", "points_extracted", "points_emitted", "bytes_read", "parse_time_s")
+
+def _new_parser_stats():
+    return dict.fromkeys(PARSER_COUNTERS, 0)
+
+class RunMetrics:
+    """
+    Collects the elapsed time, counters and memory high-water mark of each phase, and
+    the counters of each format parser, for the JSON report saved to METRICS_REPORT_FILE.
+    """
+
+    def __init__(self):
+        self.phases = []
+        self.parsers = {}
+        self._current = None
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Measures the enclosed block as phase `name`; `note` adds counters to it meanwhile."""
+        entry, outer = {"phase": name}, self._current
+        self._current = entry
+        started = time.perf_counter()
         try:
-            if config["INCLUDE_RAW_PATH"] and 'timelinePath' in segment:
-                for path_point in segment.get('timelinePath', []):
-                    if coords := parse_lat_lng_string(path_point.get('point')): points.append(coords)
-            elif config["INCLUDE_VISITS"] and 'visit' in segment:
-                if lat_lng := segment.get('visit', {}).get('topCandidate', {}).get('placeLocation', {}).get('latLng'):
-                    if coords := parse_lat_lng_string(lat_lng): points.append(coords)
-            elif config["INCLUDE_ACTIVITIES"] and 'activity' in segment:
-                activity = segment.get('activity', {})
-                if start_lat_lng := activity.get('start', {}).get('latLng'):
-                    if coords := parse_lat_lng_string(start_lat_lng): points.append(coords)
-                if end_lat_lng := activity.get('end', {}).get('latLng'):
-                    if coords := parse_lat_lng_string(end_lat_lng): points.append(coords)
-        except Exception:
-            print(f"\n[WARNING] Error processing segment #{i+1}. Skipping.")
-            continue
-        if (i + 1) % 20000 == 0:
-            print(f"  [PROGRESS] {i+1:,} segments processed...")
-    return points
+            yield entry
+        finally:
+            entry["elapsed_s"] = round(time.perf_counter() - started, 4)
+            entry["peak_rss_mb"] = _peak_rss_mb()
+            self.phases.append(entry)
+            self._current = outer
 
-def _process_timeline_objects_format(file_handle, config):
-    """Processes the newer 'timelineObjects' (iOS) format."""
-    print("[INFO] 'timelineObjects' (iOS) format detected. Processing...")
-    points = []
-    E7 = 1e-7
-    timeline_objects = ijson.items(file_handle, 'timelineObjects.item')
-    
-    for i, t_object in enumerate(timeline_objects):
+    def note(self, **counters):
+        """Records counters (points, bytes...) on the phase being measured, if any."""
+        if self._current is not None:
+            self._current.update(counters)
+
+    def add_parser_stats(self, format_name, stats):
+        """Adds the counters of one parse (a whole array or a shard) to the totals of its format."""
+        totals = self.parsers.setdefault(format_name, _new_parser_stats())
+        for key in PARSER_COUNTERS:
+            totals[key] += stats[key]
+        if stats.get("peak_rss_mb") is not None:
+            totals["peak_rss_mb"] = max(totals.get("peak_rss_mb") or 0, stats["peak_rss_mb"])
+
+    def report(self):
+        """The collected metrics as a JSON-serializable dict, with throughputs derived."""
+        phases = []
+        for entry in self.phases:
+            entry = dict(entry)
+            points = entry.get("points_in", entry.get("points"))
+            if points is not None and entry["elapsed_s"]:
+                entry["points_per_s"] = round(points / entry["elapsed_s"])
+            phases.append(entry)
+        parsers = {}
+        for format_name, totals in self.parsers.items():
+            entry = dict(totals, parse_time_s=round(totals["parse_time_s"], 4))
+            if totals["parse_time_s"]:
+                entry["records_per_s"] = round(totals["records_seen"] / totals["parse_time_s"])
+                entry["mb_per_s"] = round(totals["bytes_read"] / 1024 / 1024 / totals["parse_time_s"], 2)
+            parsers[format_name] = entry
+        return {
+            "ijson_backend": ijson.backend_name,
+            "total_elapsed_s": round(sum(entry["elapsed_s"] for entry in self.phases), 4),
+            "peak_rss_mb": _peak_rss_mb(),
+            "phases": phases,
+            "parsers": parsers,
+        }
+
+    def save(self, path, config):
+        """Writes the report, with the settings that shaped the run, to `path`."""
+        report = self.report()
+        report["input_file"] = config["JSON_INPUT_FILE"]
+        report["settings"] = {key: config[key] for key in (
+            "INCLUDE_VISITS", "INCLUDE_ACTIVITIES", "INCLUDE_RAW_PATH", "THINNING", "AGGREGATION_GRID",
+            "ZOOM_PYRAMID", "TIME_SLIDER", "POINT_ENCODING", "POINT_COMPRESSION", "PARALLEL_WORKERS",
+        )}
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+# Metrics of the current run; build_heatmap() starts a new RunMetrics for each run.
+METRICS = RunMetrics()
+
+def _metered_phase(name):
+    """Decorator measuring every call of a phase function as phase `name` in METRICS."""
+    def decorate(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with METRICS.phase(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+@contextlib.contextmanager
+def _profiled(config, suffix=""):
+    """Runs the enclosed block under cProfile when PROFILE_OUTPUT_FILE is set, saving the stats there."""
+    path = config["PROFILE_OUTPUT_FILE"]
+    if not path:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path + suffix)
+
+# --- Trajectory thinning ---
+E7_TO_METERS = 0.0111319 # Meters per 1e-7 degree of latitude (and of longitude at the equator).
+
+def _distance_m(lat1_e7, lon1_e7, lat2_e7, lon2_e7):
+    """Approximate distance in meters between two nearby E7 points (equirectangular projection)."""
+    dy = (lat2_e7 - lat1_e7) * E7_TO_METERS
+    dx = (lon2_e7 - lon1_e7) * E7_TO_METERS * math.cos(math.radians(lat1_e7 * 1e-7))
+    return math.hypot(dx, dy)
+
+def _douglas_peucker(window, tolerance):
+    """Returns the indices of the (lat_e7, lon_e7, ...) points of `window` kept by Douglas-Peucker simplification."""
+    scale_x = E7_TO_METERS * math.cos(math.radians(window[0][0] * 1e-7))
+    xs = [(p[1] - window[0][1]) * scale_x for p in window]
+    ys = [(p[0] - window[0][0]) * E7_TO_METERS for p in window]
+    keep = {0, len(window) - 1}
+    stack = [(0, len(window) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2: continue
+        x0, y0 = xs[first], ys[first]
+        dx, dy = xs[last] - x0, ys[last] - y0
+        length = math.hypot(dx, dy)
+        inner = zip(xs[first + 1:last], ys[first + 1:last])
+        if length:
+            # Cross products: the distance to the line through the endpoints, times its length.
+            distances = [abs(dx * (y - y0) - dy * (x - x0)) for x, y in inner]
+            limit = tolerance * length
+        else:
+            distances = [math.hypot(x - x0, y - y0) for x, y in inner]
+            limit = tolerance
+        farthest = max(distances)
+        if farthest > limit:
+            i = first + 1 + distances.index(farthest)
+            keep.add(i)
+            stack.append((first, i))
+            stack.append((i, last))
+    return sorted(keep)
+
+class TrajectoryThinner:
+    """
+    Point sink with the append interface of a PointBuffer that thins a track on its way into
+    one, in a single pass with bounded look-back:
+      - A stop, a run of consecutive points staying within THIN_STATIONARY_RADIUS_M of its first
+        point for at least THIN_STATIONARY_MIN_STAY_S, without gaps longer than THIN_STATIONARY_MAX_GAP_S,
+        becomes one point at its centroid weighted by the sum of the run's weights, so the heat
+        it produces is preserved.
+      - Moving points (including runs too short to be stops) are held in a window of at most
+        THIN_WINDOW_POINTS and simplified with Douglas-Peucker (THIN_PATH_TOLERANCE_M) whenever
+        it fills up or a stop ends the stretch.
+    Call flush() after the last point.
+    """
+    with_timestamps = True # Handlers must supply timestamps for the stop time tolerances.
+
+    def __init__(self, target, config):
+        self.target = target
+        self.radius = config["THIN_STATIONARY_RADIUS_M"]
+        self.min_stay_ms = config["THIN_STATIONARY_MIN_STAY_S"] * 1000
+        self.max_gap_ms = config["THIN_STATIONARY_MAX_GAP_S"] * 1000
+        self.tolerance = config["THIN_PATH_TOLERANCE_M"]
+        self.window_size = max(3, config["THIN_WINDOW_POINTS"])
+        self.received = 0
+        # The open run: its points (None once it is known to be a stop, when only the sums are
+        # needed), its first point, the timestamp of its last point and its [lat, lon, count, weight] sums.
+        self._run_points = None
+        self._run_first = None
+        self._run_last_time = 0
+        self._run_sums = None
+        # Moving points awaiting simplification; the first one, if any, was already emitted.
+        self._window = []
+
+    def append(self, lat, lon, timestamp=0, weight=1.0):
+        """Adds one point given in decimal degrees."""
+        self.append_e7(round(lat * 1e7), round(lon * 1e7), timestamp, weight)
+
+    def append_e7(self, lat_e7, lon_e7, timestamp=0, weight=1.0):
+        """Adds one point given as E7 integers. Raises like PointBuffer.append_e7 on invalid values."""
+        lat_e7, lon_e7 = operator.index(lat_e7), operator.index(lon_e7)
+        if not (-2**31 <= lat_e7 < 2**31 and -2**31 <= lon_e7 < 2**31):
+            raise OverflowError("coordinate out of int32 range")
+        self.received += 1
+        point = (lat_e7, lon_e7, timestamp, weight)
+        first = self._run_first
+        if first is not None:
+            if (_distance_m(first[0], first[1], lat_e7, lon_e7) <= self.radius
+                    and (not timestamp or not self._run_last_time or timestamp - self._run_last_time <= self.max_gap_ms)):
+                self._extend_run(point)
+                return
+            self._close_run()
+        self._run_first = point
+        self._run_points = [point]
+        self._run_last_time = timestamp
+        self._run_sums = [lat_e7, lon_e7, 1, weight]
+
+    def flush(self):
+        """Emits everything still held. The thinner can keep receiving points afterwards."""
+        if self._run_first is not None:
+            self._close_run()
+        if len(self._window) > 1:
+            self._simplify_window()
+        self._window = []
+
+    def _extend_run(self, point):
+        sums = self._run_sums
+        sums[0] += point[0]
+        sums[1] += point[1]
+        sums[2] += 1
+        sums[3] += point[3]
+        if point[2]: self._run_last_time = point[2]
+        if self._run_points is not None:
+            self._run_points.append(point)
+            # Once the run qualifies as a stop (or is too dense to hold), its points are no longer needed.
+            stayed = self._run_first[2] and self._run_last_time - self._run_first[2] >= self.min_stay_ms
+            if stayed or len(self._run_points) >= self.window_size:
+                self._run_points = None
+
+    def _close_run(self):
+        run_points, first, sums = self._run_points, self._run_first, self._run_sums
+        self._run_first = self._run_points = self._run_sums = None
+        if run_points is not None:
+            for point in run_points:
+                self._add_moving(point)
+            return
+        # A stop ends the current moving stretch and starts the next one.
+        lat_sum, lon_sum, count, weight = sums
+        stop = (round(lat_sum / count), round(lon_sum / count), first[2], weight)
+        if self._window:
+            self._window.append(stop)
+            self._simplify_window()
+        else:
+            self._emit(stop)
+            self._window = [stop]
+
+    def _add_moving(self, point):
+        if not self._window:
+            self._emit(point)
+        self._window.append(point)
+        if len(self._window) >= self.window_size:
+            self._simplify_window()
+
+    def _simplify_window(self):
+        window = self._window
+        kept = _douglas_peucker(window, self.tolerance) if self.tolerance > 0 else range(len(window))
+        for i in kept:
+            if i: self._emit(window[i])
+        self._window = [window[-1]]
+
+    def _emit(self, point):
+        self.target.append_e7(*point)
+
+def _feed_thinner(thinner, points):
+    """Appends every point of a PointBuffer to a TrajectoryThinner, in order."""
+    for lat, lon, ts, weight in points.iter_chunks():
+        timestamps = ts if ts is not None else repeat(0)
+        weights = weight if weight is not None else repeat(1.0)
+        for point in zip(lat, lon, timestamps, weights):
+            thinner.append_e7(*point)
+
+def thin_points(config, points):
+    """Runs a PointBuffer through a TrajectoryThinner and returns the thinned, weighted points."""
+    thinned = PointBuffer(with_timestamps=points.with_timestamps, with_weights=True)
+    thinner = TrajectoryThinner(thinned, config)
+    _feed_thinner(thinner, points)
+    thinner.flush()
+    return thinned
+
+# Regular expression to find floating-point numbers in coordinate strings.
+COORD_REGEX = re.compile(r"([-]?\d+\.\d+)")
+
+def _parse_lat_lng_string(lat_lng_str):
+    """Finds the two floating point numbers in strings like "geo:35.123,-47.456" or "35.123°, -47.456°"."""
+    if not isinstance(lat_lng_str, str): return None
+    coords = COORD_REGEX.findall(lat_lng_str)
+    return (float(coords[0]), float(coords[1])) if len(coords) == 2 else None
+
+def _parse_timestamp(value):
+    """
+    Converts a Takeout timestamp to epoch milliseconds. Accepts ISO 8601 strings
+    ('2020-01-01T00:00:00.123Z', with any UTC offset) and millisecond counts ('1556668800000').
+    Returns 0 if the value is missing or invalid.
+    """
+    if value is None: return 0
+    try:
+        if isinstance(value, str) and not value.isdigit():
+            if value.endswith('Z'): value = value[:-1] + '+00:00'
+            moment = datetime.fromisoformat(value)
+            if moment.tzinfo is None: moment = moment.replace(tzinfo=timezone.utc)
+            return round(moment.timestamp() * 1000)
+        return int(value)
+    except (ValueError, TypeError, OverflowError):
+        return 0
+
+def _record_time(points, record, *keys):
+    """Timestamp of the first of `keys` found in `record`, or 0 when `points` does not keep timestamps."""
+    if not points.with_timestamps: return 0
+    for key in keys:
+        if key in record: return _parse_timestamp(record[key])
+    return 0
+
+def _keeps_timestamps(config):
+    """Whether the processors should extract a timestamp for every point."""
+    return bool(config["HISTORY_STORE_DIR"] or config["TIME_SLIDER"] or config["EXPORT_FILES"])
+
+def _thins_while_parsing(config):
+    """
+    Whether points go through a TrajectoryThinner as they are parsed. The history store keeps
+    raw points, since thinned ones depend on their neighbors and would not deduplicate across
+    exports; its output is thinned when it is read instead.
+    """
+    return bool(config["THINNING"]) and not config["HISTORY_STORE_DIR"]
+
+def _new_point_buffer(config):
+    """Empty PointBuffer with the columns the processors fill for this config."""
+    return PointBuffer(with_timestamps=_keeps_timestamps(config), with_weights=_thins_while_parsing(config))
+
+def _handle_locations_record(record, points, config):
+    """Extracts the point of one item of the older 'locations' array format."""
+    # Google stores coordinates as E7 integers, which the point buffer keeps as-is.
+    if 'latitudeE7' in record and 'longitudeE7' in record:
+        points.append_e7(record['latitudeE7'], record['longitudeE7'],
+                         _record_time(points, record, 'timestamp', 'timestampMs'))
+
+def _handle_semantic_segment_record(record, points, config):
+    """Extracts the points of one item of the 'semanticSegments' (Android) format."""
+    if config["INCLUDE_RAW_PATH"] and 'timelinePath' in record:
+        for path_point in record.get('timelinePath', []):
+            if coords := _parse_lat_lng_string(path_point.get('point')):
+                points.append(*coords, _record_time(points, path_point, 'time'))
+    elif config["INCLUDE_VISITS"] and 'visit' in record:
+        if lat_lng := record.get('visit', {}).get('topCandidate', {}).get('placeLocation', {}).get('latLng'):
+            if coords := _parse_lat_lng_string(lat_lng): points.append(*coords, _record_time(points, record, 'startTime'))
+    elif config["INCLUDE_ACTIVITIES"] and 'activity' in record:
+        activity = record.get('activity', {})
+        if start_lat_lng := activity.get('start', {}).get('latLng'):
+            if coords := _parse_lat_lng_string(start_lat_lng): points.append(*coords, _record_time(points, record, 'startTime'))
+        if end_lat_lng := activity.get('end', {}).get('latLng'):
+            if coords := _parse_lat_lng_string(end_lat_lng): points.append(*coords, _record_time(points, record, 'endTime'))
+
+def _handle_timeline_object_record(record, points, config):
+    """Extracts the points of one item of the 'timelineObjects' (iOS) format."""
+    if config["INCLUDE_VISITS"] and 'placeVisit' in record:
+        visit = record.get('placeVisit', {})
+        if location := visit.get('location', {}):
+            if 'latitudeE7' in location and 'longitudeE7' in location:
+                points.append_e7(location['latitudeE7'], location['longitudeE7'],
+                                 _record_time(points, visit.get('duration', {}), 'startTimestamp', 'startTimestampMs'))
+
+    elif config["INCLUDE_ACTIVITIES"] and 'activitySegment' in record:
+        segment = record.get('activitySegment', {})
+        duration = segment.get('duration', {})
+        if start_loc := segment.get('startLocation'):
+            if 'latitudeE7' in start_loc and 'longitudeE7' in start_loc:
+                points.append_e7(start_loc['latitudeE7'], start_loc['longitudeE7'],
+                                 _record_time(points, duration, 'startTimestamp', 'startTimestampMs'))
+        if end_loc := segment.get('endLocation'):
+            if 'latitudeE7' in end_loc and 'longitudeE7' in end_loc:
+                points.append_e7(end_loc['latitudeE7'], end_loc['longitudeE7'],
+                                 _record_time(points, duration, 'endTimestamp', 'endTimestampMs'))
+
+        if config["INCLUDE_RAW_PATH"] and (raw_path := segment.get('simplifiedRawPath')):
+            for point in raw_path.get('points', []):
+                if 'latE7' in point and 'lngE7' in point:
+                    points.append_e7(point['latE7'], point['lngE7'], _record_time(points, point, 'timestamp', 'timestampMs'))
+
+def _handle_root_array_record(record, points, config):
+    """Extracts the points of one item of a root array of 'visit' and 'activity' records."""
+    # Check if the object is a 'visit'.
+    if config["INCLUDE_VISITS"] and 'visit' in record:
+        if lat_lng := record.get('visit', {}).get('topCandidate', {}).get('placeLocation'):
+            if coords := _parse_lat_lng_string(lat_lng):
+                points.append(*coords, _record_time(points, record, 'startTime'))
+
+    # Check if the object is an 'activity'.
+    elif config["INCLUDE_ACTIVITIES"] and 'activity' in record:
+        activity = record.get('activity', {})
+        if start_coords := _parse_lat_lng_string(activity.get('start')):
+            points.append(*start_coords, _record_time(points, record, 'startTime'))
+        if end_coords := _parse_lat_lng_string(activity.get('end')):
+            points.append(*end_coords, _record_time(points, record, 'endTime'))
+
+# Where the records of each supported format live and how they are handled. Records are
+# built by ijson's C backend (ijson.items): building a whole record in C costs less than
+# walking its events in Python to keep only some of its fields.
+FORMAT_SPECS = {
+    'locations': {
+        "item_prefix": 'locations.item',
+        "handler": _handle_locations_record,
+        "title": "'locations'",
+        "label": 'location',
+        "progress_every": 50000,
+    },
+    'semanticSegments': {
+        "item_prefix": 'semanticSegments.item',
+        "handler": _handle_semantic_segment_record,
+        "title": "'semanticSegments' (Android)",
+        "label": 'segment',
+        "progress_every": 20000,
+    },
+    'timelineObjects': {
+        "item_prefix": 'timelineObjects.item',
+        "handler": _handle_timeline_object_record,
+        "title": "'timelineObjects' (iOS)",
+        "label": 'timeline object',
+        "progress_every": 20000,
+    },
+    'root_array': {
+        "item_prefix": 'item',
+        "handler": _handle_root_array_record,
+        "title": "Root array",
+        "label": 'record',
+        "progress_every": 20000,
+    },
+}
+
+PARSE_BLOCK_SIZE = 64 * 1024 # Bytes handed to the parsers at a time; larger blocks parse slower (CPU cache).
+PREAMBLE_LIMIT = 16 * 1024 * 1024 # Bytes of a root object kept in memory while looking for its first record array.
+
+class _RecordConsumer:
+    """
+    Feeds records of one format to its handler, appending the extracted points to
+    `points` (thinned first when THINNING is enabled), and keeps the parser counters
+    (see PARSER_COUNTERS) of that format. 'bytes_read' is left to the caller, which owns the file.
+    """
+    def __init__(self, points, config, format_name, report_progress=True):
+        self.points = points
+        self.config = config
+        self.format_name = format_name
+        self.report_progress = report_progress
+        self.thinner = TrajectoryThinner(points, config) if _thins_while_parsing(config) else None
+        self.stats = _new_parser_stats()
+        self._points_before = len(points)
+        self._started = time.perf_counter()
+
+    def consume(self, records):
+        """Handles every record of an iterable; a record that fails is reported and skipped."""
+        spec = FORMAT_SPECS[self.format_name]
+        handler = spec["handler"]
+        label = spec["label"]
+        progress_every = spec["progress_every"]
+        sink = self.thinner or self.points
+        config = self.config
+        report_progress = self.report_progress
+        stats = self.stats
+        i = stats["records_seen"]
         try:
-            if config["INCLUDE_VISITS"] and 'placeVisit' in t_object:
-                if location := t_object.get('placeVisit', {}).get('location', {}):
-                    if 'latitudeE7' in location and 'longitudeE7' in location:
-                        points.append([location['latitudeE7'] * E7, location['longitudeE7'] * E7])
-            
-            elif config["INCLUDE_ACTIVITIES"] and 'activitySegment' in t_object:
-                segment = t_object.get('activitySegment', {})
-                if start_loc := segment.get('startLocation'):
-                    if 'latitudeE7' in start_loc and 'longitudeE7' in start_loc:
-                        points.append([start_loc['latitudeE7'] * E7, start_loc['longitudeE7'] * E7])
-                if end_loc := segment.get('endLocation'):
-                    if 'latitudeE7' in end_loc and 'longitudeE7' in end_loc:
-                        points.append([end_loc['latitudeE7'] * E7, end_loc['longitudeE7'] * E7])
-
-                if config["INCLUDE_RAW_PATH"] and (raw_path := segment.get('simplifiedRawPath')):
-                    for point in raw_path.get('points', []):
-                        if 'latE7' in point and 'lngE7' in point:
-                            points.append([point['latE7'] * E7, point['lngE7'] * E7])
-        except Exception:
-            print(f"\n[WARNING] Error processing timeline object #{i+1}. Skipping.")
-            continue
-        if (i + 1) % 20000 == 0:
-            print(f"  [PROGRESS] {i+1:,} timeline objects processed...")
-    return points
+            for i, record in enumerate(records, i + 1):
+                try:
+                    handler(record, sink, config)
+                except Exception:
+                    # If an error occurs processing a single record, skip it and continue.
+                    print(f"\n[WARNING] Error processing {label} #{i}. Skipping.")
+                    stats["records_skipped"] += 1
+                    continue
+                if report_progress and i % progress_every == 0:
+                    print(f"  [PROGRESS] {i:,} {label}s processed...")
+        finally:
+            stats["records_seen"] = i
+
+    def finish(self):
+        """Flushes the thinner and returns the counters."""
+        stats = self.stats
+        if self.thinner is not None:
+            self.thinner.flush()
+            if self.report_progress:
+                print(f"[INFO] Thinning kept {len(self.points) - self._points_before:,} of {self.thinner.received:,} '{self.format_name}' points.")
+        stats["parse_time_s"] = time.perf_counter() - self._started
+        stats["points_emitted"] = len(self.points) - self._points_before
+        stats["points_extracted"] = self.thinner.received if self.thinner is not None else stats["points_emitted"]
+        stats["peak_rss_mb"] = _peak_rss_mb()
+        return stats
 
-def _process_root_array_format(file_handle, config):
+def _process_records(file_handle, config, format_name, report_progress=True, points=None):
     """
-    Processes a JSON format where the root is a direct array of records.
-    This format also contains 'visit' and 'activity' objects.
+    Streams the records of one format out of `file_handle`, a root array of them, and
+    feeds them to the format's handler. Returns (points, parser counters). The points go
+    to `points` if given, or to a new buffer with the columns the config needs.
     """
-    print("[INFO] Root array format detected. Processing...")
-    points = []
-    # This regex helper function is reused from the semantic segments parser.
-    coord_regex = re.compile(r"([-]?\d+\.\d+)")
-    def parse_lat_lng_string(lat_lng_str):
-        if not isinstance(lat_lng_str, str): return None
+    if points is None:
+        points = _new_point_buffer(config)
+    consumer = _RecordConsumer(points, config, format_name, report_progress)
+    consumer.consume(ijson.items(file_handle, 'item', use_float=True))
+    return points, consumer.finish()
+
+class _RecordStream:
+    """
+    A record array parsed from blocks pushed into an ijson items coroutine, for the arrays
+    of a document other than the first one (see _process_document). An exact stream parses
+    the document from its first byte. A candidate starts at a key that was only found by
+    searching the bytes, parsed as the first key of an object, so it is not known to be
+    a top-level one until the document has been parsed to its end.
+    """
+    def __init__(self, config, format_name, exact):
+        self.format_name = format_name
+        self.exact = exact
+        self.points = _new_point_buffer(config)
+        self.consumer = _RecordConsumer(self.points, config, format_name)
+        self.records = ijson.utils.sendable_list()
+        self.parser = ijson.items_coro(self.records, FORMAT_SPECS[format_name]["item_prefix"], use_float=True)
+        self.failed = False
+        self.dropped = False
+
+    def _consume(self):
+        count = len(self.records)
+        self.consumer.consume(self.records)
+        del self.records[:]
+        return count
+
+    def feed(self, data):
+        """Parses the next bytes and handles the records they complete; returns how many there were."""
         try:
-            # It finds the two floating point numbers in strings like "geo:35.123,-47.456"
-            coords = [float(c) for c in coord_regex.findall(lat_lng_str)]
-            return [coords[0], coords[1]] if len(coords) == 2 else None
-        except (ValueError, AttributeError): return None
+            self.parser.send(data)
+        finally:
+            # Records completed before a parse error are still handled.
+            count = self._consume()
+        return count
 
-    # The '.item' suffix tells ijson to iterate through the items of the root array.
-    records = ijson.items(file_handle, 'item')
-    
-    for i, record in enumerate(records):
+    def close(self):
+        """Ends the parse; raises IncompleteJSONError if the document is truncated."""
         try:
-            # Check if the object is a 'visit'.
-            if config["INCLUDE_VISITS"] and 'visit' in record:
-                if lat_lng := record.get('visit', {}).get('topCandidate', {}).get('placeLocation'):
-                    if coords := parse_lat_lng_string(lat_lng):
-                        points.append(coords)
-            
-            # Check if the object is an 'activity'.
-            elif config["INCLUDE_ACTIVITIES"] and 'activity' in record:
-                activity = record.get('activity', {})
-                if start_coords := parse_lat_lng_string(activity.get('start')):
-                    points.append(start_coords)
-                if end_coords := parse_lat_lng_string(activity.get('end')):
-                    points.append(end_coords)
-
-        except Exception:
-            # If an error occurs processing a single record, skip it and continue.
-            print(f"\n[WARNING] Error processing record #{i+1}. Skipping.")
-            continue
+            self.parser.close()
+        finally:
+            self._consume()
 
-        if (i + 1) % 20000 == 0:
-            print(f"  [PROGRESS] {i+1:,} records processed...")
-            
-    return points
+class _BlockReader:
+    """
+    File object for the pull parser of a document's first record array: returns
+    `first_block`, then the rest of `file_handle` in PARSE_BLOCK_SIZE blocks, passing
+    each of them to `on_block` as it is read.
+    """
+    def __init__(self, file_handle, first_block, on_block):
+        self._file = file_handle
+        self._first = first_block
+        self._on_block = on_block
+        self.bytes_read = len(first_block)
 
-def extract_locations(config):
+    def read(self, size=-1):
+        if not size: return b''
+        if self._first is not None:
+            block, self._first = self._first, None
+            return block
+        block = self._file.read(PARSE_BLOCK_SIZE)
+        self.bytes_read += len(block)
+        if block: self._on_block(block)
+        return block
+
+def _process_document(file_handle, config, points_by_format, target=None):
     """
-    Detects the JSON format by sniffing the file's start
-    and calls the appropriate processing function.
-    Handles all known formats: root array, 'locations', 'semanticSegments', or 'timelineObjects'.
+    Parses a whole export in one streaming pass, without seeking. A root array, or each
+    known record array among the keys of the root object ('locations', 'semanticSegments',
+    'timelineObjects'), is routed to its format's handler, whatever its position in the
+    file and however many formats the file combines. Points go into `points_by_format` as
+    they are found, so a parse error later in the file keeps what was read before it.
+    With a `target` sink, every format's points go into it instead of a new PointBuffer
+    per format.
+
+    ijson's C parser builds the records, but cannot say where it is in the document, so
+    the record arrays of a root object are found by searching the blocks for their quoted
+    keys. The first key found, within PREAMBLE_LIMIT bytes, is parsed by ijson.items over
+    the whole document, the fastest path. Other keys found by then get an exact parser over
+    the whole document too, and keys first found later a candidate one from the key on; both
+    are fed each block as it is read, and their points are added after the first array's.
     """
-    print("\n--- [PHASE 1/3] Processing JSON File ---")
-    input_file = config["JSON_INPUT_FILE"]
-    print(f"[INFO] Starting to read '{input_file}'...")
-    
-    points = []
+    keys = {f'"{key}"'.encode(): format_name for key, format_name in ARRAY_FORMATS.items() if key}
+    overlap = max(map(len, keys)) - 1
+    streams = [] # Pushed record arrays, in the order they were found.
+    first = None # _RecordConsumer of the first record array, parsed by pulling.
+    parsing_first = False
+    error = None
 
-    try:
-        with open(input_file, 'rb') as f:
-            # Sniff the first few non-whitespace bytes to detect the root structure.
-            prefix = f.read(4096).strip()
-            f.seek(0) # Rewind the file for the actual parser.
-            
-            detected_format = None
-            
-            # Check if the file starts with '[' for the root array format.
-            if prefix.startswith(b'['):
-                detected_format = 'root_array'
-            # Otherwise, check for known keys if it's an object.
-            elif prefix.startswith(b'{'):
-                if b'"locations"' in prefix:
-                    detected_format = 'locations'
-                elif b'"semanticSegments"' in prefix:
-                    detected_format = 'semanticSegments'
-                elif b'"timelineObjects"' in prefix:
-                    detected_format = 'timelineObjects'
-
-            # Call the correct function based on the detected format.
-            if detected_format == 'root_array':
-                points = _process_root_array_format(f, config)
-            elif detected_format == 'locations':
-                points = _process_locations_format(f)
-            elif detected_format == 'semanticSegments':
-                points = _process_semantic_segments_format(f, config)
-            elif detected_format == 'timelineObjects':
-                points = _process_timeline_objects_format(f, config)
+    def start(format_name, exact, data):
+        stream = _RecordStream(config, format_name, exact)
+        streams.append(stream)
+        feed(stream, data)
+        return stream
+
+    def feed(stream, data, close=False):
+        nonlocal error
+        try:
+            count = stream.close() if close else stream.feed(data)
+        except ijson.common.IncompleteJSONError as e:
+            stream.failed = True
+            # A candidate that fails before any record, or while an exact parser still reads
+            # on, was not a top-level key (e.g. a string value, or a key of a nested object).
+            # Otherwise the file itself is damaged.
+            exact_parsing = parsing_first or any(s.exact and not s.failed for s in streams)
+            if stream.exact or (stream.consumer.stats["records_seen"] and not exact_parsing):
+                error = error or e
             else:
-                print("\n[ERROR] Could not determine JSON format. No known structure was identified.")
-                return None
+                stream.dropped = True
+            return
+        if count:
+            stream.consumer.stats["bytes_read"] += len(data)
 
-    except ijson.common.IncompleteJSONError as e:
-        print(f"\n[STRUCTURAL ERROR] A parsing error occurred: {e}")
-        print("  > ACTION: Proceeding with the data read so far.")
-    except FileNotFoundError:
-        print(f"\n[FATAL ERROR] The input file '{input_file}' was not found.")
-        return None
-    except Exception as e:
-        print(f"\n[FATAL ERROR] An unexpected error occurred: {e}")
-        traceback.print_exc()
-        return None
+    def find_keys(data):
+        for key, format_name in keys.items():
+            if first and first.format_name == format_name: continue
+            if any(s.format_name == format_name and not s.failed for s in streams): continue
+            pos = data.find(key)
+            while pos != -1 and error is None:
+                # Skip quotes escaped inside a string; a candidate that fails at once was no key.
+                if (pos == 0 or data[pos - 1] != 0x5c) and not start(format_name, False, b'{' + data[pos:]).failed: break
+                pos = data.find(key, pos + 1)
 
-    # --- Final Processing Report ---
-    print("\n[INFO] File analysis complete.")
-    print(f"  > Total coordinate points found: {len(points):,}")
+    tail = b''
+    def on_block(block):
+        nonlocal tail
+        for stream in streams:
+            if not stream.failed: feed(stream, block)
+        if root == b'{':
+            # Keys cut in two by a block boundary are found in the previous block's tail.
+            find_keys(tail + block)
+            tail = block[-overlap:]
+        if error is not None:
+            raise error
 
-    if not points:
-        print("\n[WARNING] No location points were extracted. The HTML file will not be generated.")
-        return None
-    
-    return points
+    def register(format_name, points):
+        print(f"[INFO] {FORMAT_SPECS[format_name]['title']} format detected. Processing...")
+        if target is not None and points is not target:
+            target.extend(points)
+            points = target
+        if points_by_format.setdefault(format_name, points) is not points:
+            points_by_format[format_name].extend(points)
 
-def create_html_file(config, points):
-    """Generates the final HTML file, injecting all data and configurations."""
-    print("\n--- [PHASE 2/3] Generating Interactive HTML File ---")
-    output_file = config["HTML_OUTPUT_FILE"]
-    print(f"[INFO] Creating '{output_file}' with live controls...")
+    def finish():
+        if first is not None and (stats := first.finish())["records_seen"]:
+            stats["bytes_read"] = reader.bytes_read
+            METRICS.add_parser_stats(first.format_name, stats)
+        for stream in streams:
+            if stream.dropped: continue
+            stats = stream.consumer.finish()
+            if not stats["records_seen"]: continue
+            register(stream.format_name, stream.points)
+            METRICS.add_parser_stats(stream.format_name, stats)
 
-    # Prepare initial heatmap options for JavaScript injection.
-    heatmap_options_js = json.dumps({
-        "radius": config["HEATMAP_RADIUS"],
-        "blur": config["HEATMAP_BLUR"],
-        "max": config["HEATMAP_MAX_INTENSITY"],
-        "maxZoom": config["HEATMAP_MAX_ZOOM"],
-        "minOpacity": config["HEATMAP_MIN_OPACITY"],
-        "gradient": config["HEATMAP_GRADIENT"]
-    })
-    
-    # Pass the map style dictionaries to JavaScript.
-    map_styles_js = json.dumps(MAP_STYLE_URLS)
-    map_attributions_js = json.dumps(MAP_ATTRIBUTIONS)
+    try:
+        block = file_handle.read(PARSE_BLOCK_SIZE)
+        root = block.lstrip()[:1]
+        head = [block]
+        formats = ['root_array'] if root == b'[' else []
+        if root == b'{':
+            # Keep reading up to the first key, so that its array gets an exact parser too.
+            size = len(block)
+            while not any(key in block for key in keys) and size < PREAMBLE_LIMIT:
+                seam = head[-1][-overlap:]
+                if not (block := file_handle.read(PARSE_BLOCK_SIZE)): break
+                size += len(block)
+                head.append(block)
+                block = seam + block
+            head = b''.join(head)
+            found = sorted((head.find(key), format_name) for key, format_name in keys.items() if key in head)
+            formats = [format_name for _, format_name in found]
+        else:
+            head = head[0]
+        reader = _BlockReader(file_handle, head, on_block)
+        tail = head[-overlap:]
+        if formats:
+            first = _RecordConsumer(target if target is not None else _new_point_buffer(config), config, formats[0])
+            for format_name in formats[1:]:
+                start(format_name, True, head)
+            records = ijson.items(reader, FORMAT_SPECS[formats[0]]["item_prefix"], use_float=True)
+            parsing_first = True
+            for record in records:
+                register(formats[0], first.points)
+                first.consume(chain((record,), records))
+            parsing_first = False
+        else:
+            while reader.read(PARSE_BLOCK_SIZE): pass
+        for stream in streams:
+            if error is None and not stream.failed: feed(stream, b'', close=True)
+    finally:
+        finish()
+    if error is not None:
+        raise error
 
-    # Replace all placeholders in the template with configured values.
-    final_html = (
-        HTML_TEMPLATE
-        .replace("%(LOCATIONS_DATA)s", json.dumps(points))
-        .replace("%(HEATMAP_OPTIONS)s", heatmap_options_js)
-        .replace("%(MAP_CENTER)s", str(config["MAP_INITIAL_CENTER"]))
-        .replace("%(MAP_ZOOM)s", str(config["MAP_INITIAL_ZOOM"]))
-        .replace("%(INITIAL_MAP_STYLE)s", config["MAP_STYLE"])
-        .replace("%(MAP_STYLES_JS)s", map_styles_js)
-        .replace("%(MAP_ATTRIBUTIONS_JS)s", map_attributions_js)
-    )
+# --- Point files and parse cache ---
+# Point file layout (little-endian): a 32-byte header (magic, flags, point count) followed
+# by the int32 latitude column, the int32 longitude column and, when flagged, the int64
+# timestamp column and the float64 weight column. Columns can be memory-mapped as-is.
+POINT_FILE_MAGIC = b'HEATPTS1'
+POINT_FILE_HEADER = struct.Struct('<8sIIQ8x')
+POINT_FILE_TIMESTAMPS = 1
+POINT_FILE_WEIGHTS = 2
 
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write(final_html)
-    file_size_kb = os.path.getsize(output_file) / 1024
-    print(f"[SUCCESS] File '{output_file}' generated ({file_size_kb:.2f} KB).")
+def save_points(path, points):
+    """Writes a PointBuffer to a point file, column by column, replacing `path` atomically."""
+    flags = (POINT_FILE_TIMESTAMPS if points.with_timestamps else 0) | (POINT_FILE_WEIGHTS if points.with_weights else 0)
+    columns = [(0, 'i'), (1, 'i')]
+    if points.with_timestamps: columns.append((2, 'q'))
+    if points.with_weights: columns.append((3, 'd'))
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(POINT_FILE_HEADER.pack(POINT_FILE_MAGIC, flags, 0, len(points)))
+        for index, typecode in columns:
+            for chunk in points.iter_chunks():
+                _write_column(f, chunk[index], typecode)
+    os.replace(temp_path, path)
 
-def open_in_browser(config):
-    """Opens the generated HTML file in the default web browser."""
-    if not config["AUTO_OPEN_IN_BROWSER"]: return
-    print("\n--- [PHASE 3/3] Visualization ---")
-    file_name = config["HTML_OUTPUT_FILE"]
-    print(f"[INFO] Opening '{file_name}' in your default browser...")
-    absolute_path = os.path.abspath(file_name)
-    webbrowser.open(f"file://{absolute_path}")
+def _write_column(file_handle, column, typecode):
+    """Writes a column slice (an array or a memoryview) to a point file, in little-endian order."""
+    if not isinstance(column, array) or sys.byteorder == 'big':
+        column = array(typecode, column)
+    if sys.byteorder == 'big':
+        column.byteswap()
+    column.tofile(file_handle)
+
+def _load_point_columns(path):
+    """
+    Memory-maps a point file and returns its (lat, lon, timestamps, weights) columns as
+    read-only sequences covering the whole file; missing columns are None.
+    """
+    with open(path, 'rb') as f:
+        magic, flags, _, count = POINT_FILE_HEADER.unpack(f.read(POINT_FILE_HEADER.size))
+        if magic != POINT_FILE_MAGIC:
+            raise ValueError(f"'{path}' is not a point file")
+        # Empty files cannot be mapped, so stand in with empty bytes.
+        view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if count else bytes(POINT_FILE_HEADER.size))
+
+    def column(offset, typecode, itemsize):
+        data = view[offset:offset + count * itemsize]
+        if sys.byteorder == 'big':
+            values = array(typecode, data.tobytes())
+            values.byteswap()
+            return values
+        return data.cast(typecode)
+
+    offset = POINT_FILE_HEADER.size
+    lat = column(offset, 'i', 4)
+    lon = column(offset + 4 * count, 'i', 4)
+    offset += 8 * count
+    ts = weight = None
+    if flags & POINT_FILE_TIMESTAMPS:
+        ts = column(offset, 'q', 8)
+        offset += 8 * count
+    if flags & POINT_FILE_WEIGHTS:
+        weight = column(offset, 'd', 8)
+    return lat, lon, ts, weight
+
+def load_points(path):
+    """
+    Opens a point file as a PointBuffer. The columns are memory-mapped rather than read,
+    so loading takes milliseconds and pages are only brought in as they are used.
+    """
+    return PointBuffer.from_columns(*_load_point_columns(path))
+
+def _extraction_settings(config):
+    """The config values that change which points are extracted from a file (part of the cache key)."""
+    settings = {key: config[key] for key in ("INCLUDE_VISITS", "INCLUDE_ACTIVITIES", "INCLUDE_RAW_PATH")}
+    settings["timestamps"] = _keeps_timestamps(config)
+    if config["ARCHIVE_MEMBER"]:
+        settings["archive_member"] = config["ARCHIVE_MEMBER"]
+    if _thins_while_parsing(config):
+        settings.update({key: value for key, value in config.items() if key.startswith("THIN")})
+    return settings
+
+def _file_content_hash(path):
+    """BLAKE2b hash of a file's contents."""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        while chunk := f.read(4 * 1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _hash_in_background(path):
+    """
+    Starts hashing a file's contents in a thread, which overlaps with parsing as file reads
+    and hashing release the GIL. Returns a function that waits for the hash (None on error).
+    """
+    result = []
+    def run():
+        with contextlib.suppress(OSError):
+            result.append(_file_content_hash(path))
+    thread = threading.Thread(target=run, name="fingerprint", daemon=True)
+    thread.start()
+    def wait():
+        thread.join()
+        return result[0] if result else None
+    return wait
+
+def _prune_cache_index(index):
+    """Drops the index entries of files that were deleted or replaced since they were indexed."""
+    kept = {}
+    for stat_key, content_hash in index.items():
+        path, size, mtime_ns = stat_key.rsplit('|', 2)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        if (str(stat.st_size), str(stat.st_mtime_ns)) == (size, mtime_ns):
+            kept[stat_key] = content_hash
+    return kept
+
+def _cache_entry_path(config, content_hash=None):
+    """
+    Returns the cache file for the input file and extraction settings, or None if caching
+    is disabled, the input does not exist, or its contents have not been hashed yet. Files
+    are identified by content hash, found through an index of (path, size, mtime) -> hash.
+    A file missing from the index is only hashed here if an indexed file has the same size
+    (it may be a renamed or copied one); otherwise extract_locations hashes it while parsing
+    and passes the `content_hash` in to add it to the index.
+    """
+    cache_dir = config["CACHE_DIR"]
+    input_file = config["JSON_INPUT_FILE"]
+    if not cache_dir: return None
+    try:
+        stat = os.stat(input_file)
+    except OSError:
+        return None
+    os.makedirs(cache_dir, exist_ok=True)
+    index_path = os.path.join(cache_dir, "index.json")
+    try:
+        with open(index_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        index = {}
+
+    stat_key = f"{os.path.abspath(input_file)}|{stat.st_size}|{stat.st_mtime_ns}"
+    if content_hash is None:
+        content_hash = index.get(stat_key)
+    if content_hash is None:
+        if str(stat.st_size) not in {key.rsplit('|', 2)[1] for key in index}: return None
+        print("[INFO] Fingerprinting the input file for the parse cache...")
+        content_hash = _file_content_hash(input_file)
+    if index.get(stat_key) != content_hash:
+        index = _prune_cache_index(index)
+        index[stat_key] = content_hash
+        # Replaced atomically, as batch jobs may share the cache.
+        temp_path = f"{index_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f, indent=1)
+        os.replace(temp_path, index_path)
+
+    settings = json.dumps(_extraction_settings(config), sort_keys=True)
+    settings_hash = hashlib.blake2b(settings.encode('utf-8'), digest_size=6).hexdigest()
+    return os.path.join(cache_dir, f"{content_hash}-{settings_hash}.points")
+
+def _trim_cache(config):
+    """Deletes the least recently used cache entries until the cache fits CACHE_MAX_SIZE_MB."""
+    cache_dir = config["CACHE_DIR"]
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith(".points"):
+            try:
+                stat = os.stat(os.path.join(cache_dir, name))
+            except FileNotFoundError: # Evicted meanwhile by another process.
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+    total = sum(size for _, size, _ in entries)
+    limit = config["CACHE_MAX_SIZE_MB"] * 1024 * 1024
+    for _, size, name in sorted(entries):
+        if total <= limit: break
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(os.path.join(cache_dir, name))
+        total -= size
+        print(f"[INFO] Evicted cache entry '{name}'.")
+
+def clear_cache(config):
+    """Deletes every cache entry and the file index."""
+    cache_dir = config["CACHE_DIR"]
+    if not cache_dir or not os.path.isdir(cache_dir): return
+    for name in os.listdir(cache_dir):
+        if name.endswith(".points") or name == "index.json":
+            os.remove(os.path.join(cache_dir, name))
+    print(f"[INFO] Cache '{cache_dir}' cleared.")
+
+# --- Point exports ---
+# Besides the HTML page, the extracted points can be written to EXPORT_FILES for other tools,
+# in the format given by each file's extension. Every writer consumes the points chunk by
+# chunk as they come, so one parse feeds all of them and each only adds its encoding cost.
+# Exported points carry their timestamp, and a weight when THINNING merged some of them.
+
+def _iso_timestamp(timestamp_ms):
+    """ISO 8601 UTC time of an epoch-milliseconds timestamp, e.g. '2021-03-01T12:00:00.250Z'."""
+    seconds, millis = divmod(timestamp_ms, 1000)
+    text = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(seconds))
+    return f"{text}.{millis:03d}Z" if millis else f"{text}Z"
+
+def _chunk_columns(chunk, with_weights):
+    """
+    The (lat, lon, timestamps, weights) columns of a chunk to export: missing timestamps are 0
+    and missing weights 1.0; weights are None unless `with_weights`.
+    """
+    lat, lon, ts, weight = chunk
+    if ts is None:
+        ts = array('q', bytes(8 * len(lat)))
+    if not with_weights:
+        weight = None
+    elif weight is None:
+        weight = array('d', [1.0]) * len(lat)
+    return lat, lon, ts, weight
+
+class _ExportFile:
+    """
+    Base of the export writers: streams into a temporary file next to `path`, which replaces
+    it once close() completes it (abort() discards it instead).
+    """
+    mode = 'w'
+
+    def __init__(self, path, with_weights):
+        self.path = path
+        self.with_weights = with_weights
+        self.count = 0
+        self._temp_path = f"{path}.{os.getpid()}.tmp"
+        if self.mode == 'w':
+            self._file = open(self._temp_path, 'w', encoding='utf-8', newline='\n', buffering=HTML_WRITE_BUFFER_SIZE)
+        else:
+            self._file = open(self._temp_path, 'wb', buffering=HTML_WRITE_BUFFER_SIZE)
+        self._start()
+
+    def _start(self): pass
+    def _finish(self): pass
+
+    def write(self, chunk):
+        """Appends the points of a (lat, lon, timestamps, weights) chunk, as yielded by PointBuffer.iter_chunks()."""
+        if len(chunk[0]):
+            self._write_chunk(*_chunk_columns(chunk, self.with_weights))
+            self.count += len(chunk[0])
+
+    def close(self):
+        self._finish()
+        self._file.close()
+        os.replace(self._temp_path, self.path)
+
+    def abort(self):
+        self._file.close()
+        os.remove(self._temp_path)
+
+class _CsvExport(_ExportFile):
+    """CSV with a header row: latitude, longitude, timestamp (ISO 8601, empty if unknown) and weight."""
+    def _start(self):
+        self._file.write("latitude,longitude,timestamp,weight\n" if self.with_weights else "latitude,longitude,timestamp\n")
+
+    def _write_chunk(self, lat, lon, ts, weight):
+        if weight is None:
+            rows = (f"{a / 1e7},{b / 1e7},{_iso_timestamp(t) if t else ''}\n" for a, b, t in zip(lat, lon, ts))
+        else:
+            rows = (f"{a / 1e7},{b / 1e7},{_iso_timestamp(t) if t else ''},{w:.9g}\n" for a, b, t, w in zip(lat, lon, ts, weight))
+        self._file.write("".join(rows))
+
+class _GeoJsonExport(_ExportFile):
+    """A GeoJSON FeatureCollection of Point features, one per line, with 'timestamp' (and 'weight') properties."""
+    def _start(self):
+        self._file.write('{"type":"FeatureCollection","features":[')
+
+    def _write_chunk(self, lat, lon, ts, weight):
+        head = '{"type":"Feature","geometry":{"type":"Point","coordinates":['
+        if weight is None:
+            features = (f'{head}{b / 1e7},{a / 1e7}]}},"properties":{{"timestamp":{_json_time(t)}}}}}'
+                        for a, b, t in zip(lat, lon, ts))
+        else:
+            features = (f'{head}{b / 1e7},{a / 1e7}]}},"properties":{{"timestamp":{_json_time(t)},"weight":{w:.9g}}}}}'
+                        for a, b, t, w in zip(lat, lon, ts, weight))
+        self._file.write(("\n" if not self.count else ",\n") + ",\n".join(features))
+
+    def _finish(self):
+        self._file.write("\n]}\n")
+
+def _json_time(timestamp_ms):
+    """JSON value of a timestamp: its ISO 8601 string, or null if unknown."""
+    return f'"{_iso_timestamp(timestamp_ms)}"' if timestamp_ms else "null"
+
+class _PointFileExport(_ExportFile):
+    """
+    The columnar point file format of the parse cache (see save_points; readable with
+    load_points). The columns are streamed to temporary files and joined behind the header on close.
+    """
+    mode = 'wb'
+
+    def _start(self):
+        self._columns = [(tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(self.path))), typecode)
+                         for typecode in ('i', 'i', 'q', 'd')[:4 if self.with_weights else 3]]
+
+    def _write_chunk(self, *columns):
+        for (f, typecode), column in zip(self._columns, columns):
+            _write_column(f, column, typecode)
+
+    def _finish(self):
+        flags = POINT_FILE_TIMESTAMPS | (POINT_FILE_WEIGHTS if self.with_weights else 0)
+        self._file.write(POINT_FILE_HEADER.pack(POINT_FILE_MAGIC, flags, 0, self.count))
+        for f, _ in self._columns:
+            f.seek(0)
+            shutil.copyfileobj(f, self._file, HTML_WRITE_BUFFER_SIZE)
+            f.close()
+
+    def abort(self):
+        for f, _ in self._columns:
+            f.close()
+        super().abort()
+
+EXPORT_FORMATS = {
+    ".csv": _CsvExport,
+    ".geojson": _GeoJsonExport,
+    ".points": _PointFileExport,
+}
+
+@contextlib.contextmanager
+def _open_exports(config):
+    """
+    Opens a writer for each of EXPORT_FILES and yields them as a list. On exit they are
+    completed, or discarded if no point was written or an error occurred.
+    """
+    exports = []
+    try:
+        for path in config["EXPORT_FILES"]:
+            extension = os.path.splitext(path)[1].lower()
+            if extension not in EXPORT_FORMATS:
+                raise ValueError(f"Unknown export format '{path}' (expected {', '.join(EXPORT_FORMATS)}).")
+            exports.append(EXPORT_FORMATS[extension](path, with_weights=bool(config["THINNING"])))
+        yield exports
+    except BaseException:
+        for export in exports:
+            export.abort()
+        raise
+    for export in exports:
+        if not export.count:
+            export.abort()
+            continue
+        export.close()
+        print(f"[SUCCESS] {export.count:,} points exported to '{export.path}' "
+              f"({os.path.getsize(export.path) / 1024:.2f} KB).")
+
+def export_points(config, points):
+    """Writes the points of a PointBuffer to every file of EXPORT_FILES, in a single pass over its chunks."""
+    if config["EXPORT_FILES"]:
+        _export_points(config, points)
+
+@_metered_phase("export")
+def _export_points(config, points):
+    print(f"\n[INFO] Exporting {len(points):,} points to {len(config['EXPORT_FILES'])} file(s)...")
+    with _open_exports(config) as exports:
+        for chunk in points.iter_chunks():
+            for export in exports:
+                export.write(chunk)
+    METRICS.note(points=len(points), files=len(config["EXPORT_FILES"]))
+
+# --- Input files and archives ---
+# Besides plain JSON, the input can be a Takeout .zip archive or a .gz / .zst compressed export,
+# recognized by its first bytes. Compressed input is read by a background thread that
+# decompresses ahead of the parser, so I/O, decompression and parsing overlap and nothing is
+# extracted to disk.
+ZIP_MAGIC = b'PK\x03\x04'
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+READ_AHEAD_BLOCK_SIZE = 1024 * 1024
+READ_AHEAD_BLOCKS = 8 # Decompressed blocks buffered ahead of the parser.
+# Names of the timeline file inside an archive, by preference (Takeout's, then the phone exports').
+TIMELINE_MEMBER_NAMES = ("records.json", "timeline.json", "location-history.json")
+# Raised when compressed input turns out to be truncated or corrupted part way through.
+DAMAGED_INPUT_ERRORS = (EOFError, zlib.error, zipfile.BadZipFile, gzip.BadGzipFile) + ((zstandard.ZstdError,) if zstandard else ())
+
+class InputFileError(Exception):
+    """The input file exists but cannot be read as an export (e.g. an archive without one)."""
+
+def _input_compression(path):
+    """'zip', 'gzip' or 'zstd' depending on the first bytes of the file, or None for plain JSON."""
+    with open(path, 'rb') as f:
+        magic = f.read(4)
+    if magic == ZIP_MAGIC: return "zip"
+    if magic.startswith(GZIP_MAGIC): return "gzip"
+    if magic == ZSTD_MAGIC: return "zstd"
+    return None
+
+def _find_timeline_member(archive, name=None):
+    """
+    The member of a zip archive holding the location history: `name` (its full path or file
+    name) when given, else the first one named like an export (TIMELINE_MEMBER_NAMES, e.g.
+    Takeout's 'Location History/Records.json'), else the largest .json file.
+    """
+    members = [info for info in archive.infolist() if not info.is_dir()]
+    if name:
+        for info in members:
+            if name in (info.filename, posixpath.basename(info.filename)):
+                return info
+        raise InputFileError(f"The archive has no member '{name}'.")
+    json_members = [info for info in members if info.filename.lower().endswith(".json")]
+    for wanted in TIMELINE_MEMBER_NAMES:
+        for info in json_members:
+            if posixpath.basename(info.filename).lower() == wanted:
+                return info
+    if json_members:
+        return max(json_members, key=lambda info: info.file_size)
+    raise InputFileError("The archive contains no .json file.")
+
+class _ReadAheadReader(io.RawIOBase):
+    """
+    Read-only stream over a file object that a background thread reads ahead of the consumer
+    in READ_AHEAD_BLOCK_SIZE blocks, at most READ_AHEAD_BLOCKS at a time. Decompressors release
+    the GIL, so a compressed source is inflated while the parser works. tell() counts the
+    bytes consumed; errors of the source are raised in the consumer.
+    """
+    def __init__(self, source):
+        self._source = source
+        self._blocks = queue.Queue(maxsize=READ_AHEAD_BLOCKS)
+        self._block = memoryview(b'')
+        self._position = 0
+        self._eof = False
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._read_ahead, name="read-ahead", daemon=True)
+        self._thread.start()
+
+    def _read_ahead(self):
+        try:
+            while not self._stopped.is_set():
+                block = self._source.read(READ_AHEAD_BLOCK_SIZE)
+                self._blocks.put(block)
+                if not block: return
+        except Exception as e:
+            self._blocks.put(e)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._block:
+            if self._eof: return 0
+            block = self._blocks.get()
+            if isinstance(block, Exception):
+                self._eof = True
+                raise block
+            if not block:
+                self._eof = True
+                return 0
+            self._block = memoryview(block)
+        n = min(len(buffer), len(self._block))
+        buffer[:n] = self._block[:n]
+        self._block = self._block[n:]
+        self._position += n
+        return n
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        if not self.closed:
+            # Unblock the thread if it waits on a full queue, then release the source.
+            self._stopped.set()
+            while self._thread.is_alive():
+                try:
+                    self._blocks.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            self._source.close()
+        super().close()
+
+@contextlib.contextmanager
+def _open_input(config):
+    """
+    Opens JSON_INPUT_FILE for parsing: a plain JSON file directly (through a _ReadAheadReader
+    with PIPELINE), a .gz or .zst file, or the timeline file of a .zip archive (see
+    ARCHIVE_MEMBER) through a _ReadAheadReader.
+    """
+    input_file = config["JSON_INPUT_FILE"]
+    compression = _input_compression(input_file)
+    if compression is None:
+        if not config["PIPELINE"]:
+            with open(input_file, 'rb') as f:
+                yield f
+        else:
+            with _ReadAheadReader(open(input_file, 'rb')) as reader:
+                yield reader
+        return
+
+    with contextlib.ExitStack() as stack:
+        if compression == "zip":
+            try:
+                archive = stack.enter_context(zipfile.ZipFile(input_file))
+            except zipfile.BadZipFile as e:
+                raise InputFileError(f"Damaged zip archive ({e}).") from e
+            member = _find_timeline_member(archive, config["ARCHIVE_MEMBER"])
+            print(f"[INFO] Reading '{member.filename}' from the archive "
+                  f"({member.file_size / 1024 / 1024:,.1f} MB uncompressed).")
+            source = archive.open(member)
+        elif compression == "gzip":
+            source = gzip.open(input_file, 'rb')
+        else:
+            if zstandard is None:
+                raise InputFileError("Reading .zst files requires the 'zstandard' package (pip install zstandard).")
+            source = zstandard.ZstdDecompressor().stream_reader(stack.enter_context(open(input_file, 'rb')))
+        print(f"[INFO] Decompressing {compression} input in a read-ahead thread.")
+        yield stack.enter_context(_ReadAheadReader(source))
+
+# --- Parallel ingestion by byte-range sharding ---
+# A raw newline can never appear inside a JSON string, so blocks cut at line ends never
+# split a string. That lets most of the boundary scan run on whole blocks with C-level
+# bytes/regex operations instead of walking the file token by token.
+SCAN_BLOCK_SIZE = 16 * 1024 * 1024
+SCAN_MAX_LINE = 256 * 1024 * 1024
+JSON_STRING_REGEX = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"')
+JSON_TOKEN_REGEX = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"|[\[\]{}]')
+# Maps opening brackets to +1 and closing ones to -1 (as signed bytes).
+_BRACKET_TABLE = bytes.maketrans(b'[{]}', b'\x01\x01\xff\xff')
+_NON_STRUCTURAL_BYTES = bytes(c for c in range(256) if c not in b'[]{}"\\')
+# Top-level array key (None for a root array) -> format name.
+ARRAY_FORMATS = {
+    None: 'root_array',
+    'locations': 'locations',
+    'semanticSegments': 'semanticSegments',
+    'timelineObjects': 'timelineObjects',
+}
+
+def _block_end(mm, pos, block_size):
+    """Returns the end of the scan block of at least `block_size` bytes starting at `pos`, cut just after a newline."""
+    if pos + block_size >= len(mm): return len(mm)
+    end = mm.find(b'\n', pos + block_size)
+    if end == -1 or end - pos > SCAN_MAX_LINE:
+        raise ValueError("no line breaks to split the file on (minified JSON?)")
+    return end + 1
+
+def _bracket_deltas(data):
+    """Returns the +1/-1 depth steps of every bracket in `data` (whole lines) that is not inside a string."""
+    # Reduce the data to its quotes and brackets. Without escapes, dropping adjacent quote
+    # pairs removes every string that holds no bracket; if no quote survives, none did.
+    skeleton = data.translate(None, _NON_STRUCTURAL_BYTES)
+    if b'\\' not in skeleton:
+        skeleton = skeleton.replace(b'""', b'')
+    if b'"' in skeleton:
+        # Escapes or brackets inside strings: strip the strings exactly (slower).
+        skeleton = JSON_STRING_REGEX.sub(b'', data).translate(None, _NON_STRUCTURAL_BYTES)
+    return memoryview(skeleton.translate(_BRACKET_TABLE)).cast('b')
+
+def _find_split(block, end_depth, array_depth):
+    """
+    Finds, scanning back from the end of `block`, the offset just after the last
+    item of the array at `array_depth` that closes inside it. `end_depth` is the
+    nesting depth at the end of the block. Returns None if no item closes in it.
+    """
+    line_end = len(block)
+    depth = end_depth
+    while line_end > 0:
+        line_start = block.rfind(b'\n', 0, line_end - 1) + 1
+        line = block[line_start:line_end]
+        depth -= sum(_bracket_deltas(line))
+        d, split = depth, None
+        for m in JSON_TOKEN_REGEX.finditer(line):
+            char = line[m.start()]
+            if char == 0x22: continue
+            if char in b'[{':
+                d += 1
+            else:
+                d -= 1
+                if d == array_depth: split = line_start + m.end()
+        if split is not None: return split
+        line_end = line_start
+    return None
+
+def _find_array_close(block, depth, array_depth):
+    """
+    Returns the offset in `block` of the bracket that closes the array at `array_depth`,
+    given the nesting depth at its start. The block is halved at line ends until
+    the closing line range is small, and only that range is walked token by token.
+    """
+    start, end = 0, len(block)
+    while end - start > 65536:
+        mid = block.find(b'\n', (start + end) // 2, end - 1)
+        if mid == -1: break
+        deltas = _bracket_deltas(block[start:mid + 1])
+        if deltas and depth + min(accumulate(deltas)) < array_depth:
+            end = mid + 1
+        else:
+            depth += sum(deltas)
+            start = mid + 1
+    for m in JSON_TOKEN_REGEX.finditer(block, start, end):
+        char = block[m.start()]
+        if char == 0x22: continue
+        depth += 1 if char in b'[{' else -1
+        if depth < array_depth: return m.start()
+    raise ValueError("array end not found")
+
+def _scan_array(mm, start, array_depth, shard_size):
+    """
+    Skips through the top-level array whose contents begin at offset `start`.
+    Returns (splits, end): offsets just after item boundaries at roughly `shard_size`
+    intervals (if shard_size is set), and the offset of the array's closing bracket.
+    Shards smaller than a scan block are cut from blocks of the shard size.
+    """
+    splits = []
+    last_split = pos = start
+    depth = array_depth
+    block_size = min(SCAN_BLOCK_SIZE, shard_size or SCAN_BLOCK_SIZE)
+    while pos < len(mm):
+        end = _block_end(mm, pos, block_size)
+        block = mm[pos:end]
+        deltas = _bracket_deltas(block)
+        if deltas and depth + min(accumulate(deltas)) < array_depth:
+            return splits, pos + _find_array_close(block, depth, array_depth)
+        depth += sum(deltas)
+        if shard_size and end - last_split >= shard_size:
+            if (split := _find_split(block, depth, array_depth)) is not None and pos + split > last_split:
+                last_split = pos + split
+                splits.append(last_split)
+        pos = end
+    raise ValueError("unterminated top-level array")
+
+def find_array_shards(input_file, shard_size):
+    """
+    Scans a JSON file for its top-level record arrays (the root array, or the
+    'locations', 'semanticSegments' and 'timelineObjects' arrays of a root object)
+    and splits each of them into byte ranges of whole records.
+    Returns a list of (format_name, [(start, end), ...]) in file order. The ranges hold
+    comma-separated items without the enclosing brackets. Raises ValueError if the
+    file cannot be sharded.
+    """
+    arrays = []
+    with open(input_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        depth, pos, last_string, root = 0, 0, None, None
+        while pos < len(mm):
+            end = _block_end(mm, pos, SCAN_BLOCK_SIZE)
+            block = mm[pos:end]
+            for m in JSON_TOKEN_REGEX.finditer(block):
+                char = block[m.start()]
+                if char == 0x22:
+                    last_string = m.group()
+                    continue
+                if char not in b'[{':
+                    depth -= 1
+                    continue
+                depth += 1
+                if root is None: root = char
+                if char != 0x5b or depth != (1 if root == 0x5b else 2): continue
+
+                # A top-level array: skip over it in bulk, recording shard boundaries if it is a known one.
+                key = None if depth == 1 else json.loads(last_string)
+                format_name = ARRAY_FORMATS.get(key)
+                array_start = pos + m.end()
+                splits, array_end = _scan_array(mm, array_start, depth, shard_size if format_name else None)
+                if format_name:
+                    bounds = [array_start] + splits + [array_end]
+                    ranges = []
+                    for range_start, range_end in zip(bounds, bounds[1:]):
+                        if range_start != array_start:
+                            # Every later range starts with the comma that separated it from the previous one.
+                            # A split after the last item (cut at a block edge) leaves no comma and no items.
+                            range_start = mm.find(b',', range_start, range_end) + 1
+                            if not range_start: continue
+                        ranges.append((range_start, range_end))
+                    arrays.append((format_name, ranges))
+                depth -= 1
+                pos = array_end + 1
+                break
+            else:
+                pos = end
+    return arrays
+
+class _ShardReader(io.RawIOBase):
+    """Read-only file object over the byte range of a shard, wrapped in '[' and ']' so it parses as an array."""
+
+    def __init__(self, file_handle, start, end):
+        self._file = file_handle
+        self._file.seek(start)
+        self._parts = [io.BytesIO(b'['), None, io.BytesIO(b']')]
+        self._remaining = end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while self._parts:
+            part = self._parts[0]
+            if part is None:
+                data = self._file.read(min(len(buffer), self._remaining))
+                self._remaining -= len(data)
+                if not data or not self._remaining: self._parts.pop(0)
+            else:
+                data = part.read(len(buffer))
+                if not data:
+                    self._parts.pop(0)
+                    continue
+            if data:
+                buffer[:len(data)] = data
+                return len(data)
+        return 0
+
+def _parse_shard(task):
+    """Worker entry point: parses one byte range of records with the format's handler."""
+    input_file, format_name, start, end, config = task
+    # Stops and straight runs can cross shard boundaries, so the parent thins the whole track
+    # (see _process_in_parallel); the shard keeps the raw points and the timestamps that needs.
+    points = PointBuffer(with_timestamps=_keeps_timestamps(config) or _thins_while_parsing(config))
+    # Each worker profiles its own shard, next to the main profile file.
+    with open(input_file, 'rb') as f, _profiled(config, suffix=f".{format_name}-{start}"):
+        reader = io.BufferedReader(_ShardReader(f, start, end), buffer_size=1024 * 1024)
+        points, stats = _process_records(reader, dict(config, THINNING=False), format_name, report_progress=False, points=points)
+    stats["bytes_read"] = end - start
+    return points, stats
+
+def _map_in_order(executor, function, tasks, window):
+    """
+    Like executor.map, but with at most `window` tasks submitted and not yet consumed, so
+    finished shards wait in the workers instead of piling up in this process.
+    """
+    pending = deque()
+    for task in tasks:
+        if len(pending) >= window:
+            yield pending.popleft().result()
+        pending.append(executor.submit(function, task))
+    while pending:
+        yield pending.popleft().result()
+
+def _process_in_parallel(input_file, arrays, config, workers, points_by_format, target=None):
+    """
+    Parses the shards of every record array in a process pool and merges their points,
+    in file order, into `points_by_format` (or into the `target` sink). With THINNING, the
+    merged track of each array goes through one TrajectoryThinner, as in a sequential parse.
+    """
+    tasks = [(input_file, format_name, start, end, config) for format_name, ranges in arrays for start, end in ranges]
+    names = ", ".join(f"'{format_name}'" for format_name, _ in arrays)
+    print(f"[INFO] Parsing {len(tasks)} shards of {names} records with {workers} worker processes...")
+    thinning = None # (format_name, thinner, points held before it) of the array being merged.
+
+    def finish_thinning():
+        format_name, thinner, points_before = thinning
+        thinner.flush()
+        emitted = len(points_by_format[format_name]) - points_before
+        METRICS.add_parser_stats(format_name, dict(_new_parser_stats(), points_emitted=emitted - thinner.received))
+        print(f"[INFO] Thinning kept {emitted:,} of {thinner.received:,} '{format_name}' points.")
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = _map_in_order(executor, _parse_shard, tasks, window=2 * workers)
+            for i, (task, (shard_points, stats)) in enumerate(zip(tasks, results)):
+                format_name = task[1]
+                METRICS.add_parser_stats(format_name, stats)
+                if format_name not in points_by_format:
+                    points_by_format[format_name] = target if target is not None else _new_point_buffer(config)
+                    if _thins_while_parsing(config):
+                        if thinning is not None: finish_thinning()
+                        points = points_by_format[format_name]
+                        thinning = (format_name, TrajectoryThinner(points, config), len(points))
+                if thinning is not None:
+                    _feed_thinner(thinning[1], shard_points)
+                else:
+                    points_by_format[format_name].extend(shard_points)
+                print(f"  [PROGRESS] {i+1}/{len(tasks)} shards merged ({len(points_by_format[format_name]):,} '{format_name}' points)...")
+    finally:
+        # Like a sequential parse, an interrupted one keeps the points read so far.
+        if thinning is not None: finish_thinning()
+
+def _worker_count(config):
+    """Number of parser processes requested in the config (0 means one per CPU core)."""
+    return config["PARALLEL_WORKERS"] or os.cpu_count() or 1
+
+def _plan_parallel_shards(input_file, config):
+    """
+    Returns the (format_name, byte ranges) of the record arrays to parse in parallel,
+    or None to parse sequentially (parallelism disabled, file too small, or not shardable).
+    """
+    if _worker_count(config) <= 1: return None
+    if _input_compression(input_file):
+        print("[INFO] Compressed input cannot be split into byte ranges. Parsing it in a single process.")
+        return None
+    shard_size = int(config["PARALLEL_SHARD_SIZE_MB"] * 1024 * 1024)
+    if os.path.getsize(input_file) < 2 * shard_size: return None
+    print("[INFO] Scanning record boundaries for parallel parsing...")
+    try:
+        arrays = find_array_shards(input_file, shard_size)
+    except ValueError as e:
+        print(f"[INFO] Parallel parsing unavailable ({e}). Falling back to a single process.")
+        return None
+    if any(len(ranges) > 1 for _, ranges in arrays):
+        return arrays
+    return None
+
+def _parse_input_file(config, target=None):
+    """
+    Extracts the points of every known record array in the input file, sharded across
+    worker processes for big files or in a single streaming pass otherwise.
+    Returns ({format_name: PointBuffer}, parse_complete), or None if the file cannot
+    be read or holds no known structure. A `target` sink with the append interface of
+    a PointBuffer (e.g. an ExternalAggregator) receives the points of every format instead.
+    """
+    input_file = config["JSON_INPUT_FILE"]
+    points_by_format = {}
+
+    try:
+        # Shard big files across worker processes when parallel parsing is enabled.
+        if arrays := _plan_parallel_shards(input_file, config):
+            _process_in_parallel(input_file, arrays, config, _worker_count(config), points_by_format, target)
+        else:
+            with _open_input(config) as f, _profiled(config):
+                _process_document(f, config, points_by_format, target)
+        if profile_file := config["PROFILE_OUTPUT_FILE"]:
+            saved_to = f"'{profile_file}.<format>-<offset>' (one per shard)" if arrays else f"'{profile_file}'"
+            print(f"[INFO] Parser profile saved to {saved_to}.")
+        if not points_by_format:
+            print("\n[ERROR] Could not determine JSON format. No known structure was identified.")
+            return None
+
+    except ijson.common.IncompleteJSONError as e:
+        print(f"\n[STRUCTURAL ERROR] A parsing error occurred: {e}")
+        print("  > ACTION: Proceeding with the data read so far.")
+        return points_by_format, False
+    except DAMAGED_INPUT_ERRORS as e:
+        # A truncated or corrupted compressed file; what was decompressed before is intact.
+        print(f"\n[STRUCTURAL ERROR] The compressed input is damaged: {e}")
+        print("  > ACTION: Proceeding with the data read so far.")
+        return points_by_format, False
+    except FileNotFoundError:
+        print(f"\n[FATAL ERROR] The input file '{input_file}' was not found.")
+        return None
+    except InputFileError as e:
+        print(f"\n[FATAL ERROR] Cannot read '{input_file}': {e}")
+        return None
+    except Exception as e:
+        print(f"\n[FATAL ERROR] An unexpected error occurred: {e}")
+        traceback.print_exc()
+        return None
+
+    return points_by_format, True
+
+def _load_cache_entry(config, cache_entry):
+    """The cached points of the input file (memory-mapped), or None on a cache miss."""
+    if not cache_entry or not os.path.exists(cache_entry) or config["CACHE_REFRESH"]:
+        return None
+    started = time.perf_counter()
+    points = load_points(cache_entry)
+    os.utime(cache_entry) # Mark the entry as recently used.
+    METRICS.note(cache_hit=True, points=len(points))
+    print(f"[INFO] Loaded {len(points):,} cached points from '{cache_entry}' "
+          f"in {(time.perf_counter() - started) * 1000:.1f} ms.")
+    return points
+
+@_metered_phase("extract")
+def extract_locations(config):
+    """
+    Extracts the points of the input file, from the parse cache when possible.
+    Handles all known formats: root array, 'locations', 'semanticSegments', or 'timelineObjects'.
+    """
+    print("\n--- [PHASE 1/3] Processing JSON File ---")
+    input_file = config["JSON_INPUT_FILE"]
+    print(f"[INFO] Starting to read '{input_file}'...")
+
+    cache_entry = _cache_entry_path(config)
+    if (points := _load_cache_entry(config, cache_entry)) is not None:
+        return points if points else None
+    fingerprint = None
+    if cache_entry is None and config["CACHE_DIR"] and os.path.isfile(input_file):
+        fingerprint = _hash_in_background(input_file)
+
+    parsed = _parse_input_file(config)
+    if parsed is None:
+        return None
+    points_by_format, parse_complete = parsed
+    points = PointBuffer.concatenate(points_by_format.values())
+    METRICS.note(cache_hit=False, input_bytes=os.path.getsize(input_file), points=len(points))
+
+    # --- Final Processing Report ---
+    print("\n[INFO] File analysis complete.")
+    print(f"  > Total coordinate points found: {len(points):,}")
+    print(f"  > Point storage size: {points.nbytes / 1024 / 1024:.2f} MB")
+
+    # Only cache complete results, so a damaged file is re-read (and reported) every time.
+    if fingerprint and parse_complete and (content_hash := fingerprint()):
+        cache_entry = _cache_entry_path(config, content_hash)
+    if cache_entry and parse_complete:
+        save_points(cache_entry, points)
+        _trim_cache(config)
+        print(f"[INFO] Points cached in '{cache_entry}'.")
+
+    if not points:
+        print("\n[WARNING] No location points were extracted. The HTML file will not be generated.")
+        return None
+    
+    return points
+
+@_metered_phase("extract")
+def extract_binned(config):
+    """
+    Phase 1 under MEMORY_LIMIT_MB or PIPELINE: streams the points of the input file (or of
+    its parse cache entry) into an ExternalAggregator instead of keeping them, writing
+    EXPORT_FILES on the way; with PIPELINE through the threads of a _PointPipe. Returns the
+    aggregator, to be finished by aggregate_points, or None if no point was extracted.
+    Nothing is cached, as the raw points are never held.
+    """
+    print("\n--- [PHASE 1/3] Processing JSON File ---")
+    input_file = config["JSON_INPUT_FILE"]
+    pipelined = bool(config["PIPELINE"])
+    mode = f"within {config['MEMORY_LIMIT_MB']:,} MB of aggregates" if config["MEMORY_LIMIT_MB"] else "binning points as they come"
+    print(f"[INFO] Starting to read '{input_file}' {mode}{' (pipelined)' if pipelined else ''}...")
+
+    with _open_exports(config) as exports:
+        # In the pipeline the exports get their own stage; otherwise the aggregator writes them.
+        bins = ExternalAggregator(config, timed=bool(config["TIME_SLIDER"]), exports=() if pipelined else exports)
+        with _PointPipe(config, bins, exports) if pipelined else contextlib.nullcontext(bins) as target:
+            if (points := _load_cache_entry(config, _cache_entry_path(config))) is not None:
+                target.extend(points)
+                parsed = True
+            else:
+                parsed = _parse_input_file(config, target=target) is not None
+        if not parsed:
+            # Unreadable input: drop whatever the exports received before the error.
+            for export in exports:
+                export.abort()
+            exports.clear()
+            return None
+        if points is None:
+            METRICS.note(cache_hit=False, input_bytes=os.path.getsize(input_file), points=len(bins))
+            print("\n[INFO] File analysis complete.")
+            print(f"  > Total coordinate points found: {len(bins):,}")
+        bins.flush() # The exports must have every point before they are completed.
+
+    if not bins:
+        print("\n[WARNING] No location points were extracted. The HTML file will not be generated.")
+        return None
+    return bins
+
+# --- Incremental location history ---
+# The store keeps every point ever merged, per source format, as a list of point files
+# ("segments") sorted by (timestamp, lat, lon). A merge only writes the points of the new
+# export that the store lacks, so a monthly refresh costs about as much as the new data.
+HISTORY_MANIFEST_FILE = "manifest.json"
+
+def _load_history_manifest(store_dir):
+    """Reads the store manifest: segments and high-water mark per format, and the merged exports."""
+    try:
+        with open(os.path.join(store_dir, HISTORY_MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"settings": None, "next_segment": 0, "formats": {}, "ingested": []}
+
+def _save_history_manifest(store_dir, manifest):
+    """Replaces the manifest atomically, so an interrupted merge leaves the previous state."""
+    path = os.path.join(store_dir, HISTORY_MANIFEST_FILE)
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+def _key_columns(keys):
+    """The (timestamps, lat, lon) columns of a list of (timestamp, lat, lon) keys."""
+    return (array('q', map(operator.itemgetter(0), keys)),
+            array('i', map(operator.itemgetter(1), keys)),
+            array('i', map(operator.itemgetter(2), keys)))
+
+def _merge_sorted_runs(runs):
+    """
+    Merges runs of (timestamps, lat, lon) columns, each sorted by (timestamp, lat, lon), and
+    yields the result as column chunks of at most CHUNK_SIZE points. Runs that already follow
+    one another (the usual case for time-ordered exports) are passed on slice by slice; only
+    interleaved runs are merged key by key.
+    """
+    runs = [run for run in runs if len(run[0])]
+    bounds = [((ts[0], lat[0], lon[0]), (ts[-1], lat[-1], lon[-1])) for ts, lat, lon in runs]
+    if all(previous[1] <= following[0] for previous, following in zip(bounds, bounds[1:])):
+        for ts, lat, lon in runs:
+            for start in range(0, len(ts), PointBuffer.CHUNK_SIZE):
+                stop = start + PointBuffer.CHUNK_SIZE
+                yield ts[start:stop], lat[start:stop], lon[start:stop]
+        return
+    keys = heapq.merge(*(zip(*run) for run in runs))
+    while batch := list(islice(keys, PointBuffer.CHUNK_SIZE)):
+        yield _key_columns(batch)
+
+def _sorted_history_runs(points):
+    """
+    Yields the timestamped `points` sorted by (timestamp, lat, lon), as column chunks. Each
+    chunk is sorted on its own, so key tuples are only built for one chunk at a time, and
+    chunks with strictly increasing timestamps are already in order and used as they are.
+    """
+    runs = []
+    for lat, lon, ts, _ in points.iter_chunks():
+        if all(map(operator.lt, ts, islice(ts, 1, None))):
+            runs.append((ts, lat, lon))
+        else:
+            runs.append(_key_columns(sorted(zip(ts, lat, lon))))
+    return _merge_sorted_runs(runs)
+
+def _new_history_runs(points, segments, high_water_mark):
+    """
+    Yields, sorted and as (timestamps, lat, lon) column chunks, the points of `points` that
+    the store does not hold yet. Points after the high-water mark are new by definition.
+    Earlier ones are merged against the stored points of the same time range, streamed in
+    order from the sorted segments; each stored point cancels one incoming copy, so
+    overlapping exports never add a point twice while repeated points within one export
+    are preserved.
+    """
+    runs = _sorted_history_runs(points)
+    first = min((min(ts) for _, _, ts, _ in points.iter_chunks() if len(ts)), default=None)
+    if first is None or first > high_water_mark:
+        yield from runs
+        return
+    # Segments are sorted by timestamp, so only the overlapping range of each is read.
+    ranges = []
+    for seg_lat, seg_lon, seg_ts in segments:
+        start = bisect_left(seg_ts, first)
+        stop = bisect_right(seg_ts, high_water_mark, start)
+        ranges.append(zip(seg_ts[start:stop], seg_lat[start:stop], seg_lon[start:stop]))
+    stored = heapq.merge(*ranges)
+    stored_key = next(stored, None)
+    for ts, lat, lon in runs:
+        overlap = bisect_right(ts, high_water_mark)
+        if overlap:
+            fresh = []
+            for key in zip(ts[:overlap], lat[:overlap], lon[:overlap]):
+                while stored_key is not None and stored_key < key:
+                    stored_key = next(stored, None)
+                if stored_key == key:
+                    stored_key = next(stored, None)
+                else:
+                    fresh.append(key)
+            if fresh: yield _key_columns(fresh)
+        if overlap < len(ts):
+            yield ts[overlap:], lat[overlap:], lon[overlap:]
+
+def _write_history_segment(store_dir, manifest, format_name, runs):
+    """
+    Streams sorted (timestamps, lat, lon) column chunks into a new segment file and returns
+    its manifest entry, or None (and no file) if they hold no point.
+    """
+    name = f"{format_name}-{manifest['next_segment']:06d}.points"
+    segment = _PointFileExport(os.path.join(store_dir, name), with_weights=False)
+    try:
+        for ts, lat, lon in runs:
+            segment.write((lat, lon, ts, None))
+    except BaseException:
+        segment.abort()
+        raise
+    if not segment.count:
+        segment.abort()
+        return None
+    segment.close()
+    manifest["next_segment"] += 1
+    return {"file": name, "points": segment.count}
+
+def _compact_history(store_dir, manifest, format_name):
+    """
+    Merges the newest segment into the previous one while that one is not much larger.
+    Segment sizes then grow geometrically: a format keeps O(log n) segments and each point is
+    rewritten O(log n) times overall, instead of the whole history on every merge.
+    """
+    entry = manifest["formats"][format_name]
+    segments = entry["segments"]
+    while len(segments) >= 2 and segments[-2]["points"] <= 2 * segments[-1]["points"]:
+        older, newer = segments[-2], segments[-1]
+        runs = []
+        for s in (older, newer):
+            lat, lon, ts, _ = _load_point_columns(os.path.join(store_dir, s["file"]))
+            runs.append((ts, lat, lon))
+        segments[-2:] = [_write_history_segment(store_dir, manifest, format_name, _merge_sorted_runs(runs))]
+        _save_history_manifest(store_dir, manifest)
+        del runs, lat, lon, ts # Release the mapped files before they are deleted.
+        for s in (older, newer):
+            os.remove(os.path.join(store_dir, s["file"]))
+
+def _merge_into_history(config, manifest, points_by_format):
+    """Adds the points of a parsed export that the store does not hold yet."""
+    store_dir = config["HISTORY_STORE_DIR"]
+    for format_name, points in points_by_format.items():
+        entry = manifest["formats"].setdefault(format_name, {"high_water_mark": None, "segments": []})
+        high_water_mark = entry["high_water_mark"]
+        segments = [
+            _load_point_columns(os.path.join(store_dir, s["file"]))[:3]
+            for s in entry["segments"]
+        ]
+        fresh = _new_history_runs(points, segments, float('-inf') if high_water_mark is None else high_water_mark)
+        segment = _write_history_segment(store_dir, manifest, format_name, fresh)
+        del fresh, segments
+        print(f"[INFO] '{format_name}': {segment['points'] if segment else 0:,} new of {len(points):,} points in this export.")
+        if segment is None: continue
+        entry["segments"].append(segment)
+        # Every point after the high-water mark is new, so the latest point of the export sets the new mark.
+        latest = max(max(ts) for _, _, ts, _ in points.iter_chunks() if len(ts))
+        entry["high_water_mark"] = latest if high_water_mark is None else max(latest, high_water_mark)
+        _save_history_manifest(store_dir, manifest)
+        _compact_history(store_dir, manifest, format_name)
+
+@_metered_phase("history")
+def update_history(config):
+    """
+    Merges the input export into the history store (HISTORY_STORE_DIR) and returns every
+    stored point as a memory-mapped PointBuffer. Exports that were merged before are
+    recognized by content hash and not parsed again.
+    """
+    print("\n--- [PHASE 1/3] Updating Location History ---")
+    store_dir = config["HISTORY_STORE_DIR"]
+    input_file = config["JSON_INPUT_FILE"]
+    os.makedirs(store_dir, exist_ok=True)
+    manifest = _load_history_manifest(store_dir)
+
+    settings = _extraction_settings(config)
+    if manifest["settings"] is None:
+        manifest["settings"] = settings
+    elif manifest["settings"] != settings:
+        print(f"\n[ERROR] The history in '{store_dir}' was built with different INCLUDE_* settings: {manifest['settings']}.")
+        print("  > ACTION: Restore those settings or use another HISTORY_STORE_DIR.")
+        return None
+
+    try:
+        content_hash = _file_content_hash(input_file)
+    except OSError:
+        content_hash = None # Reported by the parser below.
+    if content_hash in manifest["ingested"]:
+        print(f"[INFO] '{input_file}' was already merged into the history. Skipping it.")
+    else:
+        print(f"[INFO] Starting to read '{input_file}'...")
+        parsed = _parse_input_file(config)
+        if parsed is not None:
+            points_by_format, parse_complete = parsed
+            _merge_into_history(config, manifest, points_by_format)
+            # A damaged export is not marked as merged, so a repaired copy is read again.
+            if parse_complete:
+                manifest["ingested"].append(content_hash)
+            _save_history_manifest(store_dir, manifest)
+
+    points = PointBuffer.concatenate(
+        load_points(os.path.join(store_dir, s["file"]))
+        for entry in manifest["formats"].values()
+        for s in entry["segments"]
+    )
+    print("\n[INFO] History update complete.")
+    METRICS.note(points=len(points))
+    print(f"  > Total coordinate points stored: {len(points):,}")
+    if config["THINNING"]:
+        # The thinner needs the track in time order; segments are only sorted individually.
+        thinned = thin_points(config, _sorted_by_time(points))
+        print(f"  > Thinning kept {len(thinned):,} of {len(points):,} points.")
+        METRICS.note(points_thinned=len(thinned))
+        points = thinned
+    if not points:
+        print("\n[WARNING] The history holds no location points. The HTML file will not be generated.")
+        return None
+    return points
+
+# --- Time index ---
+# Periods are UTC calendar months or ISO weeks (starting on Monday). A timestamp of 0 means
+# the record had none; such points are kept apart and shown whatever the selected range.
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+WEEK_MS = 7 * 24 * 3600 * 1000
+FIRST_MONDAY_MS = -3 * 24 * 3600 * 1000 # 1969-12-29, the Monday before the epoch.
+TIME_BLOCK_PERIODS = ("month", "week")
+
+def _period_starts(period, first_ms, last_ms):
+    """Start times (epoch milliseconds) of the consecutive periods covering [first_ms, last_ms]."""
+    if period == "week":
+        start = (first_ms - FIRST_MONDAY_MS) // WEEK_MS * WEEK_MS + FIRST_MONDAY_MS
+        return list(range(start, last_ms + 1, WEEK_MS))
+    if period != "month":
+        raise ValueError(f"Unknown TIME_BLOCK_PERIOD '{period}' (expected 'month' or 'week').")
+    first = EPOCH + timedelta(milliseconds=first_ms)
+    last = EPOCH + timedelta(milliseconds=last_ms)
+    starts = []
+    year, month = first.year, first.month
+    while (year, month) <= (last.year, last.month):
+        starts.append((datetime(year, month, 1, tzinfo=timezone.utc) - EPOCH) // timedelta(milliseconds=1))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return starts
+
+def period_label(period, start_ms):
+    """Slider label of the period starting at `start_ms`, e.g. '2021-03' or '2021-03-01' for weeks."""
+    moment = EPOCH + timedelta(milliseconds=start_ms)
+    return moment.strftime("%Y-%m" if period == "month" else "%Y-%m-%d")
+
+def _sorted_by_time(points):
+    """Returns `points` ordered by timestamp (the buffer itself if it already is)."""
+    lat, lon, ts, weight = array('i'), array('i'), array('q'), array('d')
+    for chunk in points.iter_chunks():
+        lat.extend(chunk[0])
+        lon.extend(chunk[1])
+        ts.extend(chunk[2])
+        if points.with_weights: weight.extend(chunk[3])
+    if all(map(operator.le, ts, islice(ts, 1, None))):
+        return points
+    order = sorted(range(len(ts)), key=ts.__getitem__)
+    return PointBuffer.from_columns(
+        array('i', map(lat.__getitem__, order)),
+        array('i', map(lon.__getitem__, order)),
+        array('q', map(ts.__getitem__, order)),
+        array('d', map(weight.__getitem__, order)) if points.with_weights else None,
+    )
+
+def build_time_index(config, points):
+    """
+    Splits timestamped points into consecutive TIME_BLOCK_PERIOD periods.
+    Returns (period_starts, blocks, undated): blocks[i] holds the points of the period
+    starting at period_starts[i], sorted by time, and `undated` the points without a timestamp.
+    Chunks that are already in time order (the usual case) are split with binary searches
+    and copied slice by slice; only out-of-order chunks are distributed point by point.
+    """
+    period = config["TIME_BLOCK_PERIOD"]
+    first, last = None, 0
+    for _, _, ts, _ in points.iter_chunks():
+        if (earliest := min(filter(None, ts), default=None)) is not None:
+            first = earliest if first is None else min(first, earliest)
+            last = max(last, max(ts))
+    starts = _period_starts(period, first, last) if first is not None else []
+    blocks = [PointBuffer(with_timestamps=True, with_weights=points.with_weights) for _ in starts]
+    undated = PointBuffer(with_timestamps=True, with_weights=points.with_weights)
+    locate = partial(bisect_right, starts)
+
+    for lat, lon, ts, weight in points.iter_chunks():
+        if not len(ts): continue
+        if ts[0] and all(map(operator.le, ts, islice(ts, 1, None))):
+            start = 0
+            while start < len(ts):
+                index = locate(ts[start]) - 1
+                stop = len(ts) if index + 1 == len(starts) else bisect_left(ts, starts[index + 1], start)
+                blocks[index].extend(PointBuffer.from_columns(
+                    lat[start:stop], lon[start:stop], ts[start:stop],
+                    weight[start:stop] if weight is not None else None
+                ))
+                start = stop
+            continue
+        for lat_e7, lon_e7, timestamp, w in zip(lat, lon, ts, weight if weight is not None else repeat(1.0)):
+            target = blocks[locate(timestamp) - 1] if timestamp else undated
+            target.append_e7(lat_e7, lon_e7, timestamp, w)
+    return starts, [_sorted_by_time(block) for block in blocks], undated
+
+def pixel_cell_size_e7(zoom):
+    """Size in E7 units of one 256px-tile pixel of longitude at `zoom`."""
+    return max(1, round(360 / (256 * 2 ** zoom) * 1e7))
+
+def grid_cell_size_e7(config):
+    """
+    Returns the aggregation cell size in E7 units, or None if aggregation is disabled.
+    In 'pixel' mode a cell spans one pixel at HEATMAP_MAX_ZOOM, the finest detail the heatmap ever draws.
+    """
+    grid = config["AGGREGATION_GRID"]
+    if grid is None: return None
+    if grid == "pixel": return pixel_cell_size_e7(config["HEATMAP_MAX_ZOOM"])
+    return max(1, round(float(grid) * 1e7))
+
+def _cell_center_e7(index, cell):
+    """E7 coordinate of the center of grid cell `index`."""
+    return index * cell + cell // 2
+
+@_metered_phase("aggregate")
+def aggregate_points(config, points):
+    """
+    Snaps points to the configured grid and merges each cell into one weighted point,
+    returned as a new PointBuffer with a weight column ([lat, lon, weight] for leaflet.heat).
+    Cells are counted in a hash table; for unweighted chunks the whole loop runs inside
+    Counter.update, so tens of millions of points aggregate in seconds.
+    `points` can also be the ExternalAggregator of extract_binned, which is merged instead;
+    under MEMORY_LIMIT_MB a PointBuffer goes through one too, so the table stays bounded.
+    """
+    cell = grid_cell_size_e7(config)
+    METRICS.note(points_in=len(points), points_out=len(points))
+    if cell is None: return points
+    print(f"\n[INFO] Aggregating points on a {cell / 1e7:.7g} degree grid...")
+    if isinstance(points, ExternalAggregator):
+        aggregated = points.finish()
+    elif _bounded_memory(config):
+        bins = ExternalAggregator(config, timed=bool(config["TIME_SLIDER"] and points.with_timestamps))
+        bins.extend(points)
+        aggregated = bins.finish()
+    elif config["TIME_SLIDER"] and points.with_timestamps:
+        # Cells are merged within each time period only; the merged points carry the period's start.
+        starts, blocks, undated = build_time_index(config, points)
+        aggregated = PointBuffer.concatenate(
+            [_aggregate_to_cells(undated, cell, timestamp=0)] +
+            [_aggregate_to_cells(block, cell, timestamp=start) for start, block in zip(starts, blocks) if block]
+        )
+    else:
+        aggregated = _aggregate_to_cells(points, cell)
+    METRICS.note(points_out=len(aggregated))
+    print(f"  > {len(points):,} points merged into {len(aggregated):,} weighted points "
+          f"({len(points) / max(len(aggregated), 1):.1f}x fewer).")
+    return aggregated
+
+def _aggregate_to_cells(points, cell, timestamp=None):
+    """
+    Merges the points of each `cell`-sized grid cell (E7 units) into one weighted point at its center.
+    A `timestamp` is stored on every merged point (the result then has a timestamp column).
+    """
+    counts = Counter()
+    to_cell = cell.__rfloordiv__ # to_cell(x) == x // cell
+    for lat, lon, _, weight in points.iter_chunks():
+        cells = zip(map(to_cell, lat), map(to_cell, lon))
+        if weight is None:
+            counts.update(cells)
+        else:
+            for key, w in zip(cells, weight):
+                counts[key] += w
+
+    aggregated = PointBuffer(with_timestamps=timestamp is not None, with_weights=True)
+    for (lat_cell, lon_cell), weight in sorted(counts.items()):
+        aggregated.append_e7(
+            min(max(_cell_center_e7(lat_cell, cell), -900000000), 900000000),
+            min(max(_cell_center_e7(lon_cell, cell), -1800000000), 1800000000),
+            timestamp or 0, weight
+        )
+    return aggregated
+
+PYRAMID_BLOCK_ZOOMS = 4 # A pyramid block spans at least 2^4 x 2^4 map tiles of its level...
+PYRAMID_BLOCK_POINTS = 4096 # ...and a level is cut into at most one block per this many points.
+
+def _pyramid_tile_zoom(tile_keys, zoom, point_count):
+    """
+    Picks the zoom of the tiles a pyramid level at `zoom` is cut into, given the tile keys
+    its points fall in at `zoom` - PYRAMID_BLOCK_ZOOMS. Coarser tiles are used until the level
+    has at most one block per PYRAMID_BLOCK_POINTS points, so the page size stays proportional
+    to the point count instead of to the area covered.
+    """
+    tile_zoom = max(0, zoom - PYRAMID_BLOCK_ZOOMS)
+    max_blocks = max(1, point_count // PYRAMID_BLOCK_POINTS)
+    while tile_zoom > 0 and len(tile_keys) > max_blocks:
+        tile_zoom -= 1
+        tile_keys = {(ty >> 1, tx >> 1) for ty, tx in tile_keys}
+    return tile_zoom
+
+def build_zoom_pyramid(config, points, report=True):
+    """
+    Builds the multi-resolution pyramid: one aggregated level every PYRAMID_ZOOM_STEP zooms
+    from HEATMAP_MAX_ZOOM down to 0, each with pixel-sized cells for its zoom and split into
+    tiles of 360 / 2^tz degrees (see _pyramid_tile_zoom). Each level is aggregated from the
+    previous, finer one. Returns a list of ({'z', 'tz', 'ty', 'tx'}, PointBuffer) blocks.
+    """
+    max_zoom = config["HEATMAP_MAX_ZOOM"]
+    step = max(1, config["PYRAMID_ZOOM_STEP"])
+    if report: print(f"\n[INFO] Building zoom pyramid (levels every {step} zooms up to {max_zoom})...")
+    blocks = []
+    level = points
+    for zoom in range(max_zoom, -1, -step):
+        level = _aggregate_to_cells(level, pixel_cell_size_e7(zoom))
+        tile_e7 = 360e7 / 2 ** max(0, zoom - PYRAMID_BLOCK_ZOOMS)
+        tile_keys = set()
+        for lat, lon, _, _ in level.iter_chunks():
+            tile_keys.update(zip((math.floor(v / tile_e7) for v in lat), (math.floor(v / tile_e7) for v in lon)))
+        tile_zoom = _pyramid_tile_zoom(tile_keys, zoom, len(level))
+        tile_e7 = 360e7 / 2 ** tile_zoom
+        tiles = {}
+        for lat, lon, _, weight in level.iter_chunks():
+            for lat_e7, lon_e7, w in zip(lat, lon, weight):
+                key = (math.floor(lat_e7 / tile_e7), math.floor(lon_e7 / tile_e7))
+                if (tile := tiles.get(key)) is None:
+                    tile = tiles[key] = PointBuffer(with_weights=True)
+                tile.append_e7(lat_e7, lon_e7, weight=w)
+        for (ty, tx), tile in tiles.items():
+            blocks.append(({"z": zoom, "tz": tile_zoom, "ty": ty, "tx": tx}, tile))
+        if report: print(f"  > Zoom {zoom:2d}: {len(level):,} weighted points in {len(tiles):,} tiles of zoom {tile_zoom}.")
+    return blocks
+
+# --- Bounded-memory aggregation ---
+# With MEMORY_LIMIT_MB, points are binned into grid cells as they are parsed instead of being
+# kept. Whenever the bin table outgrows the limit it is written to a temporary file ("run")
+# sorted by cell, and the runs are merged at the end. Cells sort by (period start, lat, lon),
+# the order in which aggregate_points emits them, so both paths give the same points.
+BIN_RECORD = struct.Struct('<qiid') # Period start (ms), lat cell, lon cell, weight.
+BIN_ENTRY_BYTES = 200 # Approximate memory of one bin table entry: the dict slot, its key tuple and ints.
+UNDATED_PERIOD = -2 ** 63 # Period key of points without a timestamp, which aggregate_points emits first.
+DAY_MS = 24 * 3600 * 1000
+
+def _bounded_memory(config):
+    """Whether points are binned while parsing under MEMORY_LIMIT_MB (aggregation must be enabled)."""
+    return bool(config["MEMORY_LIMIT_MB"]) and grid_cell_size_e7(config) is not None
+
+def _bins_while_parsing(config):
+    """
+    Whether Phase 1 bins the points as they are parsed (extract_binned) instead of keeping
+    them: under MEMORY_LIMIT_MB or PIPELINE, with aggregation enabled and no history store.
+    """
+    if config["HISTORY_STORE_DIR"] or grid_cell_size_e7(config) is None: return False
+    return bool(config["MEMORY_LIMIT_MB"] or config["PIPELINE"])
+
+def _period_start(period, timestamp_ms):
+    """Start (epoch milliseconds) of the TIME_BLOCK_PERIOD period containing `timestamp_ms`."""
+    return _period_starts(period, timestamp_ms, timestamp_ms)[0]
+
+class ExternalAggregator:
+    """
+    Point sink with the append interface of a PointBuffer that snaps points to the aggregation
+    grid as they arrive, keeping at most MEMORY_LIMIT_MB of cells in memory (no limit if unset)
+    and spilling sorted runs to SPILL_DIR beyond that. With `timed`, cells are kept apart per TIME_BLOCK_PERIOD
+    like the time slider needs. Incoming points are also written to the `exports` writers
+    (see _open_exports) on their way in. len() is the number of points received; call finish()
+    once they are all in to get the aggregated PointBuffer.
+    """
+    with_weights = True
+
+    def __init__(self, config, timed=False, exports=()):
+        self.timed = timed
+        self.exports = exports
+        self.with_timestamps = timed or bool(exports) # Tells the processors to extract timestamps.
+        self.cell = grid_cell_size_e7(config)
+        self.period = config["TIME_BLOCK_PERIOD"]
+        limit_mb = config["MEMORY_LIMIT_MB"]
+        self.max_cells = max(PointBuffer.CHUNK_SIZE, int(limit_mb * 1024 * 1024) // BIN_ENTRY_BYTES) if limit_mb else sys.maxsize
+        self.spill_dir = config["SPILL_DIR"]
+        self.received = 0
+        self.spilled_bytes = 0
+        self._counts = Counter()
+        self._pending = PointBuffer(with_timestamps=self.with_timestamps, with_weights=True)
+        self._period_by_day = {}
+        self._runs = []
+        self._temp_dir = None # A TemporaryDirectory, created on the first spill.
+
+    def __len__(self):
+        return self.received
+
+    def append_e7(self, lat_e7, lon_e7, timestamp=0, weight=1.0):
+        """Adds one point given as E7 integers (degrees * 10^7)."""
+        self._pending.append_e7(lat_e7, lon_e7, timestamp, weight)
+        self.received += 1
+        if len(self._pending) >= PointBuffer.CHUNK_SIZE:
+            self.flush()
+
+    def append(self, lat, lon, timestamp=0, weight=1.0):
+        """Adds one point given in decimal degrees."""
+        self.append_e7(round(lat * 1e7), round(lon * 1e7), timestamp, weight)
+
+    def extend(self, points):
+        """Adds every point of a PointBuffer, a whole chunk at a time."""
+        self.received += len(points)
+        self._fold(points)
+
+    def _period_key(self, timestamp):
+        if not timestamp: return UNDATED_PERIOD
+        day = timestamp // DAY_MS
+        if (start := self._period_by_day.get(day)) is None:
+            start = self._period_by_day[day] = _period_start(self.period, timestamp)
+        return start
+
+    def _fold(self, points):
+        """Adds the points of a PointBuffer to the bin table, spilling it when it is full."""
+        to_cell = self.cell.__rfloordiv__ # to_cell(x) == x // cell
+        for chunk in points.iter_chunks():
+            for export in self.exports:
+                export.write(chunk)
+            lat, lon, ts, weight = chunk
+            periods = map(self._period_key, ts) if self.timed and ts is not None else repeat(0)
+            cells = zip(periods, map(to_cell, lat), map(to_cell, lon))
+            if weight is None:
+                self._counts.update(cells)
+            else:
+                counts = self._counts
+                for key, w in zip(cells, weight):
+                    counts[key] += w
+            if len(self._counts) >= self.max_cells:
+                self._spill()
+
+    def _spill(self):
+        """Writes the bin table to a new run file, sorted by cell, and empties it."""
+        if self._temp_dir is None:
+            self._temp_dir = tempfile.TemporaryDirectory(prefix="heatmap-bins-", dir=self.spill_dir)
+        path = os.path.join(self._temp_dir.name, f"run-{len(self._runs):05d}.bin")
+        counts, pack = self._counts, BIN_RECORD.pack
+        with open(path, 'wb', buffering=HTML_WRITE_BUFFER_SIZE) as f:
+            for key in sorted(counts):
+                f.write(pack(*key, counts[key]))
+        self._runs.append(path)
+        self.spilled_bytes += os.path.getsize(path)
+        print(f"  [PROGRESS] Memory limit reached: {len(counts):,} cells spilled to disk (run {len(self._runs)}).")
+        self._counts = Counter()
+
+    @staticmethod
+    def _read_run(path):
+        """Yields the (key, weight) pairs of a run file in their sorted order."""
+        with open(path, 'rb') as f:
+            while data := f.read(BIN_RECORD.size * 4096):
+                for start, lat_cell, lon_cell, weight in BIN_RECORD.iter_unpack(data):
+                    yield (start, lat_cell, lon_cell), weight
+
+    def flush(self):
+        """Bins (and exports) the points appended since the last full chunk."""
+        self._fold(self._pending)
+        self._pending = PointBuffer(with_timestamps=self.with_timestamps, with_weights=True)
+
+    def finish(self):
+        """
+        Merges the spilled runs and the cells still in memory into one weighted point per cell,
+        in the order aggregate_points would produce them, and deletes the run files.
+        """
+        self.flush()
+        counts = self._counts
+        sources = [self._read_run(path) for path in self._runs]
+        sources.append((key, counts[key]) for key in sorted(counts))
+        if self._runs:
+            print(f"[INFO] Merging {len(self._runs)} spilled runs ({self.spilled_bytes / 1024 / 1024:.1f} MB) with the cells in memory...")
+
+        aggregated = PointBuffer(with_timestamps=self.with_timestamps, with_weights=True)
+        cell = self.cell
+        try:
+            merged = heapq.merge(*sources, key=operator.itemgetter(0))
+            for (start, lat_cell, lon_cell), group in groupby(merged, key=operator.itemgetter(0)):
+                aggregated.append_e7(
+                    min(max(_cell_center_e7(lat_cell, cell), -900000000), 900000000),
+                    min(max(_cell_center_e7(lon_cell, cell), -1800000000), 1800000000),
+                    0 if start == UNDATED_PERIOD else start,
+                    sum(weight for _, weight in group)
+                )
+        finally:
+            self._counts = Counter()
+            if self._temp_dir is not None:
+                self._temp_dir.cleanup()
+                self._temp_dir = None
+            self._runs = []
+        return aggregated
+
+# --- Pipelined extraction ---
+# With PIPELINE, Phase 1 runs as a chain of threads joined by bounded queues instead of one
+# step after the other: a reader thread reads (and decompresses) the file ahead of the parser,
+# the parser batches points into chunks, and each chunk goes on to a transform stage, which
+# bins it into the aggregation grid, and a write stage, which streams it to EXPORT_FILES. The
+# queues hold at most PIPELINE_QUEUE_CHUNKS chunks, so raw points are never all in memory and
+# the exports are written while the file is still being read.
+
+class _PipelineStage:
+    """
+    A thread calling `function` on every item put on its bounded queue, in order. An error
+    stops the processing (later items are drained and dropped, so producers never block)
+    and is raised by close(), which waits for the queue to empty.
+    """
+    def __init__(self, name, function, depth):
+        self.name = name
+        self.busy_s = 0.0
+        self._function = function
+        self._items = queue.Queue(maxsize=max(1, depth))
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while (item := self._items.get()) is not None:
+            if self._error is not None: continue
+            started = time.perf_counter()
+            try:
+                self._function(item)
+            except BaseException as e:
+                self._error = e
+            self.busy_s += time.perf_counter() - started
+
+    def put(self, item):
+        self._items.put(item)
+
+    def close(self):
+        self._items.put(None)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+class _ChunkBatcher(abc.ABC):
+    """
+    Base of the parse targets that pass points on in chunks: has the append interface of a
+    PointBuffer, batches points into PointBuffer chunks of CHUNK_SIZE and hands each one to
+    _send(), which subclasses must implement.
+    """
+    def __init__(self, config):
+        self._config = config
+        self._tail = _new_point_buffer(config)
+        self.with_timestamps = self._tail.with_timestamps
+        self.with_weights = self._tail.with_weights
+        self.received = 0
+
+    def __len__(self):
+        return self.received
+
+    @abc.abstractmethod
+    def _send(self, points):
+        """Passes a PointBuffer of points on."""
+
+    def flush(self):
+        """Sends the points appended since the last full chunk."""
+        tail, self._tail = self._tail, _new_point_buffer(self._config)
+        if tail: self._send(tail)
+
+    def append_e7(self, lat_e7, lon_e7, timestamp=0, weight=1.0):
+        """Adds one point given as E7 integers (degrees * 10^7)."""
+        self._tail.append_e7(lat_e7, lon_e7, timestamp, weight)
+        self.received += 1
+        if len(self._tail) >= PointBuffer.CHUNK_SIZE:
+            self.flush()
+
+    def append(self, lat, lon, timestamp=0, weight=1.0):
+        """Adds one point given in decimal degrees."""
+        self.append_e7(round(lat * 1e7), round(lon * 1e7), timestamp, weight)
+
+    def extend(self, points):
+        """Passes every point of a PointBuffer on, after the ones appended so far."""
+        self.flush()
+        self.received += len(points)
+        if points: self._send(points)
+
+class _PointPipe(_ChunkBatcher):
+    """
+    Parse target that hands each full chunk of points to the pipeline stages: binning
+    into `bins` and, when there are any, writing to `exports`. Use as a context manager;
+    leaving it flushes the last chunk and waits for the stages.
+    """
+    def __init__(self, config, bins, exports):
+        super().__init__(config)
+        depth = config["PIPELINE_QUEUE_CHUNKS"]
+        self._stages = [_PipelineStage("transform", bins.extend, depth)]
+        if exports:
+            self._stages.append(_PipelineStage("write", partial(_write_exports, exports), depth))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+        error = None
+        for stage in self._stages:
+            try:
+                stage.close()
+            except BaseException as e:
+                error = error or e
+        METRICS.note(**{f"{stage.name}_busy_s": round(stage.busy_s, 4) for stage in self._stages})
+        if error is not None and exc_type is None:
+            raise error
+        return False
+
+    def _send(self, points):
+        for stage in self._stages:
+            stage.put(points)
+
+def _write_exports(exports, points):
+    """Write stage of the pipeline: appends the points of a PointBuffer to every export."""
+    for chunk in points.iter_chunks():
+        for export in exports:
+            export.write(chunk)
+
+# --- Raster tiles ---
+# Reproduces what leaflet.heat draws, server-side: points are merged into cells of half the
+# point extent, each cell stamps a blurred disc whose opacity grows with its weight, the
+# stamps are alpha-composited and the final opacity is mapped through the gradient.
+# Tiles are standard Web Mercator {z}/{x}/{y} tiles of 256 pixels.
+
+TILE_SIZE = 256
+MAX_MERCATOR_LAT = 85.0511287798
+TRANSPARENT_TILE_ALPHA = 1 / 255 # Stamps fainter than this never reach a visible pixel.
+
+CSS_COLORS = {
+    'black': (0, 0, 0), 'white': (255, 255, 255), 'red': (255, 0, 0), 'lime': (0, 255, 0),
+    'blue': (0, 0, 255), 'yellow': (255, 255, 0), 'cyan': (0, 255, 255), 'aqua': (0, 255, 255),
+    'magenta': (255, 0, 255), 'fuchsia': (255, 0, 255), 'silver': (192, 192, 192), 'gray': (128, 128, 128),
+    'grey': (128, 128, 128), 'maroon': (128, 0, 0), 'olive': (128, 128, 0), 'green': (0, 128, 0),
+    'purple': (128, 0, 128), 'teal': (0, 128, 128), 'navy': (0, 0, 128), 'orange': (255, 165, 0),
+    'gold': (255, 215, 0), 'pink': (255, 192, 203), 'brown': (165, 42, 42), 'violet': (238, 130, 238),
+    'indigo': (75, 0, 130),
+}
+
+def _parse_css_color(color):
+    """RGB tuple of a CSS color name, '#rgb', '#rrggbb' or 'rgb(r, g, b)' string."""
+    text = color.strip().lower()
+    if text in CSS_COLORS: return CSS_COLORS[text]
+    if text.startswith('#') and len(text) in (4, 7):
+        digits = text[1:] if len(text) == 7 else "".join(c * 2 for c in text[1:])
+        return tuple(int(digits[i:i + 2], 16) for i in (0, 2, 4))
+    if match := re.fullmatch(r'rgba?\(\s*(\d+)\s*,\s*(\d+)\s*,\s*(\d+)\s*(?:,[^)]*)?\)', text):
+        return tuple(min(int(c), 255) for c in match.groups())
+    raise ValueError(f"Unsupported HEATMAP_GRADIENT color '{color}'.")
+
+def _gradient_palette(gradient):
+    """Red, green and blue translation tables mapping a pixel's opacity (0-255) to its gradient color."""
+    stops = sorted((float(stop), _parse_css_color(color)) for stop, color in gradient.items())
+    channels = [bytearray(256) for _ in range(3)]
+    for i in range(256):
+        t = i / 255
+        upper = bisect_left([stop for stop, _ in stops], t)
+        if upper == 0: rgb = stops[0][1]
+        elif upper == len(stops): rgb = stops[-1][1]
+        else:
+            (t0, c0), (t1, c1) = stops[upper - 1], stops[upper]
+            f = (t - t0) / (t1 - t0)
+            rgb = tuple(round(a + (b - a) * f) for a, b in zip(c0, c1))
+        for channel, value in zip(channels, rgb):
+            channel[i] = value
+    return tuple(bytes(channel) for channel in channels)
+
+def _disc_kernel(radius, blur):
+    """
+    Opacity (0-1) of one point's stamp: a disc of `radius` pixels blurred by a Gaussian of
+    sigma blur/2 (the canvas shadow leaflet.heat uses), over a square of 2*(radius+blur)+1 pixels.
+    """
+    extent = radius + blur
+    size = 2 * extent + 1
+    disc = [[1.0 if (x - extent) ** 2 + (y - extent) ** 2 <= radius * radius else 0.0 for x in range(size)] for y in range(size)]
+    sigma = max(blur / 2, 0.5)
+    taps = [math.exp(-(d * d) / (2 * sigma * sigma)) for d in range(-extent, extent + 1)]
+    total = sum(taps)
+    taps = [t / total for t in taps]
+
+    def blur_rows(rows):
+        return [[sum(row[x + d - extent] * taps[d] for d in range(size) if 0 <= x + d - extent < size) for x in range(size)] for row in rows]
+
+    blurred = blur_rows(disc)
+    blurred = [list(column) for column in zip(*blur_rows([list(column) for column in zip(*blurred)]))]
+    return [min(value, 1.0) for row in blurred for value in row]
+
+_stamp_cache = {}
+
+def _stamp_rows(radius, blur, level):
+    """
+    Rows of one stamp at opacity level `level` (1-255) as -ln(1 - alpha) terms: source-over
+    compositing multiplies transparencies, so in log space the stamps of a tile simply add up.
+    Cached per worker process, as a tile reuses the same few levels many times.
+    """
+    key = (radius, blur, level)
+    if (rows := _stamp_cache.get(key)) is None:
+        if (kernel := _stamp_cache.get((radius, blur))) is None:
+            kernel = _stamp_cache[(radius, blur)] = _disc_kernel(radius, blur)
+        size = 2 * (radius + blur) + 1
+        alpha = level / 255
+        terms = array('d', (-math.log(1 - min(alpha * k, 0.999)) for k in kernel))
+        rows = _stamp_cache[key] = [terms[y * size:(y + 1) * size] for y in range(size)]
+    return rows
+
+def _png_bytes(width, height, rgba):
+    """Encodes 8-bit RGBA pixels as a PNG file."""
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    stride = width * 4
+    raw = b''.join(b'\x00' + rgba[y * stride:(y + 1) * stride] for y in range(height)) # Filter type 0 per scanline.
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw, 6))
+            + chunk(b'IEND', b''))
+
+def _render_tile(task):
+    """
+    Worker entry point: renders the stamps of one tile and writes it as a PNG.
+    Returns True if the tile was written, False if it was fully transparent.
+    """
+    path, stamps, radius, blur, palette = task
+    extent = radius + blur
+    size = 2 * extent + 1
+    add = operator.add
+
+    log_transparency = array('d', bytes(8 * TILE_SIZE * TILE_SIZE))
+    for x, y, level in stamps:
+        rows = _stamp_rows(radius, blur, level)
+        left, top = round(x) - extent, round(y) - extent
+        start, stop = max(left, 0), min(left + size, TILE_SIZE)
+        if start >= stop: continue
+        for row_index in range(max(top, 0), min(top + size, TILE_SIZE)):
+            row = rows[row_index - top][start - left:stop - left]
+            offset = row_index * TILE_SIZE
+            log_transparency[offset + start:offset + stop] = array('d', map(add, log_transparency[offset + start:offset + stop], row))
+
+    alpha = bytes(min(int((1 - math.exp(-s)) * 255), 255) for s in log_transparency)
+    if not alpha.strip(b'\x00'):
+        return False
+    rgba = bytearray(4 * len(alpha))
+    for channel, table in enumerate(palette):
+        rgba[channel::4] = alpha.translate(table)
+    rgba[3::4] = alpha
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(_png_bytes(TILE_SIZE, TILE_SIZE, bytes(rgba)))
+    return True
+
+def _heat_cells(points, zoom, cell_size):
+    """
+    Merges points into leaflet.heat's grid of `cell_size` pixels at `zoom`, as
+    {(cell x, cell y): [sum of x * weight, sum of y * weight, sum of weights]} in world pixels.
+    """
+    world = TILE_SIZE * 2 ** zoom
+    radians_per_e7 = math.pi / 180e7
+    limit = math.sin(math.radians(MAX_MERCATOR_LAT))
+    cells = {}
+    for lat, lon, _, weight in points.iter_chunks():
+        xs = [(lon_e7 / 1e7 + 180) / 360 * world for lon_e7 in lon]
+        sines = [math.sin(lat_e7 * radians_per_e7) for lat_e7 in lat]
+        sines = [s if -limit < s < limit else math.copysign(limit, s) for s in sines]
+        ys = [(0.5 - math.log((1 + s) / (1 - s)) / (4 * math.pi)) * world for s in sines]
+        for x, y, w in zip(xs, ys, weight if weight is not None else repeat(1.0)):
+            key = (int(x // cell_size), int(y // cell_size))
+            if (cell := cells.get(key)) is None:
+                cells[key] = [x * w, y * w, w]
+            else:
+                cell[0] += x * w
+                cell[1] += y * w
+                cell[2] += w
+    return cells
+
+def _coarser_heat_cells(cells, cell_size):
+    """The cells one zoom level out: pixel coordinates halve and each cell joins the grid cell of its center."""
+    coarser = {}
+    for sum_x, sum_y, total in cells.values():
+        sum_x, sum_y = sum_x / 2, sum_y / 2
+        key = (int(sum_x / total // cell_size), int(sum_y / total // cell_size)) if total else (0, 0)
+        if (cell := coarser.get(key)) is None:
+            coarser[key] = [sum_x, sum_y, total]
+        else:
+            cell[0] += sum_x
+            cell[1] += sum_y
+            cell[2] += total
+    return coarser
+
+def _tile_stamps(config, cells, zoom):
+    """
+    Returns {(x, y): [(x, y, level), ...]}: for every tile at `zoom`, the stamps of the cells
+    that reach it, in tile pixel coordinates with an opacity level of 1-255.
+    """
+    extent = config["HEATMAP_RADIUS"] + config["HEATMAP_BLUR"]
+    # Like leaflet.heat, weights fade by half per zoom level below HEATMAP_MAX_ZOOM.
+    scale = 1 / 2 ** max(0, min(config["HEATMAP_MAX_ZOOM"] - zoom, 12)) / config["HEATMAP_MAX_INTENSITY"]
+    min_opacity = config["HEATMAP_MIN_OPACITY"]
+    tiles = {}
+    for sum_x, sum_y, total in cells.values():
+        if total <= 0: continue
+        x, y = sum_x / total, sum_y / total # The cell's point sits at its weighted center.
+        level = round(min(max(total * scale, min_opacity), 1) * 255)
+        if level < 1: continue
+        for tile_x in range(int((x - extent) // TILE_SIZE), int((x + extent) // TILE_SIZE) + 1):
+            for tile_y in range(int((y - extent) // TILE_SIZE), int((y + extent) // TILE_SIZE) + 1):
+                if 0 <= tile_x < 2 ** zoom and 0 <= tile_y < 2 ** zoom:
+                    tiles.setdefault((tile_x, tile_y), []).append(
+                        (x - tile_x * TILE_SIZE, y - tile_y * TILE_SIZE, level))
+    return tiles
+
+def _clear_tile_dir(tile_dir):
+    """Deletes the tiles of a previous run ('<z>/<x>/<y>.png' files only), so no stale tile survives."""
+    if not os.path.isdir(tile_dir): return
+    for z_name in os.listdir(tile_dir):
+        z_dir = os.path.join(tile_dir, z_name)
+        if not (z_name.isdigit() and os.path.isdir(z_dir)): continue
+        for x_name in os.listdir(z_dir):
+            x_dir = os.path.join(z_dir, x_name)
+            if not (x_name.isdigit() and os.path.isdir(x_dir)): continue
+            for name in os.listdir(x_dir):
+                if name.endswith('.png') and name[:-4].isdigit():
+                    os.remove(os.path.join(x_dir, name))
+            with contextlib.suppress(OSError): os.rmdir(x_dir)
+        with contextlib.suppress(OSError): os.rmdir(z_dir)
+
+@_metered_phase("raster")
+def render_raster_tiles(config, points):
+    """
+    Renders the heatmap of `points` into RASTER_TILE_DIR (next to the HTML file) for zooms
+    RASTER_MIN_ZOOM to RASTER_MAX_ZOOM, in PARALLEL_WORKERS processes. Fully transparent
+    tiles are not written. Returns the tile layer description for the page.
+    """
+    tile_dir = os.path.join(os.path.dirname(os.path.abspath(config["HTML_OUTPUT_FILE"])), config["RASTER_TILE_DIR"])
+    min_zoom, max_zoom = config["RASTER_MIN_ZOOM"], config["RASTER_MAX_ZOOM"]
+    radius, blur = int(config["HEATMAP_RADIUS"]), int(config["HEATMAP_BLUR"])
+    palette = _gradient_palette(config["HEATMAP_GRADIENT"])
+    workers = _worker_count(config)
+    print(f"\n[INFO] Rendering raster tiles for zooms {min_zoom}-{max_zoom} into '{tile_dir}'...")
+    _clear_tile_dir(tile_dir)
+
+    # Points are binned once at the deepest zoom; each coarser level merges the cells of the previous one.
+    cell_size = (radius + blur) / 2
+    cells = _heat_cells(points, max_zoom, cell_size)
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    written = 0
+    try:
+        for zoom in range(max_zoom, min_zoom - 1, -1):
+            if zoom < max_zoom:
+                cells = _coarser_heat_cells(cells, cell_size)
+            tiles = _tile_stamps(config, cells, zoom)
+            tasks = [(os.path.join(tile_dir, str(zoom), str(x), f"{y}.png"), stamps, radius, blur, palette)
+                     for (x, y), stamps in tiles.items()]
+            results = executor.map(_render_tile, tasks, chunksize=8) if executor else map(_render_tile, tasks)
+            level_written = sum(results)
+            written += level_written
+            print(f"  [PROGRESS] Zoom {zoom:2d}: {level_written:,} tiles rendered.")
+    finally:
+        if executor: executor.shutdown()
+    METRICS.note(points=len(points), tiles=written)
+    print(f"  > {written:,} tiles written.")
+    return {
+        "url": "/".join([*config["RASTER_TILE_DIR"].replace(os.sep, "/").rstrip("/").split("/"), "{z}", "{x}", "{y}.png"]),
+        "minZoom": min_zoom,
+        "maxZoom": max_zoom,
+    }
+
+# The template is split once into alternating literal text and placeholder names.
+TEMPLATE_PLACEHOLDER_REGEX = re.compile(r"%\((\w+)\)s")
+HTML_TEMPLATE_PARTS = TEMPLATE_PLACEHOLDER_REGEX.split(HTML_TEMPLATE)
+HTML_WRITE_BUFFER_SIZE = 1024 * 1024
+
+def _write_template(file_handle, parts, values):
+    """Writes split template `parts`, substituting placeholders with strings or iterables of strings."""
+    for i, part in enumerate(parts):
+        if i % 2 == 0:
+            file_handle.write(part)
+            continue
+        value = values[part]
+        if isinstance(value, str):
+            file_handle.write(value)
+        else:
+            for piece in value:
+                file_handle.write(piece)
+
+def _build_data_blocks(config, points):
+    """
+    Splits the points into the (metadata, PointBuffer) blocks the page selects from.
+    Returns (blocks, period_labels). With the time slider every period gets its own blocks,
+    tagged with the period's index 't' in period_labels.
+    """
+    if not (config["TIME_SLIDER"] and points.with_timestamps):
+        if config["ZOOM_PYRAMID"]:
+            return build_zoom_pyramid(config, points), []
+        return [({}, points)], []
+
+    period = config["TIME_BLOCK_PERIOD"]
+    starts, periods, undated = build_time_index(config, points)
+    print(f"[INFO] Time slider: {len(starts):,} {period}s from {period_label(period, starts[0]) if starts else '-'} "
+          f"to {period_label(period, starts[-1]) if starts else '-'} ({len(undated):,} points without a timestamp).")
+    blocks = []
+    for meta, block in [({}, undated)] + [({"t": i}, block) for i, block in enumerate(periods)]:
+        if not block: continue
+        if config["ZOOM_PYRAMID"]:
+            blocks.extend((dict(tile, **meta), tile_points) for tile, tile_points in build_zoom_pyramid(config, block, report=False))
+        else:
+            blocks.append((meta, block))
+    return blocks, [period_label(period, start) for start in starts]
+
+@_metered_phase("html")
+def create_html_file(config, points):
+    """Generates the final HTML file, injecting all data and configurations (or rendering raster tiles)."""
+    print("\n--- [PHASE 2/3] Generating Interactive HTML File ---")
+    output_file = config["HTML_OUTPUT_FILE"]
+    print(f"[INFO] Creating '{output_file}' with live controls...")
+
+    if config["RASTER_TILES"]:
+        # The page only shows the rendered tiles; it embeds no points at all.
+        raster_tiles = render_raster_tiles(config, points)
+        values = _page_values(config, "", [], raster_tiles=raster_tiles)
+    else:
+        # Values for every placeholder in the template. The point data is a generator of text
+        # pieces, so the page is streamed to disk without ever holding it whole in memory.
+        blocks, period_labels = _build_data_blocks(config, points)
+        values = _page_values(config, _iter_block_tags(blocks, config), period_labels)
+    with open(output_file, 'w', encoding='utf-8', buffering=HTML_WRITE_BUFFER_SIZE) as f:
+        _write_template(f, HTML_TEMPLATE_PARTS, values)
+    file_size_kb = os.path.getsize(output_file) / 1024
+    METRICS.note(points=len(points), output_bytes=os.path.getsize(output_file))
+    print(f"[SUCCESS] File '{output_file}' generated ({file_size_kb:.2f} KB).")
+
+def _page_values(config, data_blocks, period_labels, points_url=None, raster_tiles=None):
+    """
+    Values for every placeholder of the template. `data_blocks` is the HTML of the embedded
+    block tags (a string or an iterable of pieces); with a `points_url` the page
+    fetches the blocks in view from that endpoint instead. `raster_tiles` describes a
+    pre-rendered tile layer ({'url', 'minZoom', 'maxZoom'}) to show.
+    """
+    # Prepare initial heatmap options for JavaScript injection.
+    heatmap_options_js = json.dumps({
+        "radius": config["HEATMAP_RADIUS"],
+        "blur": config["HEATMAP_BLUR"],
+        "max": config["HEATMAP_MAX_INTENSITY"],
+        "maxZoom": config["HEATMAP_MAX_ZOOM"],
+        "minOpacity": config["HEATMAP_MIN_OPACITY"],
+        "gradient": config["HEATMAP_GRADIENT"]
+    })
+    
+    # Pass the map style dictionaries to JavaScript.
+    map_styles_js = json.dumps(MAP_STYLE_URLS)
+    map_attributions_js = json.dumps(MAP_ATTRIBUTIONS)
+
+    return {
+        "DATA_BLOCKS": data_blocks,
+        "TIME_PERIODS": json.dumps(period_labels),
+        "POINTS_URL": json.dumps(points_url),
+        "RASTER_TILES": json.dumps(raster_tiles),
+        "HEATMAP_OPTIONS": heatmap_options_js,
+        "MAP_CENTER": str(config["MAP_INITIAL_CENTER"]),
+        "MAP_ZOOM": str(config["MAP_INITIAL_ZOOM"]),
+        "INITIAL_MAP_STYLE": config["MAP_STYLE"],
+        "MAP_STYLES_JS": map_styles_js,
+        "MAP_ATTRIBUTIONS_JS": map_attributions_js,
+    }
+
+def open_in_browser(config):
+    """Opens the generated HTML file in the default web browser."""
+    if not config["AUTO_OPEN_IN_BROWSER"]: return
+    print("\n--- [PHASE 3/3] Visualization ---")
+    file_name = config["HTML_OUTPUT_FILE"]
+    print(f"[INFO] Opening '{file_name}' in your default browser...")
+    absolute_path = os.path.abspath(file_name)
+    webbrowser.open(f"file://{absolute_path}")
+
+# --- Serve mode ---
+# Instead of embedding every point, a local server keeps the zoom pyramid in memory and
+# answers viewport queries, so the page starts instantly whatever the size of the history.
+
+class TileIndex:
+    """
+    Spatial index over zoom pyramid blocks, keyed by (zoom, tile zoom, tile y, tile x). A viewport query
+    only touches the tiles it overlaps. Each block is encoded once, on its first request.
+    """
+
+    def __init__(self, blocks, config):
+        self.config = config
+        self.tiles = {}
+        self.tile_zooms = {} # Pyramid zoom -> tile zooms its blocks use (one per time slider period at most).
+        for meta, points in blocks:
+            self.tiles.setdefault((meta["z"], meta["tz"], meta["ty"], meta["tx"]), []).append((meta, points))
+            self.tile_zooms.setdefault(meta["z"], set()).add(meta["tz"])
+        self.zooms = sorted(self.tile_zooms)
+        self._encoded = {}
+
+    def query(self, west, south, east, north, zoom, periods=None):
+        """
+        Returns the blocks of the finest pyramid level not finer than `zoom` that overlap the
+        bounding box (in degrees), limited to the (first, last) period indexes when given.
+        """
+        if not self.zooms: return []
+        level = max((z for z in self.zooms if z <= zoom), default=self.zooms[0])
+        keys = []
+        for tile_zoom in sorted(self.tile_zooms[level]):
+            size = 360 / 2 ** tile_zoom
+            ty_range = range(math.floor(max(south, -90) / size), math.floor(min(north, 90) / size) + 1)
+            tx_range = range(math.floor(max(west, -180) / size), math.floor(min(east, 180) / size) + 1)
+            if len(ty_range) * len(tx_range) <= len(self.tiles):
+                keys += [(level, tile_zoom, ty, tx) for ty in ty_range for tx in tx_range]
+            else: # A huge box at a fine level: scanning the tiles that exist is cheaper.
+                keys += [key for key in self.tiles if key[:2] == (level, tile_zoom) and key[2] in ty_range and key[3] in tx_range]
+        blocks = []
+        for key in keys:
+            for meta, points in self.tiles.get(key, ()):
+                if periods is None or "t" not in meta or periods[0] <= meta["t"] <= periods[1]:
+                    blocks.append((meta, points))
+        return blocks
+
+    def encode(self, blocks):
+        """The blocks as the JSON array the page decodes."""
+        pieces = []
+        for meta, points in blocks:
+            key = (meta["z"], meta["ty"], meta["tx"], meta.get("t"))
+            if (text := self._encoded.get(key)) is None:
+                text = self._encoded[key] = "".join(_iter_block_js(meta, points, self.config))
+            pieces.append(text)
+        return "[" + ",".join(pieces) + "]"
+
+class _HeatmapRequestHandler(BaseHTTPRequestHandler):
+    """Serves the page at '/' and viewport queries at '/points?bbox=west,south,east,north&zoom=z[&periods=a,b]'."""
+    page = ""         # Set on the subclass built by serve_heatmap.
+    index = None
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path in ("/", "/index.html"):
+            self._send(200, "text/html; charset=utf-8", self.page)
+        elif url.path == "/points":
+            try:
+                params = parse_qs(url.query)
+                west, south, east, north = (float(v) for v in params["bbox"][0].split(","))
+                zoom = int(params.get("zoom", ["0"])[0])
+                periods = [int(v) for v in params["periods"][0].split(",")] if "periods" in params else None
+                # float() accepts 'nan' and 'inf', which no tile range can be computed from.
+                if not all(map(math.isfinite, (west, south, east, north))):
+                    raise ValueError("bbox values must be finite")
+                if periods is not None and len(periods) != 2:
+                    raise ValueError("periods takes a first and a last period")
+            except (KeyError, ValueError):
+                self._send(400, "application/json", json.dumps({"error": "Expected bbox=west,south,east,north (finite degrees), zoom=z and optionally periods=first,last."}))
+                return
+            blocks = self.index.query(west, south, east, north, zoom, periods)
+            self._send(200, "application/json", self.index.encode(blocks))
+        else:
+            self._send(404, "text/plain", "Not found")
+
+    def _send(self, status, content_type, text):
+        body = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        if len(body) > 1024 and "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body, compresslevel=5)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # Keep the console for the script's own messages.
+
+def serve_heatmap(config):
+    """
+    Extracts and aggregates the points, indexes their zoom pyramid and serves the map on
+    SERVE_HOST:SERVE_PORT until interrupted. The page fetches the points in view on every move.
+    """
+    _, points = load_aggregated_points(config)
+    if points is None:
+        print("\n[EXECUTION FINISHED] No data was extracted, nothing to serve.")
+        return
+    # The index is the pyramid; aggregation above keeps its finest level small.
+    blocks, period_labels = _build_data_blocks(dict(config, ZOOM_PYRAMID=True), points)
+    index = TileIndex(blocks, config)
+    page = io.StringIO()
+    _write_template(page, HTML_TEMPLATE_PARTS, _page_values(config, "", period_labels, points_url="points"))
+
+    handler = type("HeatmapRequestHandler", (_HeatmapRequestHandler,), {"page": page.getvalue(), "index": index})
+    server = ThreadingHTTPServer((config["SERVE_HOST"], config["SERVE_PORT"]), handler)
+    host, port = server.server_address[:2]
+    url = f"http://{'localhost' if host in ('0.0.0.0', '127.0.0.1') else host}:{port}/"
+    print(f"\n[SUCCESS] Serving {len(points):,} weighted points in {len(index.tiles):,} tiles at {url} (Ctrl+C to stop).")
+    if config["AUTO_OPEN_IN_BROWSER"]:
+        webbrowser.open(url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n[INFO] Server stopped.")
+    finally:
+        server.server_close()
+
+# --- Library API and command line ---
+# The phase functions above only read the config dict they are given, so other code can
+# import this module and run them on explicit configs built with make_config().
+
+def make_config(overrides=None, **settings):
+    """
+    Returns a copy of CONFIG with `overrides` (a dict) and keyword `settings` applied.
+    Unknown keys raise KeyError and invalid choices ValueError, so a misspelled setting
+    cannot pass silently.
+    """
+    config = dict(CONFIG)
+    for key, value in {**(overrides or {}), **settings}.items():
+        if key not in config:
+            raise KeyError(f"Unknown setting '{key}'.")
+        config[key] = value
+    if config["TIME_BLOCK_PERIOD"] not in TIME_BLOCK_PERIODS:
+        raise ValueError(f"Unknown TIME_BLOCK_PERIOD '{config['TIME_BLOCK_PERIOD']}' (expected 'month' or 'week').")
+    return config
+
+def load_locations(config):
+    """Phase 1: the points of the input file, merged into the history store when HISTORY_STORE_DIR is set."""
+    if config["HISTORY_STORE_DIR"]:
+        return update_history(config)
+    return extract_locations(config)
+
+def load_aggregated_points(config):
+    """
+    Phase 1 and aggregation: returns (number of extracted points, aggregated PointBuffer),
+    or (0, None) if there are none. Under MEMORY_LIMIT_MB the points of the input file are
+    binned as they are parsed, with the same result in bounded memory; with PIPELINE too,
+    in a chain of threads. The extracted points are also written to EXPORT_FILES.
+    """
+    if _bins_while_parsing(config):
+        points = extract_binned(config)
+    else:
+        if (config["MEMORY_LIMIT_MB"] or config["PIPELINE"]) and grid_cell_size_e7(config) is None:
+            print("[WARNING] MEMORY_LIMIT_MB and PIPELINE need AGGREGATION_GRID (e.g. 'pixel'); all points are kept in memory.")
+        points = load_locations(config)
+        if points: export_points(config, points)
+    if not points: return 0, None
+    return len(points), aggregate_points(config, points)
+
+class _IterationClosed(BaseException):
+    """
+    Stops the parser thread of iter_locations once its consumer is gone. Not an Exception,
+    so the record handlers do not take it for a bad record.
+    """
+
+class _ChunkFeed(_ChunkBatcher):
+    """
+    Parse target of iter_locations: writes each chunk of points to `exports` and puts it on
+    the bounded `chunks` queue for the consumer. Once the `closed` event is set, adding
+    points raises _IterationClosed.
+    """
+    def __init__(self, config, exports, chunks, closed):
+        super().__init__(config)
+        self._exports = exports
+        self._chunks = chunks
+        self._closed = closed
+
+    def _send(self, points):
+        if self._closed.is_set(): raise _IterationClosed()
+        _write_exports(self._exports, points)
+        self._chunks.put(points)
+
+def _iter_parsed_chunks(config):
+    """
+    Parses the input file in a thread and yields its points as PointBuffer chunks as they
+    are extracted, writing them to EXPORT_FILES on the way. Nothing is cached, as the raw
+    points are never all held.
+    """
+    chunks = queue.Queue(maxsize=max(1, config["PIPELINE_QUEUE_CHUNKS"]))
+    closed = threading.Event()
+    errors = []
+    def parse():
+        try:
+            with _open_exports(config) as exports:
+                feed = _ChunkFeed(config, exports, chunks, closed)
+                _parse_input_file(config, target=feed)
+                feed.flush()
+        except _IterationClosed:
+            pass
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            chunks.put(None)
+    thread = threading.Thread(target=parse, name="parse", daemon=True)
+    thread.start()
+    points = None
+    try:
+        while (points := chunks.get()) is not None:
+            yield points
+    finally:
+        closed.set()
+        while points is not None: # Unblocks the parser thread, which then stops.
+            points = chunks.get()
+        thread.join()
+    if errors: raise errors[0]
+
+def iter_locations(config):
+    """
+    Yields the points of `config`'s input as (lat, lon, timestamp_ms) tuples in decimal
+    degrees, before aggregation, chunk by chunk as the file is parsed, so they are never all
+    in memory. Points come from the parse cache or the history store (HISTORY_STORE_DIR)
+    instead when those hold them. The points are also written to EXPORT_FILES. Timestamps
+    are 0 unless TIME_SLIDER, HISTORY_STORE_DIR or EXPORT_FILES keeps them.
+    """
+    if config["HISTORY_STORE_DIR"]:
+        points = update_history(config)
+        if points is None: return
+    else:
+        points = _load_cache_entry(config, _cache_entry_path(config))
+    if points is not None:
+        export_points(config, points)
+        chunks = points.iter_chunks()
+    else:
+        print(f"[INFO] Streaming the points of '{config['JSON_INPUT_FILE']}'...")
+        chunks = (chunk for points in _iter_parsed_chunks(config) for chunk in points.iter_chunks())
+    for lat, lon, ts, _ in chunks:
+        timestamps = ts if ts is not None else repeat(0)
+        for lat_e7, lon_e7, timestamp in zip(lat, lon, timestamps):
+            yield (lat_e7 / 1e7, lon_e7 / 1e7, timestamp)
+
+def build_heatmap(config):
+    """
+    Runs every phase for one export (extraction, aggregation, HTML) with an explicit
+    config. Returns a summary dict (files, point counts, metrics report), or None when
+    no points were extracted. The metrics report is also saved to METRICS_REPORT_FILE.
+    """
+    global METRICS
+    METRICS = RunMetrics()
+    result = None
+    point_count, aggregated = load_aggregated_points(config)
+    if aggregated is not None:
+        create_html_file(config, aggregated)
+        result = {
+            "input_file": config["JSON_INPUT_FILE"],
+            "output_file": config["HTML_OUTPUT_FILE"],
+            "export_files": list(config["EXPORT_FILES"]),
+            "points": point_count,
+            "weighted_points": len(aggregated),
+            "metrics": METRICS.report(),
+        }
+    if config["METRICS_REPORT_FILE"]:
+        METRICS.save(config["METRICS_REPORT_FILE"], config)
+        print(f"\n[INFO] Metrics report saved to '{config['METRICS_REPORT_FILE']}'.")
+    return result
+
+def _batch_job(config):
+    """
+    Worker entry point of batch mode: builds one heatmap with its output redirected to a
+    log file next to the HTML. Never raises, so one bad export cannot stop the batch.
+    """
+    started = time.perf_counter()
+    log_file = os.path.splitext(config["HTML_OUTPUT_FILE"])[0] + ".log"
+    summary = {"input_file": config["JSON_INPUT_FILE"], "log_file": log_file}
+    with open(log_file, 'w', encoding='utf-8') as log, contextlib.redirect_stdout(log):
+        try:
+            result = build_heatmap(config)
+        except Exception as e:
+            traceback.print_exc(file=log)
+            summary.update(status="failed", error=f"{type(e).__name__}: {e}")
+        else:
+            if result is None:
+                summary.update(status="no data", error="No location points were extracted.")
+            else:
+                del result["metrics"]
+                summary.update(result, status="ok")
+    summary["elapsed_s"] = round(time.perf_counter() - started, 2)
+    return summary
+
+def _run_isolated(job_config):
+    """Reruns a job whose worker process died in a pool of its own, so it can only take itself down."""
+    try:
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            return executor.submit(_batch_job, job_config).result()
+    except BrokenProcessPool:
+        return {"input_file": job_config["JSON_INPUT_FILE"], "status": "failed",
+                "error": "The worker process died (out of memory?)."}
+
+def _export_name(path):
+    """File name of an export without its extensions, e.g. 'Records' for 'Records.json.gz'."""
+    name = os.path.basename(path)
+    for extension in (".gz", ".zst", ".zip", ".json"):
+        if name.lower().endswith(extension):
+            name = name[:-len(extension)]
+    return name
+
+def _export_names(paths):
+    """
+    Output names of the exports in `paths` (see _export_name), made unique: exports that
+    share a name, like 'Records.json' and 'Records.json.gz', get a numeric suffix after the
+    first ('Records-2'). Names differing only in case also count as the same, as they
+    would overwrite each other on case-insensitive file systems.
+    """
+    names, taken = [], set()
+    for path in paths:
+        name = base = _export_name(path)
+        suffix = 1
+        while name.lower() in taken:
+            suffix += 1
+            name = f"{base}-{suffix}"
+        if name != base:
+            print(f"[WARNING] '{os.path.basename(path)}' has the same output name as another export. Its files are named '{name}'.")
+        taken.add(name.lower())
+        names.append(name)
+    return names
+
+def run_batch(config, input_dir, output_dir, workers=None, pattern="*.json"):
+    """
+    Builds one heatmap per export in `input_dir` matching `pattern`, in a pool of at most
+    `workers` processes (one per CPU core by default) that is reused across exports.
+    Each export gets '<name>.html' and '<name>.log' in `output_dir` (plus '<name>.csv' etc.
+    for EXPORT_FILES, and its own history store under HISTORY_STORE_DIR, if set); a failing
+    export is reported and skipped.
+    Returns the per-export summaries, also saved to 'batch_summary.json'.
+    """
+    inputs = sorted(path for path in glob.glob(os.path.join(input_dir, pattern)) if os.path.isfile(path))
+    if not inputs:
+        print(f"[ERROR] No files matching '{pattern}' in '{input_dir}'.")
+        return []
+    os.makedirs(output_dir, exist_ok=True)
+    workers = max(1, min(workers or os.cpu_count() or 1, len(inputs)))
+
+    job_configs = []
+    for input_file, name in zip(inputs, _export_names(inputs)):
+        job_config = dict(config,
+            JSON_INPUT_FILE=input_file,
+            HTML_OUTPUT_FILE=os.path.join(output_dir, name + ".html"),
+            AUTO_OPEN_IN_BROWSER=False,
+            PARALLEL_WORKERS=1, # The batch pool already uses the cores.
+        )
+        if config["HISTORY_STORE_DIR"]:
+            job_config["HISTORY_STORE_DIR"] = os.path.join(config["HISTORY_STORE_DIR"], name)
+        if config["METRICS_REPORT_FILE"]:
+            job_config["METRICS_REPORT_FILE"] = os.path.join(output_dir, name + ".metrics.json")
+        if config["PROFILE_OUTPUT_FILE"]:
+            job_config["PROFILE_OUTPUT_FILE"] = os.path.join(output_dir, name + ".prof")
+        if config["EXPORT_FILES"]:
+            job_config["EXPORT_FILES"] = [os.path.join(output_dir, name + os.path.splitext(path)[1]) for path in config["EXPORT_FILES"]]
+        job_configs.append(job_config)
+
+    print(f"[INFO] Processing {len(inputs)} exports from '{input_dir}' with {workers} worker processes...")
+    summaries, crashed = [], []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_batch_job, job_config): job_config for job_config in job_configs}
+        for future in as_completed(futures):
+            try:
+                summary = future.result()
+            except BrokenProcessPool:
+                # A dying worker fails every job still in the pool; those are rerun one by one below.
+                crashed.append(futures[future])
+                continue
+            summaries.append(summary)
+            _report_batch_job(summary, len(summaries), len(inputs))
+    for job_config in crashed:
+        summaries.append(_run_isolated(job_config))
+        _report_batch_job(summaries[-1], len(summaries), len(inputs))
+
+    summaries.sort(key=lambda summary: summary["input_file"])
+    failed = sum(summary["status"] != "ok" for summary in summaries)
+    with open(os.path.join(output_dir, "batch_summary.json"), 'w', encoding='utf-8') as f:
+        json.dump(summaries, f, indent=2)
+    print(f"\n[INFO] Batch complete: {len(summaries) - failed} heatmaps generated, {failed} failed. "
+          f"Summary saved to '{os.path.join(output_dir, 'batch_summary.json')}'.")
+    return summaries
+
+def _report_batch_job(summary, done, total):
+    name = os.path.basename(summary["input_file"])
+    if summary["status"] == "ok":
+        print(f"  [PROGRESS] {done}/{total} '{name}': {summary['points']:,} points -> "
+              f"'{summary['output_file']}' ({summary['elapsed_s']:.1f} s)")
+    else:
+        print(f"  [WARNING] {done}/{total} '{name}' {summary['status']}: {summary['error']}")
+
+def _parse_settings(assignments):
+    """Turns KEY=VALUE strings into config overrides; values are JSON, or plain strings otherwise."""
+    settings = {}
+    for assignment in assignments:
+        key, separator, value = assignment.partition("=")
+        if not separator:
+            raise argparse.ArgumentTypeError(f"expected KEY=VALUE, got '{assignment}'")
+        try:
+            settings[key] = json.loads(value)
+        except ValueError:
+            settings[key] = value
+    return settings
+
+def _build_argument_parser():
+    parser = argparse.ArgumentParser(description="Generates an interactive heatmap from Google location history exports.")
+    commands = parser.add_subparsers(dest="command", metavar="COMMAND")
+    settings_help = "Overrides a CONFIG setting, e.g. --set MAP_STYLE=Dark or --set TIME_SLIDER=true. Repeatable."
+
+    generate = commands.add_parser("generate", help="Build the heatmap of one export (the default without a command).")
+    generate.add_argument("input", nargs="?", help="The exported JSON file (default: CONFIG's JSON_INPUT_FILE).")
+    generate.add_argument("-o", "--output", help="The HTML file to write (default: CONFIG's HTML_OUTPUT_FILE).")
+    generate.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help=settings_help)
+    generate.add_argument("--export", action="append", default=[], metavar="FILE",
+                          help="Also write the points to FILE (.csv, .geojson or .points). Repeatable.")
+    generate.add_argument("--no-open", action="store_true", help="Do not open the result in the browser.")
+
+    batch = commands.add_parser("batch", help="Build one heatmap per export in a directory, in a process pool.")
+    batch.add_argument("input_dir", help="Directory holding the exports.")
+    batch.add_argument("-o", "--output-dir", default="heatmaps", help="Where to write the heatmaps and logs (default: heatmaps).")
+    batch.add_argument("-j", "--workers", type=int, default=0, help="Worker processes (default: one per CPU core).")
+    batch.add_argument("--pattern", default="*.json", help="Which files of the directory to process (default: *.json).")
+    batch.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help=settings_help)
+
+    serve = commands.add_parser("serve", help="Serve the map locally, loading only the points in view.")
+    serve.add_argument("input", nargs="?", help="The exported JSON file (default: CONFIG's JSON_INPUT_FILE).")
+    serve.add_argument("--host", help="Address to listen on (default: CONFIG's SERVE_HOST).")
+    serve.add_argument("--port", type=int, help="Port to listen on (default: CONFIG's SERVE_PORT).")
+    serve.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help=settings_help)
+    serve.add_argument("--no-open", action="store_true", help="Do not open the map in the browser.")
+
+    clear = commands.add_parser("clear-cache", help="Delete the parse cache (CONFIG's CACHE_DIR).")
+    clear.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help=settings_help)
+    return parser
+
+def main(argv=None):
+    """Main function that orchestrates the entire script execution."""
+    parser = _build_argument_parser()
+    args = parser.parse_args(argv)
+    try:
+        config = make_config(_parse_settings(getattr(args, "set", [])))
+    except (KeyError, ValueError, argparse.ArgumentTypeError) as e:
+        parser.error(e.args[0])
+
+    if args.command == "clear-cache":
+        clear_cache(config)
+        return
+    if args.command == "batch":
+        summaries = run_batch(config, args.input_dir, args.output_dir, args.workers, args.pattern)
+        sys.exit(0 if summaries and all(summary["status"] == "ok" for summary in summaries) else 1)
+
+    if getattr(args, "input", None): config["JSON_INPUT_FILE"] = args.input
+    if getattr(args, "output", None): config["HTML_OUTPUT_FILE"] = args.output
+    if getattr(args, "no_open", False): config["AUTO_OPEN_IN_BROWSER"] = False
+    if getattr(args, "export", None): config["EXPORT_FILES"] = config["EXPORT_FILES"] + args.export
+    if unknown := [path for path in config["EXPORT_FILES"] if os.path.splitext(path)[1].lower() not in EXPORT_FORMATS]:
+        parser.error(f"Unknown export format of {', '.join(unknown)} (expected {', '.join(EXPORT_FORMATS)}).")
+    if args.command == "serve":
+        if args.host: config["SERVE_HOST"] = args.host
+        if args.port is not None: config["SERVE_PORT"] = args.port
+        serve_heatmap(config)
+        return
 
-def main():
-    """Main function that orchestrates the entire script execution."""
     print("="*60)
     print(">>> HEATMAP GENERATOR SCRIPT STARTING <<<")
     print("="*60)
-    location_points = extract_locations(CONFIG)
-    if location_points:
-        create_html_file(CONFIG, location_points)
-        open_in_browser(CONFIG)
+    if build_heatmap(config):
+        open_in_browser(config)
     else:
         print("\n[EXECUTION FINISHED] No data was extracted, HTML file not generated.")
     print("\n" + "="*60)
@@ -548,4 +4093,4 @@ def main():
     print("="*60)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
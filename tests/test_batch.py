@@ -0,0 +1,27 @@
+import gzip
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import generate_heatmap  # noqa: E402
+
+
+def test_exports_with_the_same_name_get_their_own_outputs(tmp_path):
+    input_dir = tmp_path / "exports"
+    input_dir.mkdir()
+    for name, count in (("Records.json", 3), ("Records.json.gz", 5)):
+        text = json.dumps({"locations": [{"latitudeE7": 100 * i, "longitudeE7": 200} for i in range(count)]}, indent=1)
+        data = text.encode("utf-8")
+        (input_dir / name).write_bytes(gzip.compress(data) if name.endswith(".gz") else data)
+    config = generate_heatmap.make_config(CACHE_DIR=None)
+    summaries = generate_heatmap.run_batch(config, str(input_dir), str(tmp_path / "maps"), workers=1, pattern="Records.json*")
+    outputs = {os.path.basename(s["input_file"]): (os.path.basename(s["output_file"]), s["points"]) for s in summaries}
+    assert outputs == {"Records.json": ("Records.html", 3), "Records.json.gz": ("Records-2.html", 5)}
+    assert os.path.isfile(tmp_path / "maps" / "Records.html") and os.path.isfile(tmp_path / "maps" / "Records-2.html")
+
+
+def test_export_names_are_unique_ignoring_case():
+    paths = ["in/a.json", "in/a.json.gz", "in/A.zip", "in/a-2.json", "in/b.json.zst"]
+    assert generate_heatmap._export_names(paths) == ["a", "a-2", "A-3", "a-2-2", "b"]
@@ -0,0 +1,48 @@
+import csv
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import generate_heatmap  # noqa: E402
+
+RECORDS = [
+    {"latitudeE7": 515000000 + 37 * i, "longitudeE7": -1234567 * (i % 5), "timestamp": "2024-03-01T12:00:%02d.%03dZ" % (i % 60, i * 7 % 1000)}
+    for i in range(120)
+] + [{"latitudeE7": -337000000, "longitudeE7": 1512000000}]  # No timestamp.
+
+
+def _read_csv(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        return [(float(row["latitude"]), float(row["longitude"]), generate_heatmap._parse_timestamp(row["timestamp"] or None))
+                for row in csv.DictReader(f)]
+
+
+def _read_geojson(path):
+    with open(path, encoding="utf-8") as f:
+        features = json.load(f)["features"]
+    return [(f["geometry"]["coordinates"][1], f["geometry"]["coordinates"][0], generate_heatmap._parse_timestamp(f["properties"]["timestamp"]))
+            for f in features]
+
+
+def _read_points(path):
+    rows = []
+    for lat, lon, ts, _ in generate_heatmap.load_points(path).iter_chunks():
+        rows += [(a / 1e7, b / 1e7, t) for a, b, t in zip(lat, lon, ts)]
+    return rows
+
+
+@pytest.mark.parametrize("settings", [{}, {"PIPELINE": True, "AGGREGATION_GRID": "pixel"}])
+def test_exports_hold_the_same_points(tmp_path, settings):
+    input_file = tmp_path / "Records.json"
+    input_file.write_text(json.dumps({"locations": RECORDS}, indent=1), encoding="utf-8")
+    exports = [str(tmp_path / name) for name in ("out.csv", "out.geojson", "out.points")]
+    config = generate_heatmap.make_config(JSON_INPUT_FILE=str(input_file), EXPORT_FILES=exports, CACHE_DIR=None, **settings)
+    generate_heatmap.load_aggregated_points(config)
+    expected = [(r["latitudeE7"] / 1e7, r["longitudeE7"] / 1e7, generate_heatmap._parse_timestamp(r.get("timestamp"))) for r in RECORDS]
+    assert _read_csv(exports[0]) == expected
+    assert _read_geojson(exports[1]) == expected
+    assert _read_points(exports[2]) == expected
@@ -0,0 +1,47 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import generate_heatmap  # noqa: E402
+
+
+def _export(tmp_path, name, readings):
+    """A Records.json-style export of (latitudeE7, longitudeE7, epoch ms) readings."""
+    records = [{"latitudeE7": lat, "longitudeE7": lon, "timestamp": str(ts)} for lat, lon, ts in readings]
+    path = tmp_path / name
+    path.write_text(json.dumps({"locations": records}, indent=1), encoding="utf-8")
+    return str(path)
+
+
+def _stored(tmp_path, export_path):
+    config = generate_heatmap.make_config(JSON_INPUT_FILE=export_path, HISTORY_STORE_DIR=str(tmp_path / "history"), CACHE_DIR=None)
+    points = generate_heatmap.update_history(config)
+    return sorted(key for lat, lon, ts, _ in points.iter_chunks() for key in zip(ts, lat, lon))
+
+
+def test_overlapping_exports_are_stored_once(tmp_path):
+    first = [(100, 200, 1000 + i) for i in range(10)]
+    # The second export repeats the last five readings, and adds one twice and one out of order.
+    second = first[5:] + [(300, 400, 2000), (300, 400, 2000), (100, 200, 1003)]
+    expected = sorted((ts, lat, lon) for lat, lon, ts in first + [(300, 400, 2000)] * 2)
+    assert _stored(tmp_path, _export(tmp_path, "a.json", first)) == sorted((ts, lat, lon) for lat, lon, ts in first)
+    assert _stored(tmp_path, _export(tmp_path, "b.json", second)) == expected
+    # Merging either export again changes nothing.
+    assert _stored(tmp_path, _export(tmp_path, "c.json", list(reversed(second)))) == expected
+
+
+def test_history_segments_stay_sorted_after_compaction(tmp_path):
+    readings = [(i % 7, i % 3, 5000 - i // 2) for i in range(300)]
+    for n, start in enumerate(range(0, 300, 60)):
+        _stored(tmp_path, _export(tmp_path, "export-%d.json" % n, readings[start:start + 90]))
+    store_dir = str(tmp_path / "history")
+    manifest = generate_heatmap._load_history_manifest(store_dir)
+    keys = []
+    for segment in manifest["formats"]["locations"]["segments"]:
+        lat, lon, ts, _ = generate_heatmap._load_point_columns(os.path.join(store_dir, segment["file"]))
+        segment_keys = list(zip(ts, lat, lon))
+        assert segment_keys == sorted(segment_keys)
+        keys.extend(segment_keys)
+    assert sorted(keys) == sorted((ts, lat, lon) for lat, lon, ts in readings)
@@ -0,0 +1,46 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import generate_heatmap  # noqa: E402
+
+COUNTERS = ("records_seen", "records_skipped", "points_extracted", "points_emitted", "bytes_read")
+
+
+def _build(tmp_path, records, **settings):
+    input_file = tmp_path / "Records.json"
+    input_file.write_text(json.dumps({"locations": records}, indent=1), encoding="utf-8")
+    report_file = tmp_path / "metrics.json"
+    config = generate_heatmap.make_config(
+        JSON_INPUT_FILE=str(input_file), HTML_OUTPUT_FILE=str(tmp_path / "map.html"), METRICS_REPORT_FILE=str(report_file),
+        CACHE_DIR=None, AUTO_OPEN_IN_BROWSER=False, **settings)
+    generate_heatmap.build_heatmap(config)
+    with open(report_file, encoding="utf-8") as f:
+        return json.load(f), os.path.getsize(input_file)
+
+
+def test_report_counts_records_points_and_phases(tmp_path):
+    records = [{"latitudeE7": 100 + i, "longitudeE7": 200} for i in range(20)] + [{"bad": 1}, {"latitudeE7": "x", "longitudeE7": 1}]
+    report, input_bytes = _build(tmp_path, records)
+    assert [phase["phase"] for phase in report["phases"]] == ["extract", "aggregate", "html"]
+    assert report["phases"][0]["points"] == 20
+    parser = report["parsers"]["locations"]
+    assert {key: parser[key] for key in COUNTERS} == {
+        "records_seen": 22, "records_skipped": 1, "points_extracted": 20, "points_emitted": 20, "bytes_read": input_bytes,
+    }
+
+
+@pytest.mark.parametrize("thinning", [False, True])
+def test_parallel_counters_match_sequential(tmp_path, thinning):
+    records = [{"latitudeE7": 400000000 + (i // 40) * 5000, "longitudeE7": 100, "timestamp": str(1700000000000 + i * 10000)}
+               for i in range(2000)]
+    sequential, _ = _build(tmp_path, records, THINNING=thinning)
+    parallel, _ = _build(tmp_path, records, THINNING=thinning, PARALLEL_WORKERS=2, PARALLEL_SHARD_SIZE_MB=16 / 1024)
+    # bytes_read differs: shards only cover the record array, not the document around it.
+    counters = [{key: report["parsers"]["locations"][key] for key in COUNTERS[:-1]} for report in (sequential, parallel)]
+    assert counters[0] == counters[1]
+    assert (counters[0]["points_emitted"] < 2000) == thinning
@@ -0,0 +1,55 @@
+import base64
+import json
+import os
+import sys
+import zlib
+from array import array
+from itertools import accumulate
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import generate_heatmap  # noqa: E402
+from generate_heatmap import PointBuffer  # noqa: E402
+
+
+def _decode_block(text):
+    """Decodes a block served as JSON the way the page's decodePoints does, to [lat, lon, weight] rows."""
+    block = json.loads(text)
+    if block["encoding"] != "binary":
+        return [[p[0], p[1], p[2] if len(p) > 2 else 1] for p in block["points"]]
+    data = base64.b64decode(block["points"])
+    if block["deflate"]:
+        data = zlib.decompress(data)
+    n = block["count"]
+    coords = array('i', data[:8 * n])
+    weights = array('f', data[8 * n:]) if block["weighted"] else [1] * n
+    if sys.byteorder == 'big':
+        coords.byteswap()
+        if block["weighted"]: weights.byteswap()
+    # Undo the deltas with int32 wrap-around, like the page's Int32Array.
+    lat, lon = (accumulate(column, lambda a, b: (a + b + 2**31) % 2**32 - 2**31) for column in (coords[:n], coords[n:]))
+    return [[a / 1e7, b / 1e7, w] for a, b, w in zip(lat, lon, weights)]
+
+
+def _points(weighted, count):
+    lat = array('i', ((i * 7919) % 1800000000 - 900000000 for i in range(count)))
+    # Longitudes jump back and forth across the antimeridian, past the int32 delta range.
+    lon = array('i', ((1799999999 if i % 2 else -1799999999) - i for i in range(count)))
+    weight = array('d', (0.25 * (i % 9 + 1) for i in range(count))) if weighted else None
+    return PointBuffer.from_columns(lat, lon, None, weight)
+
+
+@pytest.mark.parametrize("weighted", [False, True])
+@pytest.mark.parametrize("compression", [False, True])
+@pytest.mark.parametrize("count", [0, 1, 5, PointBuffer.CHUNK_SIZE + 3])
+def test_binary_payload_decodes_to_the_json_points(weighted, compression, count):
+    points = _points(weighted, count)
+    meta = {"z": 3}
+    as_json = "".join(generate_heatmap._iter_block_js(meta, points, generate_heatmap.make_config(POINT_ENCODING="json")))
+    config = generate_heatmap.make_config(POINT_ENCODING="binary", POINT_COMPRESSION=compression)
+    as_binary = "".join(generate_heatmap._iter_block_js(meta, points, config))
+    assert json.loads(as_binary)["count"] == count
+    assert _decode_block(as_binary) == _decode_block(as_json)
+    assert len(_decode_block(as_json)) == count
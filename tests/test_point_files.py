@@ -0,0 +1,53 @@
+import json
+import os
+import sys
+from array import array
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import generate_heatmap  # noqa: E402
+from generate_heatmap import PointBuffer, load_points, save_points  # noqa: E402
+
+
+def _rows(points):
+    return [
+        (list(lat), list(lon), None if ts is None else list(ts), None if weight is None else list(weight))
+        for lat, lon, ts, weight in points.iter_chunks()
+    ]
+
+
+@pytest.mark.parametrize("with_timestamps", [False, True])
+@pytest.mark.parametrize("with_weights", [False, True])
+@pytest.mark.parametrize("count", [0, 1, PointBuffer.CHUNK_SIZE + 1])
+def test_point_file_round_trip(tmp_path, with_timestamps, with_weights, count):
+    points = PointBuffer(with_timestamps=with_timestamps, with_weights=with_weights)
+    for i in range(count):
+        points.append_e7(-900000000 + i * 13, 1799999999 - i * 7, 1700000000000 + i, 0.5 + i % 4)
+    path = str(tmp_path / "points.points")
+    save_points(path, points)
+    loaded = load_points(path)
+    assert (loaded.with_timestamps, loaded.with_weights) == (with_timestamps, with_weights)
+    assert len(loaded) == count
+    assert _rows(loaded) == _rows(points)
+
+
+def test_load_points_rejects_other_files(tmp_path):
+    path = tmp_path / "other.points"
+    path.write_bytes(b"not a point file".ljust(64, b"\0"))
+    with pytest.raises(ValueError):
+        load_points(str(path))
+
+
+def test_parse_cache_returns_the_parsed_points(tmp_path, monkeypatch):
+    records = [{"latitudeE7": 100 + i, "longitudeE7": 200 - i, "timestamp": str(1700000000000 + i)} for i in range(50)]
+    input_file = tmp_path / "Records.json"
+    input_file.write_text(json.dumps({"locations": records}, indent=1), encoding="utf-8")
+    config = generate_heatmap.make_config(JSON_INPUT_FILE=str(input_file), CACHE_DIR=str(tmp_path / "cache"), TIME_SLIDER=True)
+    parsed = generate_heatmap.extract_locations(config)
+    assert len(os.listdir(tmp_path / "cache")) >= 1
+    monkeypatch.setattr(generate_heatmap, "_parse_input_file", lambda *args, **kwargs: pytest.fail("cache not used"))
+    cached = generate_heatmap.extract_locations(config)
+    assert _rows(cached) == _rows(parsed)
+    assert [lat for chunk in _rows(cached) for lat in chunk[0]] == [r["latitudeE7"] for r in records]
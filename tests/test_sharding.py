@@ -0,0 +1,140 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import generate_heatmap  # noqa: E402
+from generate_heatmap import find_array_shards  # noqa: E402
+
+
+def _write(tmp_path, text):
+    path = tmp_path / "records.json"
+    path.write_bytes(text.encode("utf-8"))
+    return str(path)
+
+
+def _shard_items(path, shard_size):
+    """Parses every shard on its own and returns {format_name: [items of each shard]}."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    return {
+        format_name: [json.loads(b'[' + data[start:end] + b']') for start, end in ranges]
+        for format_name, ranges in find_array_shards(path, shard_size)
+    }
+
+
+def _joined(shards):
+    return [item for shard in shards for item in shard]
+
+
+def _records_document(records, key="locations"):
+    """One record per line, the way Takeout writes them."""
+    return '{\n  "%s": [\n' % key + ",\n".join("    " + json.dumps(r) for r in records) + "\n  ]\n}\n"
+
+
+def test_string_escapes_do_not_move_boundaries(tmp_path, monkeypatch):
+    monkeypatch.setattr(generate_heatmap, "SCAN_BLOCK_SIZE", 64)
+    records = [
+        {"i": i, "note": 'quote \\" then ]}, [{ and "x" ' * (i % 3), "path": "C:\\dir\\"}
+        for i in range(200)
+    ]
+    path = _write(tmp_path, _records_document(records))
+    shards = _shard_items(path, 256)["locations"]
+    assert len(shards) > 1
+    assert _joined(shards) == records
+
+
+def test_nested_brackets_spanning_lines(tmp_path, monkeypatch):
+    monkeypatch.setattr(generate_heatmap, "SCAN_BLOCK_SIZE", 100)
+    records = [{"i": i, "path": [[i, [j, {"k": [j]}]] for j in range(i % 4)], "meta": {"a": {"b": []}}} for i in range(150)]
+    text = json.dumps({"before": {"locations": [1]}, "semanticSegments": records, "after": [[]]}, indent=2)
+    path = _write(tmp_path, text)
+    shards = _shard_items(path, 300)
+    assert list(shards) == ["semanticSegments"]
+    assert len(shards["semanticSegments"]) > 1
+    assert _joined(shards["semanticSegments"]) == records
+
+
+def test_root_array(tmp_path, monkeypatch):
+    monkeypatch.setattr(generate_heatmap, "SCAN_BLOCK_SIZE", 50)
+    records = [{"timestamp": "2024-01-01T00:00:%02dZ" % (i % 60), "point": "geo:1,%d" % i} for i in range(100)]
+    path = _write(tmp_path, "[\n" + ",\n".join(json.dumps(r) for r in records) + "\n]\n")
+    shards = _shard_items(path, 200)["root_array"]
+    assert len(shards) > 1
+    assert _joined(shards) == records
+
+
+@pytest.mark.parametrize("block_size", range(1, 80))
+def test_cut_at_every_block_edge(tmp_path, monkeypatch, block_size):
+    # Sweeping the block size puts a block end on every byte of a record line,
+    # including exactly on the line end after a record's closing bracket.
+    monkeypatch.setattr(generate_heatmap, "SCAN_BLOCK_SIZE", block_size)
+    records = [{"i": i, "v": [i]} for i in range(40)]
+    body = "\n,".join(json.dumps(r) for r in records)  # Separators at the start of the next line.
+    path = _write(tmp_path, '{"timelineObjects": [\n' + body + "\n]}\n")
+    shards = _shard_items(path, block_size)["timelineObjects"]
+    assert _joined(shards) == records
+
+
+def test_shards_smaller_than_a_scan_block(tmp_path):
+    records = [{"i": i, "pad": "x" * 50} for i in range(1000)]
+    path = _write(tmp_path, _records_document(records))
+    shard_size = 8 * 1024
+    shards = _shard_items(path, shard_size)["locations"]
+    assert os.path.getsize(path) < generate_heatmap.SCAN_BLOCK_SIZE
+    assert len(shards) >= os.path.getsize(path) // shard_size - 1
+    assert _joined(shards) == records
+
+
+def test_minified_file_is_not_shardable(tmp_path, monkeypatch):
+    monkeypatch.setattr(generate_heatmap, "SCAN_BLOCK_SIZE", 64)
+    path = _write(tmp_path, json.dumps({"locations": [{"i": i} for i in range(100)]}))
+    with pytest.raises(ValueError):
+        find_array_shards(path, 128)
+
+
+def _track_records(count):
+    """A track of stops and straight runs, one reading every 30 s."""
+    records = []
+    lat, lon = 400000000, -30000000
+    for i in range(count):
+        if (i // 25) % 2:  # Moving, with a little sideways jitter.
+            lat += 3000
+            lon += 2000 + (i % 5) * 300
+        records.append({"latitudeE7": lat, "longitudeE7": lon + (i % 3), "timestamp": str(1700000000000 + i * 30000)})
+    return records
+
+
+def _extracted_columns(path, **settings):
+    config = generate_heatmap.make_config(JSON_INPUT_FILE=path, CACHE_DIR=None, **settings)
+    points = generate_heatmap.extract_locations(config)
+    return [tuple(None if column is None else column.tolist() for column in chunk) for chunk in points.iter_chunks()]
+
+
+def test_parallel_thinning_matches_sequential(tmp_path):
+    path = _write(tmp_path, _records_document(_track_records(3000)))
+    shard_size_mb = 16 / 1024
+    assert os.path.getsize(path) > 4 * shard_size_mb * 1024 * 1024
+    sequential = _extracted_columns(path, THINNING=True)
+    parallel = _extracted_columns(path, THINNING=True, PARALLEL_WORKERS=2, PARALLEL_SHARD_SIZE_MB=shard_size_mb)
+    assert sum(len(chunk[0]) for chunk in sequential) < 3000
+    assert parallel == sequential
+
+
+@pytest.mark.parametrize("key", ["locations", "root_array"])
+def test_parallel_parse_matches_sequential(tmp_path, key):
+    records = _track_records(2000)
+    if key == "root_array":
+        records = [{"startTime": r["timestamp"], "visit": {"topCandidate": {"placeLocation": "geo:%s,%s" % (r["latitudeE7"] / 1e7, r["longitudeE7"] / 1e7)}}}
+                   for r in records]
+        text = "[\n" + ",\n".join(json.dumps(r) for r in records) + "\n]\n"
+    else:
+        text = _records_document(records)
+    path = _write(tmp_path, text)
+    sequential = _extracted_columns(path, TIME_SLIDER=True)
+    parallel = _extracted_columns(path, TIME_SLIDER=True, PARALLEL_WORKERS=2, PARALLEL_SHARD_SIZE_MB=16 / 1024)
+    assert sum(len(chunk[0]) for chunk in sequential) == 2000
+    assert parallel == sequential